@@ -0,0 +1,90 @@
+'''An in-memory write-through copy of today's attendance rows and the employee directory.'''
+import threading
+
+
+'''A class that answers the per-event lookups of the attendance tracker from memory.'''
+class AttendanceCache():
+    def __init__(self):
+        """
+        Initialize an empty cache. It is filled by Database with one bulk query per table.
+        """
+        self.table = None
+        self.rows = None
+        self.employees = None
+        self.lock = threading.RLock()
+
+    def is_loaded(self, table):
+        """
+        Check whether the cache holds the rows of a day table.
+
+        Args:
+            table (str): The day table.
+
+        Returns:
+            bool: True if the rows of the table and the employee directory are loaded.
+        """
+        with self.lock:
+            return self.rows is not None and self.employees is not None and self.table == table
+
+    def load(self, table, rows, employees):
+        """
+        Replace the cached data.
+
+        Args:
+            table (str): The day table the rows belong to.
+            rows (list): Every row of the day table as (name, employee_id, entry_time, exit_time).
+            employees (list): Every row of the employee table as (name, employee_id).
+        """
+        with self.lock:
+            self.table = table
+            self.rows = {}
+            for row in rows:
+                self.rows.setdefault(row[0], tuple(row))
+            self.employees = {}
+            for employee in employees:
+                self.employees.setdefault(employee[0], tuple(employee))
+
+    def invalidate(self):
+        """
+        Forget everything, so that the next lookup loads the data again.
+        """
+        with self.lock:
+            self.table = None
+            self.rows = None
+            self.employees = None
+
+    def get_row(self, name):
+        """
+        Get the attendance row of a person.
+
+        Returns:
+            tuple: The row, or None if the person has no row today.
+        """
+        with self.lock:
+            return self.rows.get(name) if self.rows is not None else None
+
+    def get_employee(self, name):
+        """
+        Get the employee table row of a person.
+
+        Returns:
+            tuple: The row, or None if the person is not registered.
+        """
+        with self.lock:
+            return self.employees.get(name) if self.employees is not None else None
+
+    def put_row(self, row):
+        """
+        Store an attendance row that was written to the database.
+        """
+        with self.lock:
+            if self.rows is not None:
+                self.rows[row[0]] = tuple(row)
+
+    def put_employee(self, name, employee_id):
+        """
+        Store an employee that was written to the database.
+        """
+        with self.lock:
+            if self.employees is not None:
+                self.employees.setdefault(name, (name, employee_id))
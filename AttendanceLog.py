@@ -0,0 +1,145 @@
+'''Incremental presence intervals and daily totals folded from the append-only attendance event log.'''
+import datetime
+import threading
+
+
+def parse_timestamp(value):
+    """
+    Convert a timestamp read from the database to a datetime.
+
+    Args:
+        value: A datetime as returned by MySQL, or an ISO string as stored by SQLite.
+
+    Returns:
+        datetime.datetime: The timestamp.
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, bytes):
+        value = value.decode()
+    return datetime.datetime.fromisoformat(str(value))
+
+
+'''A class that keeps everyone's presence intervals per day up to date one event at a time.'''
+class PresenceLog():
+    def __init__(self):
+        """
+        Initialize an empty log. Days are loaded from the event table by Database before their
+        first new event is applied, so that the intervals continue where the last run stopped.
+        """
+        self.days = {}
+        self.lock = threading.RLock()
+
+    def is_loaded(self, day):
+        with self.lock:
+            return day in self.days
+
+    def load(self, day, events):
+        """
+        Rebuild a day from its logged events.
+
+        Args:
+            day (datetime.date): The day.
+            events (list): The day's events as (name, camera_id, kind, timestamp), oldest first.
+        """
+        with self.lock:
+            self.days[day] = {}
+            for name, camera_id, kind, timestamp in events:
+                self.apply(name, camera_id, kind, parse_timestamp(timestamp))
+
+    def copy(self):
+        """
+        Get an independent copy, so that a batch can be folded in and thrown away if it is not committed.
+
+        Returns:
+            PresenceLog: The copy.
+        """
+        with self.lock:
+            copy = PresenceLog()
+            copy.days = {day: {name: {'cameras': set(person['cameras']), 'last': dict(person['last']),
+                                      'intervals': [list(interval) for interval in person['intervals']]}
+                               for name, person in people.items()}
+                         for day, people in self.days.items()}
+            return copy
+
+    def forget(self, before):
+        """
+        Drop the days before a date, which no longer get new events.
+
+        Args:
+            before (datetime.date): The first day that is kept.
+        """
+        with self.lock:
+            for day in [day for day in self.days if day < before]:
+                del self.days[day]
+
+    def apply(self, name, camera_id, kind, timestamp):
+        """
+        Fold an event into the presence of a person. A person is present while at least one camera
+        sees them, so an interval opens with the first camera's entry and closes with the last
+        camera's exit. Presence does not carry over midnight, each day starts with nobody present.
+        Events older than the last one of the same person and camera were already applied and are
+        skipped, so replaying a batch never counts it twice.
+
+        Args:
+            name (str): The person.
+            camera_id (str): The camera the event was seen on.
+            kind (str): 'entry' or 'exit'.
+            timestamp (datetime.datetime): When it happened.
+
+        Returns:
+            bool: True if the event changed the person's presence.
+        """
+        with self.lock:
+            people = self.days.setdefault(timestamp.date(), {})
+            person = people.get(name)
+            if person is None:
+                person = people[name] = {'cameras': set(), 'last': {}, 'intervals': []}
+
+            last = person['last'].get(camera_id)
+            if last is not None and (timestamp < last[0] or (timestamp == last[0] and kind == last[1])):
+                return False
+            person['last'][camera_id] = (timestamp, kind)
+
+            cameras = person['cameras']
+            if kind == 'entry':
+                if camera_id in cameras:
+                    return False
+                if not cameras:
+                    person['intervals'].append([timestamp, None])
+                cameras.add(camera_id)
+            else:
+                if camera_id not in cameras:
+                    return False
+                cameras.discard(camera_id)
+                if not cameras:
+                    person['intervals'][-1][1] = timestamp
+            return True
+
+    def intervals(self, name, day):
+        """
+        Get the presence intervals of a person on a day.
+
+        Returns:
+            List: (start, end) datetimes, end is None while the person is still present.
+        """
+        with self.lock:
+            person = self.days.get(day, {}).get(name)
+            return [tuple(interval) for interval in person['intervals']] if person is not None else []
+
+    def summary(self, name, day):
+        """
+        Get the daily summary of a person as it is stored in the summary table.
+
+        Returns:
+            Tuple: (name, day, first entry, last exit, present seconds, visits, open since). The times
+            are datetime.time, the last exit and open since are None where there is none. Present
+            seconds and visits only count closed intervals.
+        """
+        intervals = self.intervals(name, day)
+        closed = [(start, end) for start, end in intervals if end is not None]
+        first_entry = intervals[0][0].time() if intervals else None
+        last_exit = closed[-1][1].time() if closed else None
+        seconds = int(sum((end - start).total_seconds() for start, end in closed))
+        open_since = intervals[-1][0].time() if intervals and intervals[-1][1] is None else None
+        return (name, day, first_entry, last_exit, seconds, len(closed), open_since)
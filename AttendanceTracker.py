@@ -1,19 +1,45 @@
 import face_recognition
-from FaceRec import FaceReco
-import mysql.connector
+from FaceRec import FaceReco, downscale_frame, upscale_boxes
 import time
 import datetime
 import cv2
 from Database import Database
-import GUI
+from AttendanceWriter import AttendanceWriter
+from Pipeline import MultiSourcePipeline
+from Tracker import FaceTracker
+from Presence import PresenceFilter, track_observations
+from Metrics import METRICS
 from ultralytics import YOLO
 
 
 class AttendanceTracker:
-    def __init__(self, database, face_recog):
+    def __init__(self, database, face_recog, model_path='yolov8n.pt', face_model=False, detection_scale=1.0,
+                 detection_roi=None, exit_frames=10, exit_seconds=None, entry_votes=1.5):
+        """
+        The initialization function
+        :param database: the database attendance is recorded in
+        :param face_recog: the face recognition system
+        :param model_path: the YOLO weights used for detection
+        :param face_model: True if class 0 of the model is a face. The default COCO model detects
+                people, so faces are looked up inside the person boxes before encoding
+        :param detection_scale: factor frames are shrunk by before YOLO runs, boxes are mapped back to full resolution
+        :param detection_roi: optional x1, y1, x2, y2 region of the frame to run YOLO on
+        :param exit_frames: consecutive processed frames a person has to be missing before they exit, None to only use
+                exit_seconds. Camera frames dropped while processing was busy do not count
+        :param exit_seconds: seconds a person has to be missing before they exit, None to only use exit_frames
+        :param entry_votes: confidence-weighted recognitions a person needs within a few frames before they enter
+        """
         self.database = database
         self.facerecog = face_recog
-        self.model = YOLO('yolov8n.pt')
+        self.model = YOLO(model_path)
+        self.refine_detections = not face_model
+        self.detection_scale = detection_scale
+        self.detection_roi = detection_roi
+        self.presence_options = {'exit_frames': exit_frames, 'exit_seconds': exit_seconds, 'entry_votes': entry_votes}
+        self.writer = AttendanceWriter(database)
+        self.pipeline = None
+        self.present = {}
+        self._stop_requested = False
 
     def download_csv_data(self):
         """
@@ -22,116 +48,204 @@ class AttendanceTracker:
         """
         self.database.export_to_csv()
 
-    def update_times(self, entered=None, exited=None):
-        try:
-            entryTime = entered[-1]
-            enteredNames = entered[0:-1]
-            # print(enteredNames)
-            for name in enteredNames:
-                # print(name)
-                exist = self.database.select_from_table(name)
-                employee_table_name = 'table_employees'
-                employee_info = self.database.select_from_table(name, employee_table_name)
-                if not exist:
-                    self.database.insert_into_table(name, employee_info[0][1], entryTime)
-                # print(exist)
-                if exist[0][2] == None:
-                    self.database.update_times(exist[0][0], entryTime, exist[0][3])
-        except:
-            pass
-        try:
-            exitTime = exited[-1]
-            exitedNames = exited[0:-1]
-            for ename in exitedNames:
-                eexist = self.database.select_from_table(ename)
-                # print(eexist)
-                self.database.update_times(eexist[0][0], eexist[0][2], exitTime)
-        except:
-            pass
+    def update_times(self, entered=None, exited=None, camera_id=None):
+        """
+        Records the entry and exit times of people. The events are handed to the background
+        writer, so a slow database never holds up the camera loop
+        :param entered: the names that entered followed by the entry time
+        :param exited: the names that exited followed by the exit time
+        :param camera_id: the camera the events were seen on
+        :return:
+        """
+        if entered:
+            self.writer.submit('entry', entered[0:-1], entered[-1], camera_id)
+        if exited:
+            self.writer.submit('exit', exited[0:-1], exited[-1], camera_id)
 
     def add_new_person(self, name, employeeID):
         """
         add a new person to the database
         :return:
         """
+        # create_data adds only the new face to the known faces
         self.facerecog.create_data(name)
-        self.facerecog.create_known_faces()
         # self.database.insert_into_table(name, employeeID, None)
         self.database.insert_into_employee_table(name, employeeID)
 
-    def detect_faces_and_count(self):
+    def reset_stop(self):
+        """
+        Forgets an earlier stop. Call it when a new detection loop is scheduled, before its thread
+        starts, so that a stop arriving while the loop is still loading the known faces is kept
+        :return:
+        """
+        self._stop_requested = False
+
+    def stop(self):
+        """
+        Stops a running detection loop after the frame it is working on, or a scheduled one before
+        it starts. Safe to call from any thread
+        :return:
+        """
+        self._stop_requested = True
+        if self.pipeline is not None:
+            self.pipeline.stop()
+
+    def status(self):
+        """
+        Reports the state of the detection loop
+        :return: a dictionary with whether it is running, its frame counters, the writer backlog
+                 and the names currently present on every camera
+        """
+        pipeline = self.pipeline
+        return {
+            'running': pipeline is not None,
+            'frames_processed': pipeline.frames_processed if pipeline is not None else 0,
+            'dropped_frames': pipeline.dropped_frames if pipeline is not None else 0,
+            'events_pending': len(self.writer),
+            'events_committed': self.writer.committed,
+            'write_failures': self.writer.failures,
+            'present': {str(camera_id): sorted(names) for camera_id, names in self.present.items()},
+        }
+
+    def detect_faces_and_count(self, source=0, reverify_every=None, display=True, preview=None):
+        """
+        Detects and recognizes faces in a video stream and records who enters and exits.
+        Camera reads, detection/recognition and rendering/recording run on separate threads
+        connected by bounded queues, so a slow stage never stalls the camera.
+        Detections are tracked between frames and recognition only runs for new tracks,
+        so the identity of a person stays attached to their track in between.
+        :param source: camera index, video file, stream URL or image directory to read frames from
+        :param reverify_every: frames after which a recognized track is recognized again, None never re-verifies
+        :param display: show the frames in a window, False runs headless without drawing anything
+        :param preview: called as preview(camera_id, frame, names) with every annotated frame and the names
+                 present in it, for example to show the frames inside a GUI instead of an OpenCV window
+        :return:
+        """
+        self.detect_faces_multi({None: source}, reverify_every, display, preview)
+
+    def detect_faces_multi(self, sources, reverify_every=None, display=True, preview=None):
+        """
+        Detects and recognizes faces in several video streams with one shared YOLO model.
+        Every camera is read on its own thread and the newest frames of all cameras are
+        detected in a single batched YOLO call. Tracking and entry/exit events are kept per
+        camera and tagged with its camera ID.
+        :param sources: a dictionary of camera ID to source, or a list of sources whose camera IDs are their positions
+        :param reverify_every: frames after which a recognized track is recognized again, None never re-verifies
+        :param display: show the frames in windows, False runs headless without drawing anything
+        :param preview: called as preview(camera_id, frame, names) with every annotated frame and the names
+                 present in it. It runs on the pipeline thread and should hand the frame off quickly
+        :return:
+        """
+        if not isinstance(sources, dict):
+            sources = dict(enumerate(sources))
+
         self.facerecog.create_known_faces()
-        old_names = []
-        # Open the default webcam (usually index 0)
-        cap = cv2.VideoCapture(0)
-        OnFaces = 0
+        trackers = {camera_id: FaceTracker(reverify_every=reverify_every) for camera_id in sources}
+        tolerance = self.facerecog.gallery.tolerance
+        presence = {camera_id: PresenceFilter(tolerance=tolerance, **self.presence_options) for camera_id in sources}
+        self.present = {camera_id: set() for camera_id in sources}
 
         def is_face(class_id):
             # Define the class index for "face" in the YOLO model's class list
             face_class_index = 0
             return class_id == face_class_index
 
-        while True:
-            nFaces = 0
-            new_names = []
-            ret, frame = cap.read()
-
-            if not ret:
-                break
-
-            # Predict using the YOLO model
-            results = self.model(frame)
-
-            # Access the detected boxes and class IDs
-            boxes = results[0].boxes.xyxy
-            classIDs = results[0].boxes.cls
-
-            # Loop through the detected objects and draw bounding boxes around faces
-            for box, classID in zip(boxes, classIDs):
-                if is_face(classID):
-                    x1, y1, x2, y2 = box
-                    cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 0, 255), 2)
-                    nFaces += 1
-
-            cv2.putText(frame, "Number of faces: " + str(nFaces), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255),
+        def process(batch):
+            # Predict on the downscaled frames of every camera with one YOLO call
+            downscaled = [downscale_frame(frame, self.detection_scale, self.detection_roi) for _, frame in batch]
+            with METRICS.timer('yolo'):
+                results = self.model([small_frame for small_frame, _ in downscaled])
+
+            outputs = []
+            for (camera_id, frame), result, (_, offset) in zip(batch, results, downscaled):
+                tracker = trackers[camera_id]
+
+                # Access the detected boxes and class IDs, mapped back to full resolution
+                boxes = result.boxes.xyxy
+                classIDs = result.boxes.cls
+                faces = [box for box, classID in zip(boxes, classIDs) if is_face(classID)]
+                faces = upscale_boxes(faces, self.detection_scale, offset)
+                tracks = tracker.update(faces)
+
+                due = tracker.due(tracks)
+                if due: # If a new person appeared
+                    # face_recognition works on RGB, OpenCV delivers BGR
+                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+                    # Perform face recognition only inside the detections of the new tracks
+                    data = self.facerecog.recognize_faces(rgb_frame, [track.box for track in due],
+                                                          self.refine_detections)
+                    for track, f in zip(due, data):
+                        tracker.identify(track, f[0], f[2])
+
+                outputs.append((faces, track_observations(tracks)))
+            return outputs
+
+        def record_exits(camera_id, exited):
+            # People left when they were last seen, not when the filter gave up waiting for them
+            tag = "" if camera_id is None else f" (camera {camera_id})"
+            exits = {}
+            for name, last_seen in sorted(exited.items()):
+                exits.setdefault(time.strftime("%H:%M:%S", time.localtime(last_seen)), []).append(name)
+            for exit_time, names in exits.items():
+                self.update_times(None, names + [exit_time], camera_id)
+                print(f"Exited{tag}:")
+                print(names + [exit_time])
+
+        def render(camera_id, frame, result):
+            faces, observations = result
+            # Single missed or misrecognized frames do not count as leaving or arriving
+            entered, exited = presence[camera_id].update(observations, time.time())
+            new_names = presence[camera_id].present()
+            tag = "" if camera_id is None else f" (camera {camera_id})"
+
+            entered = list(entered) # The names that have entered
+            if entered:
+                entered.append(time.strftime("%H:%M:%S")) # Add the current time to the list
+                self.update_times(entered, None, camera_id)
+                print(f"Entered{tag}:")
+                print(entered)
+
+            record_exits(camera_id, exited)
+
+            self.present[camera_id] = new_names
+
+            # Headless, nothing to draw
+            if not display and preview is None:
+                return True
+
+            # Draw bounding boxes around faces
+            for x1, y1, x2, y2 in faces:
+                cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 0, 255), 2)
+
+            cv2.putText(frame, "Number of faces: " + str(len(faces)), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255),
                         2)
 
+            if preview is not None:
+                preview(camera_id, frame, new_names)
+            if not display:
+                return True
+
             # Display the frame with the detected faces
-            cv2.imshow('Detected Faces', frame)
+            cv2.imshow('Detected Faces' + tag, frame)
 
             # Press 'q' to exit the loop and close the window
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
-            if not (nFaces == OnFaces): # If the number of faces has changed
-                # Perform face recognition on the frame
-                data = self.facerecog.recognize_faces(frame)
-                for f in data:
-                    new_names.append(f[0])
-                new_names = set(new_names) # Remove duplicates
-                old_names = set(old_names) # Remove duplicates
-                entered = list(new_names - old_names) # Find the names that have entered
-                if entered:
-                    entered.append(time.strftime("%H:%M:%S")) # Add the current time to the list
-                    self.update_times(entered, None)
-                    print("Entered:")
-                    print(entered)
-                else:
-                    entered = None
-
-                exited = list(old_names - new_names)
-                if exited:
-                    exited.append(time.strftime("%H:%M:%S"))
-                    self.update_times(None, exited)
-                    print("Exited:")
-                    print(exited)
-                else:
-                    exited = None
-
-                # Update previous faces with current data
-                old_names = new_names
-
-            OnFaces = nFaces
-
-        # Release the capture and close the window
-        cap.release()
-        cv2.destroyAllWindows()
+            return not (cv2.waitKey(1) & 0xFF == ord('q'))
+
+        self.pipeline = MultiSourcePipeline(sources, process, render)
+        self.writer.start()
+        try:
+            if not self._stop_requested:
+                self.pipeline.run()
+        finally:
+            self.pipeline = None
+            # Everyone still present leaves when the stream ends or the loop is stopped
+            for camera_id, camera_presence in presence.items():
+                record_exits(camera_id, camera_presence.flush())
+                self.present[camera_id] = set()
+            # Write the remaining events before returning
+            self.writer.stop()
+
+        # Close the windows
+        if display:
+            cv2.destroyAllWindows()
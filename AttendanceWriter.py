@@ -0,0 +1,259 @@
+'''A background writer that batches attendance events into the database without blocking the camera loop.'''
+import os
+import json
+import time
+import queue
+import collections
+import threading
+from Metrics import METRICS
+
+
+'''A class that spools attendance events to disk and writes them to the database in batches.'''
+class AttendanceWriter():
+    def __init__(self, database, spool_path='attendance_spool.jsonl', batch_size=100, flush_interval=1.0,
+                 max_backoff=60.0):
+        """
+        Initialize the writer.
+
+        Args:
+            database (Database): The database the events are written to with apply_events.
+            spool_path (str): Append-only file every event is written to before it is queued. How much of
+                it is committed is kept in spool_path + '.offset', so the events after that when the program
+                starts were never committed and are written again. It is started over whenever every
+                event in it is committed.
+            batch_size (int): Number of events that are committed at once at most.
+            flush_interval (float): Seconds an event may wait for the batch to fill up.
+            max_backoff (float): Longest wait in seconds between retries while the database is down.
+        """
+        self.database = database
+        self.spool_path = spool_path
+        self.checkpoint_path = spool_path + '.offset'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.committed = 0
+        self.failures = 0
+        self._queue = queue.Queue()
+        # Spool bytes of every event that is not committed yet, oldest first
+        self._lengths = collections.deque()
+        self._committed_bytes = 0
+        self._lock = threading.Lock()
+        self._spool = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._abort = threading.Event()
+
+    def __len__(self):
+        """The number of events that are not committed yet."""
+        with self._lock:
+            return len(self._lengths)
+
+    def start(self):
+        """
+        Start the background thread. Events left in the spool by an earlier run are queued first.
+        """
+        if self._thread is not None:
+            return
+
+        self._queue = queue.Queue()
+        events, lengths = self._read_spool()
+        self._lengths = collections.deque(lengths)
+        self._spool = open(self.spool_path, 'ab')
+        for event in events:
+            self._queue.put(event)
+        if events:
+            print(f"Replaying {len(events)} attendance events from the spool.")
+
+        METRICS.gauge('attendance_backlog', self.__len__)
+        self._stop.clear()
+        self._abort.clear()
+        self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+        self._thread.start()
+
+    def _read_checkpoint(self):
+        """
+        Read the number of spool bytes that were committed, 0 if it was never written.
+        """
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_checkpoint(self, offset):
+        """
+        Remember how many spool bytes are committed. A crash before it is written only replays
+        events that were already committed, which the event log skips.
+        """
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(str(offset))
+        os.replace(temporary, self.checkpoint_path)
+
+    def _read_spool(self):
+        """
+        Read the events after the committed part of the spool. A last line cut off by a crash is
+        cut from the file, so that new events start on a line of their own.
+
+        Returns:
+            List: The events and the spool bytes of each of them.
+        """
+        try:
+            with open(self.spool_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self._committed_bytes = 0
+            return [], []
+        if data and not data.endswith(b'\n'):
+            data = data[:data.rfind(b'\n') + 1]
+            with open(self.spool_path, 'r+b') as f:
+                f.truncate(len(data))
+
+        self._committed_bytes = self._read_checkpoint()
+        if self._committed_bytes > len(data):
+            self._committed_bytes = 0
+        events = []
+        lengths = []
+        skipped = 0
+        for line in data[self._committed_bytes:].splitlines(keepends=True):
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # The bytes of a broken line are committed together with the next event
+                skipped += len(line)
+                continue
+            lengths.append(len(line) + skipped)
+            skipped = 0
+        self._committed_bytes += skipped
+        return events, lengths
+
+    @staticmethod
+    def _encode(event):
+        return (json.dumps(event) + '\n').encode('utf-8')
+
+    def _commit_spool(self, count):
+        """
+        Move the committed offset past the oldest events of the spool once they are committed.
+        Batches are committed in the order they were submitted, so they are always the oldest.
+        The spool only grows while submit holds the lock, it is started over once it is drained.
+
+        Args:
+            count (int): The number of committed events.
+        """
+        with self._lock:
+            self._committed_bytes += sum(self._lengths.popleft() for _ in range(count))
+            drained = not self._lengths
+        if not drained:
+            self._write_checkpoint(self._committed_bytes)
+            return
+
+        # The checkpoint is reset before the spool is cut, so it never points past what is committed
+        self._write_checkpoint(0)
+        with self._lock:
+            if not self._lengths:
+                self._spool.seek(0)
+                self._spool.truncate()
+                self._committed_bytes = 0
+                return
+        self._write_checkpoint(self._committed_bytes)
+
+    def submit(self, kind, names, event_time, camera_id=None, table=None):
+        """
+        Queue entry or exit events. They are on disk in the spool when this returns. When the writer
+        is not started the events are written to the database right away instead.
+
+        Args:
+            kind (str): 'entry' or 'exit'.
+            names (list): The names the event is for.
+            event_time (str): The time of the event.
+            camera_id: The camera the event was seen on.
+            table (str): The day table the event belongs to. Defaults to the current table of the database.
+        """
+        table = table or self.database.current_table
+        events = [{'kind': kind, 'name': name, 'time': event_time, 'camera_id': camera_id, 'table': table}
+                  for name in names]
+        with self._lock:
+            spooled = self._spool is not None
+            if spooled:
+                for event in events:
+                    line = self._encode(event)
+                    self._spool.write(line)
+                    self._lengths.append(len(line))
+                self._spool.flush()
+        if not spooled:
+            self.database.apply_events(events)
+            self.committed += len(events)
+            return
+        for event in events:
+            self._queue.put(event)
+
+    def _next_batch(self, batch):
+        """
+        Add events to the batch until it is full or the oldest event has waited flush_interval seconds.
+        """
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if self._stop.is_set():
+                timeout = 0
+            try:
+                event = self._queue.get(timeout=max(timeout, 0)) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(event)
+        return batch
+
+    def _run(self):
+        """
+        Commit batches until stopped, retrying failed batches with exponential backoff.
+        """
+        batch = []
+        backoff = 0.5
+        while True:
+            if not batch:
+                try:
+                    batch.append(self._queue.get(timeout=0.1))
+                except queue.Empty:
+                    if self._stop.is_set():
+                        return
+                    continue
+            batch = self._next_batch(batch)
+
+            try:
+                with METRICS.timer('db_write'):
+                    self.database.apply_events(batch)
+            except Exception as e:
+                self.failures += 1
+                METRICS.increment('db_write_failures')
+                print(f"Attendance events not written, retrying in {backoff:.1f}s: {e}")
+                if self._abort.wait(backoff):
+                    return
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = 0.5
+            self.committed += len(batch)
+            METRICS.increment('attendance_events_committed', len(batch))
+            self._commit_spool(len(batch))
+            batch = []
+
+    def stop(self, timeout=10.0):
+        """
+        Stop the background thread after the queued events are written. Events that could not be
+        written within the timeout stay in the spool and are written on the next start.
+
+        Args:
+            timeout (float): Seconds to wait for the remaining events.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self._abort.set()
+            self._thread.join()
+        self._thread = None
+        METRICS.remove_gauge('attendance_backlog')
+        with self._lock:
+            self._spool.close()
+            self._spool = None
@@ -0,0 +1,187 @@
+'''A small bounded pool of persistent database connections with health checks.'''
+import time
+import queue
+import threading
+from contextlib import contextmanager
+
+
+'''A pooled connection together with the statements prepared on it.'''
+class PooledConnection():
+    def __init__(self, connection):
+        """
+        Initialize the pooled connection.
+
+        Args:
+            connection: The underlying DB-API connection.
+        """
+        self.connection = connection
+        self.statements = {}
+        self.last_used = time.monotonic()
+
+    def cursor(self, *args, **kwargs):
+        return self.connection.cursor(*args, **kwargs)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def statement(self, query):
+        """
+        Get a prepared cursor for a query, preparing it on first use. The cursor is kept for as long
+        as the connection lives, so hot statements are only parsed by the server once.
+
+        Args:
+            query (str): The query to prepare.
+
+        Returns:
+            A prepared cursor for the query.
+        """
+        cursor = self.statements.get(query)
+        if cursor is None:
+            cursor = self.connection.cursor(prepared=True)
+            self.statements[query] = cursor
+        return cursor
+
+    def close(self):
+        """
+        Close the connection, ignoring errors from connections that are already broken.
+        """
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+
+'''A class that hands out a bounded number of connections and reconnects broken ones.'''
+class ConnectionPool():
+    def __init__(self, connect, size=5, timeout=30, ping=None, ping_interval=30, connection_errors=(Exception,)):
+        """
+        Initialize the pool. Connections are opened lazily.
+
+        Args:
+            connect (callable): Opens a new connection.
+            size (int): The maximum number of open connections.
+            timeout (float): Seconds to wait for a free connection before giving up.
+            ping (callable): Called as ping(connection) to check a connection that has been idle
+                for ping_interval seconds. It should raise if the connection is dead.
+            ping_interval (float): Idle seconds after which a connection is checked before it is handed out.
+            connection_errors (tuple): Exception types that mean the connection itself is broken.
+                Other errors only roll back the transaction and keep the connection.
+        """
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.ping = ping
+        self.ping_interval = ping_interval
+        self.connection_errors = connection_errors
+        self.opened = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def _open(self):
+        return PooledConnection(self.connect())
+
+    def acquire(self):
+        """
+        Take a connection out of the pool, opening a new one if the pool is not full yet.
+
+        Returns:
+            PooledConnection: A healthy connection.
+        """
+        try:
+            pooled = self._idle.get_nowait()
+        except queue.Empty:
+            pooled = None
+            with self._lock:
+                if self.opened < self.size:
+                    self.opened += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    return self._open()
+                except Exception:
+                    with self._lock:
+                        self.opened -= 1
+                    raise
+            try:
+                pooled = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError("No database connection became free in time.")
+
+        # Check connections that sat idle long enough for the server to have dropped them
+        if self.ping is not None and time.monotonic() - pooled.last_used > self.ping_interval:
+            try:
+                self.ping(pooled.connection)
+            except Exception:
+                pooled.close()
+                try:
+                    return self._open()
+                except Exception:
+                    with self._lock:
+                        self.opened -= 1
+                    raise
+        return pooled
+
+    def release(self, pooled, broken=False):
+        """
+        Give a connection back to the pool.
+
+        Args:
+            pooled (PooledConnection): The connection.
+            broken (bool): True if the connection failed and has to be thrown away.
+        """
+        if broken:
+            pooled.close()
+            with self._lock:
+                self.opened -= 1
+            return
+        pooled.last_used = time.monotonic()
+        self._idle.put(pooled)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with block. If the block fails with a
+        connection error the connection is thrown away, otherwise it is rolled back and returned.
+        """
+        pooled = self.acquire()
+        try:
+            yield pooled
+        except Exception as e:
+            broken = isinstance(e, self.connection_errors)
+            if not broken:
+                try:
+                    pooled.rollback()
+                except Exception:
+                    broken = True
+            self.release(pooled, broken)
+            raise
+        except BaseException:
+            self.release(pooled, broken=True)
+            raise
+        else:
+            self.release(pooled)
+
+    def close(self):
+        """
+        Close every idle connection.
+        """
+        self.discard_idle()
+
+    def discard_idle(self):
+        """
+        Close every idle connection, for example when one of them turned out to be broken and the
+        others most likely went down with the same server. The next acquire opens a new one.
+        """
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            pooled.close()
+            with self._lock:
+                self.opened -= 1
@@ -1,38 +1,394 @@
-import mysql.connector
+import abc
 import datetime
+import numpy as np
+import os
 import csv
+import gzip
+import json
+import re
+import threading
+from contextlib import contextmanager
+from ConnectionPool import ConnectionPool, PooledConnection
+from AttendanceCache import AttendanceCache
+from AttendanceLog import PresenceLog
 
-class Database:
-    def __init__(self, formatted_date):
+try:
+    import mysql.connector
+except ImportError:
+    mysql = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Errors after which a MySQL connection can not be used any more and is replaced
+CONNECTION_ERRORS = ((mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
+                     if mysql is not None else ())
+
+# The table holding every day in the single table schema
+ATTENDANCE_TABLE = "attendance"
+
+# The append-only log of every entry and exit, and the daily presence totals folded from it
+EVENTS_TABLE = "attendance_events"
+SUMMARY_TABLE = "attendance_daily"
+
+# The names of the per-day tables of the daily schema
+DAY_TABLE_PATTERN = re.compile(r"^table_(\d{8})$")
+
+
+def _time_seconds(value):
+    """
+    Converts an entry or exit time to seconds since midnight
+    :param value: a 'HH:MM:SS' string, a timedelta as returned for TIME columns, or None
+    :return: the seconds, or NaN if the time is missing
+    """
+    if value is None or value == '':
+        return np.nan
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, bytes):
+        value = value.decode()
+    hours, minutes, seconds = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _hours_columns(rows):
+    """
+    Turns (name, date, hours) rows into the sorted NumPy columns returned by the hour reports
+    :param rows: the rows, with the date as a datetime.date or an ISO string
+    :return: a dictionary of 'name' (object), 'date' (datetime64[D]) and 'hours' (float64) sorted by name and date
+    """
+    name_column = np.array([row[0] for row in rows], dtype=object)
+    date_column = np.array([str(row[1]) for row in rows], dtype='datetime64[D]')
+    hours = np.array([row[2] for row in rows], dtype=np.float64)
+    order = np.lexsort((date_column, name_column.astype(str)))
+    return {'name': name_column[order], 'date': date_column[order], 'hours': hours[order]}
+
+
+'''The storage interface of the attendance system. It holds everything that does not depend on the
+database server, the subclasses connect to a server and create the tables that need its own SQL.'''
+class StorageBackend(abc.ABC):
+    # Errors after which a connection can not be used any more and is replaced
+    connection_errors = ()
+    # The query listing the tables of the database
+    show_tables_query = "SHOW TABLES"
+
+    def __init__(self, formatted_date, schema='daily'):
+        """
+        The initialization function
+        :param formatted_date: today's date as MMDDYYYY
+        :param schema: 'daily' for one untyped table per day, or 'single' for one typed and indexed
+                attendance table partitioned by month
+        """
         self.config = None
+        self.schema = schema
         self.current_table = f"table_{formatted_date}"
         self.employee_table = "table_employees"
+        self._partitions_from = None
+        self._partitions_until = None
+        self.pool_size = 0
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self.use_cache = True
+        self.cache = AttendanceCache()
+        self.presence = PresenceLog()
+        self._event_tables_ready = False
 
-    def configure_database(self, host='10.152.5.142', port=3306, database='facerecdatabase', user='interns',
-                           password='InternsPassword!'):
+    def _configure(self, config, pool_size, use_cache):
         """
-        Function that configures the database being used
-        :param host: IP address or hostname of the database server
-        :param port: Port number on which the database server is listening
-        :param database: Name of the database to connect to
-        :param user: Username for authentication
-        :param password: Password for the specified username
+        Stores the connection settings and forgets the connections and cached rows of the previous ones
+        :param config: the settings _connect opens connections with
+        :param pool_size: Number of persistent connections kept open. 0 opens a new connection for every query
+        :param use_cache: Serve today's attendance rows and the employee directory from memory
+        :return: void
         """
-        # Configure the database
-        config = {
-            'host': host,
-            'port': port,
-            'database': database,
-            'user': user,
-            'password': password
-        }
-
+        self.close()
         self.config = config
+        self.pool_size = pool_size
+        self.use_cache = use_cache
+        self.cache.invalidate()
+        self.presence = PresenceLog()
+        self._event_tables_ready = False
 
-    def create_employee_table(self, formatted_date=None):
-        conn = mysql.connector.connect(**self.config)
-        cursor = conn.cursor()
+    @abc.abstractmethod
+    def _connect(self):
+        """
+        Opens a new connection with the DB-API of the database server
+        :return: the connection
+        """
+
+    def _ping(self, connection):
+        """
+        Checks a connection that sat idle in the pool, raising if it is dead
+        :param connection: the connection
+        :return: void
+        """
+        pass
+
+    def close(self):
+        """
+        Closes the pooled connections
+        :return: void
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    @contextmanager
+    def _connection(self):
+        """
+        Borrows a connection from the pool, or opens a new one if pooling is turned off
+        :return: a PooledConnection for the duration of the with block
+        """
+        if not self.pool_size:
+            conn = PooledConnection(self._connect())
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+
+        with self._pool_lock:
+            if self.pool is None:
+                self.pool = ConnectionPool(self._connect, self.pool_size, ping=self._ping,
+                                           connection_errors=self.connection_errors)
+        with self.pool.connection() as conn:
+            yield conn
+
+    def _run(self, work):
+        """
+        Runs work(conn) on a connection. If the connection turns out to be broken, for example
+        because the server restarted, it is thrown away together with the idle connections and
+        work is retried once on a newly opened connection.
+        The connection can break after a commit already reached the server, so work that commits
+        has to give the same result when it runs twice. Reads, the CREATE/DROP IF EXISTS statements,
+        the day merge and update_times are. apply_events is for the event log and the summaries,
+        but may insert a person's first row of the day twice. insert_into_employee_table and insert_into_table
+        may insert their row twice
+        :param work: the function doing the queries
+        :return: whatever work returns
+        """
+        try:
+            with self._connection() as conn:
+                return work(conn)
+        except self.connection_errors:
+            # The broken connection is already thrown away, the idle ones most likely died with it
+            if self.pool is not None:
+                self.pool.discard_idle()
+            with self._connection() as conn:
+                return work(conn)
+
+    def _execute(self, query, values=None, fetch=False, commit=False, prepared=False):
+        """
+        Executes a single query
+        :param query: the query to execute
+        :param values: the values for the placeholders of the query
+        :param fetch: True to return all the rows of the result
+        :param commit: True to commit after the query
+        :param prepared: True to run the query as a server side prepared statement that is
+                cached on the connection. Used for the hot statements of the recognition loop
+        :return: the rows if fetch is True, None if not
+        """
+        def work(conn):
+            cursor = conn.statement(query) if prepared else conn.cursor()
+            cursor.execute(query, values)
+            result = cursor.fetchall() if fetch else None
+            if commit:
+                conn.commit()
+            if not prepared:
+                cursor.close()
+            return result
+
+        return self._run(work)
+
+    def _attendance_cache(self):
+        """
+        Gets the cache of today's rows and the employees, loading it with one bulk query per table
+        the first time and again after the day table changed
+        :return: the AttendanceCache, or None if caching is off or the tables could not be read
+        """
+        if not self.use_cache:
+            return None
+
+        with self.cache.lock:
+            if not self.cache.is_loaded(self.current_table):
+                table, where, date_values = self._day_query(self.current_table)
+                select_query = f"SELECT {self._row_columns()} FROM {table}" + (f" WHERE {where}" if where else "")
+
+                def work(conn):
+                    cursor = conn.cursor()
+                    cursor.execute(select_query, date_values or None)
+                    rows = cursor.fetchall()
+                    cursor.execute(f"SELECT name, employee_id FROM {self.employee_table}")
+                    employees = cursor.fetchall()
+                    cursor.close()
+                    return rows, employees
 
+                try:
+                    rows, employees = self._run(work)
+                except Exception:
+                    return None
+                self.cache.load(self.current_table, rows, employees)
+        return self.cache
+
+    def load_cache(self):
+        """
+        Loads today's attendance rows and the employee directory into memory with one bulk query each,
+        so that the recognition loop never has to read from the database
+        :return: True if the cache could be loaded, False if not
+        """
+        self.cache.invalidate()
+        return self._attendance_cache() is not None
+
+    @staticmethod
+    def _table_date(table_name):
+        """
+        Gets the date a day table is for
+        :param table_name: the day table, such as table_05242023
+        :return: the date as a datetime.date
+        """
+        return datetime.datetime.strptime(table_name[len("table_"):], "%m%d%Y").date()
+
+    def _day_query(self, table_name, condition=""):
+        """
+        Works out where the rows of a day live. In the daily schema they are the whole day table,
+        in the single table schema they are the rows of the attendance table with the day's date
+        :param table_name: the day table, such as table_05242023
+        :param condition: a further condition on the rows, such as 'name = %s'
+        :return: the table to query, its WHERE clause (may be empty) and the values of the date placeholders
+        """
+        if self.schema != 'single':
+            return table_name, condition, ()
+        where = " AND ".join(part for part in ("date = %s", condition) if part)
+        return ATTENDANCE_TABLE, where, (self._table_date(table_name),)
+
+    def _row_columns(self):
+        """
+        The columns of an attendance row as (name, employee_id, entry_time, exit_time). Typed times of the
+        single table schema are returned as HH:MM:SS strings like the text columns of the daily schema
+        """
+        if self.schema != 'single':
+            return "name, employee_id, entry_time, exit_time"
+        return "name, employee_id, CAST(entry_time AS CHAR), CAST(exit_time AS CHAR)"
+
+    def _insert_query(self, table_name):
+        """
+        The query that inserts one attendance row into a day
+        :param table_name: the day table
+        :return: the query and the values that follow (name, employee_id, entry_time, exit_time)
+        """
+        table, _, date_values = self._day_query(table_name)
+        if self.schema != 'single':
+            return f"INSERT INTO {table} (name, employee_id, entry_time, exit_time) VALUES (%s, %s, %s, %s)", ()
+        return (f"INSERT INTO {table} (name, employee_id, entry_time, exit_time, date) "
+                f"VALUES (%s, %s, %s, %s, %s)", date_values)
+
+    def _update_query(self, table_name):
+        """
+        The query that sets the entry and exit time of one person on a day
+        :param table_name: the day table
+        :return: the query and the date values that go between (entry_time, exit_time) and the name
+        """
+        table, where, date_values = self._day_query(table_name, "name = %s")
+        return f"UPDATE {table} SET entry_time = %s, exit_time = %s WHERE {where}", date_values
+
+    @abc.abstractmethod
+    def _create_attendance_table(self):
+        """
+        Creates the attendance table of the single table schema, with one row per person and day
+        and indexes for lookups by employee and date
+        :return: void
+        """
+
+    @abc.abstractmethod
+    def _create_event_tables(self):
+        """
+        Creates the event log, with one row per entry or exit, and the daily summary table,
+        with one row per person and day
+        :return: void
+        """
+
+    @abc.abstractmethod
+    def _insert_event_query(self):
+        """
+        The query that appends an event to the log, skipping events that are already logged
+        :return: the query, with placeholders for name, camera_id, kind and ts
+        """
+
+    @abc.abstractmethod
+    def _upsert_summary_query(self):
+        """
+        The query that writes the summary of a person and day, replacing the one stored before
+        :return: the query, with placeholders for the columns of PresenceLog.summary
+        """
+
+    def _ensure_event_tables(self):
+        """
+        Creates the event log and summary tables the first time they are needed
+        :return: void
+        """
+        if not self._event_tables_ready:
+            self._create_event_tables()
+            self._event_tables_ready = True
+
+    def _ensure_partitions(self, day):
+        """
+        Makes sure the attendance table has a partition for a day. Backends without partitions have nothing to do
+        :param day: the date that needs a partition
+        :return: void
+        """
+        pass
+
+    @abc.abstractmethod
+    def _merge_day_query(self, table_name):
+        """
+        The query that merges a day table into the attendance table, keeping the earliest entry and latest exit
+        of the stored and the merged row, whichever order they arrive in. A time that is NULL on one side is
+        taken from the other
+        :param table_name: the day table
+        :return: the query, with a placeholder for the date
+        """
+
+    @abc.abstractmethod
+    def _server_now(self, cursor):
+        """
+        Gets the current time of the database server, in the format of the updated_at column
+        :param cursor: a cursor
+        :return: the time as a string
+        """
+
+    def _table_update_times(self, cursor):
+        """
+        Gets when each table of the database was last changed
+        :param cursor: a cursor
+        :return: a dictionary from table name to the time as a string, or None where it is not known
+        """
+        cursor.execute(self.show_tables_query)
+        return {row[0]: None for row in cursor.fetchall()}
+
+    def migrate_daily_tables(self, drop=False):
+        """
+        Imports every per-day table of the daily schema into the attendance table of the single table
+        schema. Days that were already imported are merged, so the migration can be run again
+        :param drop: drop each day table after it was imported
+        :return: the number of day tables that were imported
+        """
+        self._create_attendance_table()
+        tables = [row[0] for row in self._execute(self.show_tables_query, fetch=True)]
+        day_tables = sorted((self._table_date(table), table) for table in tables if DAY_TABLE_PATTERN.match(table))
+
+        for day, table_name in day_tables:
+            self._ensure_partitions(day)
+            self._execute(self._merge_day_query(table_name), (day,), commit=True)
+            if drop:
+                self._execute(f"DROP TABLE IF EXISTS {table_name}", commit=True)
+            print(f"Imported {table_name}")
+
+        return len(day_tables)
+
+    def create_employee_table(self, formatted_date=None):
         if not formatted_date:
             self.employee_table = f"table_{formatted_date}"
 
@@ -44,8 +400,7 @@ class Database:
             )
         '''
 
-        cursor.execute(create_table_query)
-        conn.close()
+        self._execute(create_table_query)
 
     def insert_into_employee_table(self, name, employee_id):
         """
@@ -54,9 +409,6 @@ class Database:
         :param employee_id: the id of the employee
         :return:
         """
-        conn = mysql.connector.connect(**self.config)
-        cursor = conn.cursor()
-
         # Insert data into table
         insert_query = '''
             INSERT INTO {table_name} (name, employee_id)
@@ -66,10 +418,8 @@ class Database:
         # The values being entered. exit_time is none because the employee has not left yet
         values = (name, employee_id)
 
-        cursor.execute(insert_query.format(table_name=table_name), values)
-        conn.commit()
-
-        conn.close()
+        self._execute(insert_query.format(table_name=table_name), values, commit=True, prepared=True)
+        self.cache.put_employee(name, employee_id)
 
     def create_table(self, date):
         """
@@ -78,25 +428,28 @@ class Database:
                 Dates are written in the format 05242023 which means May 24th, 2023
         :return: True if the table could be created, False if not
         """
-        conn = mysql.connector.connect(**self.config)
-        cursor = conn.cursor()
-
         # Create table
         table_name = f"table_{date}"  # Using string formatting
-        create_table_query = f'''
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                name TEXT,
-                employee_id TEXT,
-                entry_time TEXT,
-                exit_time TEXT
-            )
-        '''
+        if self.schema == 'single':
+            # Every day lives in the attendance table, make sure its month has a partition
+            self._create_attendance_table()
+            self._ensure_partitions(self._table_date(table_name))
+        else:
+            create_table_query = f'''
+                CREATE TABLE IF NOT EXISTS {table_name} (
+                    name TEXT,
+                    employee_id TEXT,
+                    entry_time TEXT,
+                    exit_time TEXT
+                )
+            '''
 
-        cursor.execute(create_table_query)
-        conn.close()
+            self._execute(create_table_query)
+        self._ensure_event_tables()
 
-        # Set the current table
+        # Set the current table, the cached rows of the previous day are reloaded on next use
         self.current_table = table_name
+        self.cache.invalidate()
 
     def insert_into_table(self, name, employee_id, entry_time=None):
         """
@@ -106,22 +459,15 @@ class Database:
         :param entry_time: the entry time of the employee
         :return: True if the table could be created, False if not
         """
-        conn = mysql.connector.connect(**self.config)
-        cursor = conn.cursor()
-
         # Insert data into table
-        insert_query = '''
-            INSERT INTO {table_name} (name, employee_id, entry_time, exit_time)
-            VALUES (%s, %s, %s, %s)
-        '''
         table_name = self.current_table
+        insert_query, date_values = self._insert_query(table_name)
         # The values being entered. exit_time is none because the employee has not left yet
         values = (name, employee_id, entry_time, None)
 
-        cursor.execute(insert_query.format(table_name=table_name), values)
-        conn.commit()
-
-        conn.close()
+        self._execute(insert_query, values + date_values, commit=True, prepared=True)
+        if self.cache.is_loaded(table_name) and self.cache.get_row(name) is None:
+            self.cache.put_row(values)
 
     def update_times(self, name, new_entry_time, new_exit_time):
         """
@@ -131,22 +477,159 @@ class Database:
         :param new_exit_time: the time the employee left
         :return: True if the table could be created, False if not
         """
-        conn = mysql.connector.connect(**self.config)
-        cursor = conn.cursor()
-
         # Update entry and exit time
-        update_query = '''
-            UPDATE {table_name}
-            SET entry_time = %s, exit_time = %s
-            WHERE name = %s
-        '''
         table_name = self.current_table
-        values = (new_entry_time, new_exit_time, name)
+        update_query, date_values = self._update_query(table_name)
+        values = (new_entry_time, new_exit_time) + date_values + (name,)
+
+        self._execute(update_query, values, commit=True, prepared=True)
+        if self.cache.is_loaded(table_name):
+            row = self.cache.get_row(name)
+            if row is not None:
+                self.cache.put_row((name, row[1], new_entry_time, new_exit_time))
+
+    def _event_timestamp(self, table_name, value):
+        """
+        Gets when an event happened
+        :param table_name: the day table the event belongs to
+        :param value: the time of the event as HH:MM:SS, or a full date and time
+        :return: the datetime
+        """
+        if len(value) > 8:
+            return datetime.datetime.fromisoformat(value)
+        return datetime.datetime.combine(self._table_date(table_name), datetime.time.fromisoformat(value))
+
+    def _load_presence(self, cursor, presence, day):
+        """
+        Loads the logged events of a day into a presence log, unless it already holds the day
+        :param cursor: a cursor in the transaction of the batch
+        :param presence: the PresenceLog
+        :param day: the date
+        :return: void
+        """
+        if presence.is_loaded(day):
+            return
+        start = datetime.datetime.combine(day, datetime.time())
+        cursor.execute(f"SELECT name, camera_id, kind, ts FROM {EVENTS_TABLE} WHERE ts >= %s AND ts < %s ORDER BY ts, id",
+                       (start, start + datetime.timedelta(days=1)))
+        presence.load(day, cursor.fetchall())
+
+    def _log_events(self, cursor, presence, events):
+        """
+        Folds a batch of events into presence intervals
+        :param cursor: a cursor in the transaction of the batch
+        :param presence: the PresenceLog to fold into, a copy of the committed one
+        :param events: the events as passed to apply_events
+        :return: the event log rows to append and the summaries of the people and days that changed
+        """
+        log_rows = []
+        changed = set()
+        for event in events:
+            if event['name'] == "unknown":
+                continue
+            timestamp = self._event_timestamp(event.get('table') or self.current_table, event['time'])
+            camera_id = '' if event.get('camera_id') is None else str(event['camera_id'])
+            self._load_presence(cursor, presence, timestamp.date())
+            log_rows.append((event['name'], camera_id, event['kind'], timestamp))
+            if presence.apply(event['name'], camera_id, event['kind'], timestamp):
+                changed.add((event['name'], timestamp.date()))
+
+        summaries = [presence.summary(name, day) for name, day in sorted(changed)]
+        if changed:
+            # Yesterday stays loaded for events that arrive late, older days are loaded again when needed
+            presence.forget(max(day for _, day in changed) - datetime.timedelta(days=1))
+        return log_rows, summaries
+
+    def apply_events(self, events):
+        """
+        Applies a batch of entry and exit events in one transaction. The current rows of everyone
+        in the batch come from the cache for today's table and are read with one query per table
+        otherwise. The events are folded into them in memory and the results are written back with
+        one multi-row INSERT and one batched UPDATE.
+        Every event is also appended to the event log, and the daily summaries of the people whose
+        presence changed are rewritten from the intervals kept in memory. The batch is folded into a
+        copy of the intervals, which only replaces them once the transaction is committed, so a
+        failed batch is folded in again from the start when it is retried.
+        Applying the same events twice gives the same result, so replaying a batch is safe
+        :param events: list of dictionaries with the kind ('entry' or 'exit'), name, time, camera_id and
+                table of each event
+        :return: void
+        """
+        tables = {}
+        for event in events:
+            tables.setdefault(event.get('table') or self.current_table, []).append(event)
+        cache = self._attendance_cache() if self.current_table in tables else None
+        if events:
+            self._ensure_event_tables()
+        written = []
+        committed = []
+
+        def work(conn):
+            cursor = conn.cursor()
+            written.clear()
+            presence = self.presence.copy()
+            log_rows, summaries = self._log_events(cursor, presence, events)
+            for table_name, table_events in tables.items():
+                names = sorted(set(event['name'] for event in table_events))
+                placeholders = ', '.join(['%s'] * len(names))
+
+                # The rows people already have today and the employee IDs of the new ones
+                if cache is not None and cache.is_loaded(table_name):
+                    rows = {name: list(cache.get_row(name)) for name in names if cache.get_row(name) is not None}
+                    employees = {name: cache.get_employee(name)[1] for name in names
+                                 if cache.get_employee(name) is not None}
+                else:
+                    table, where, date_values = self._day_query(table_name, f"name IN ({placeholders})")
+                    cursor.execute(f"SELECT {self._row_columns()} FROM {table} WHERE {where}",
+                                   list(date_values) + names)
+                    rows = {row[0]: list(row) for row in cursor.fetchall()}
+                    cursor.execute(f"SELECT name, employee_id FROM {self.employee_table} "
+                                   f"WHERE name IN ({placeholders})", names)
+                    employees = {row[0]: row[1] for row in cursor.fetchall()}
+
+                inserted = {}
+                updated = set()
+                for event in table_events:
+                    name = event['name']
+                    row = rows.get(name)
+                    if event['kind'] == 'entry':
+                        if row is None:
+                            # Only registered employees get a row
+                            if name in employees:
+                                rows[name] = inserted[name] = [name, employees[name], event['time'], None]
+                        elif row[2] is None:
+                            row[2] = event['time']
+                            updated.add(name)
+                    elif row is not None:
+                        row[3] = event['time']
+                        if name not in inserted:
+                            updated.add(name)
 
-        cursor.execute(update_query.format(table_name=table_name), values)
-        conn.commit()
+                if inserted:
+                    insert_query, date_values = self._insert_query(table_name)
+                    cursor.executemany(insert_query, [tuple(row) + date_values for row in inserted.values()])
+                if updated:
+                    update_query, date_values = self._update_query(table_name)
+                    cursor.executemany(update_query, [(rows[name][2], rows[name][3]) + date_values + (name,)
+                                                      for name in sorted(updated)])
+                written.extend((table_name, rows[name]) for name in set(inserted) | updated)
+            if log_rows:
+                cursor.executemany(self._insert_event_query(), log_rows)
+            if summaries:
+                cursor.executemany(self._upsert_summary_query(), summaries)
+            conn.commit()
+            cursor.close()
+            committed.append(presence)
 
-        conn.close()
+        if tables:
+            self._run(work)
+            self.presence = committed[-1]
+
+            # Write through to the cache once the rows are committed
+            if cache is not None:
+                for table_name, row in written:
+                    if cache.is_loaded(table_name):
+                        cache.put_row(row)
 
     def select_from_table(self, name, current=None):
         """
@@ -160,96 +643,504 @@ class Database:
             table_name = self.current_table
         else:
             table_name = current
-        try:
-            conn = mysql.connector.connect(**self.config)
-            cursor = conn.cursor()
 
+        # Lookups of single people in today's table and the employee table are answered from memory
+        if name != '*' and table_name in (self.current_table, self.employee_table):
+            cache = self._attendance_cache()
+            if cache is not None:
+                row = cache.get_row(name) if table_name == self.current_table else cache.get_employee(name)
+                return [row] if row is not None else []
+
+        if table_name == self.employee_table:
+            table, where, date_values = table_name, "", ()
+            columns = "*"
+        else:
+            table, where, date_values = self._day_query(table_name)
+            columns = "*" if self.schema != 'single' else self._row_columns()
+
+        try:
             if name != '*':
                 # Select data by name
                 select_query = '''
-                    SELECT *
+                    SELECT {columns}
                     FROM {table_name}
-                    WHERE name = %s
+                    WHERE {where}
                 '''
-                values = (name,)
+                where = " AND ".join(part for part in (where, "name = %s") if part)
+                values = date_values + (name,)
 
-                cursor.execute(select_query.format(table_name=table_name), values)
-                result = cursor.fetchall()
+                result = self._execute(select_query.format(columns=columns, table_name=table, where=where),
+                                       values, fetch=True)
             elif name == '*':
                 # Select data for everyone
                 select_query = '''
-                    SELECT *
+                    SELECT {columns}
                     FROM {table_name}
                 '''
+                if where:
+                    select_query += f"WHERE {where}"
 
-                cursor.execute(select_query.format(table_name=table_name))
-                result = cursor.fetchall()
+                result = self._execute(select_query.format(columns=columns, table_name=table),
+                                       date_values or None, fetch=True)
 
-            conn.close()
             return result
         except Exception:
             return []
 
+    def hours_between(self, names, start_date, end_date):
+        """
+        Gets the hours everyone in names was present on each day of a date range with a single query.
+        In the daily schema the day tables of the range are read with one UNION ALL, in the single
+        table schema the date range of the attendance table is read directly
+        :param names: the name of a person, a list of names, or None for everyone
+        :param start_date: the first day as a datetime.date or a MMDDYYYY string
+        :param end_date: the last day as a datetime.date or a MMDDYYYY string
+        :return: a dictionary of equally long NumPy columns sorted by name and date: 'name' (object),
+                'date' (datetime64[D]) and 'hours' (float64). Days without both an entry and an
+                exit time are left out
+        """
+        if isinstance(start_date, str):
+            start_date = datetime.datetime.strptime(start_date, "%m%d%Y").date()
+        if isinstance(end_date, str):
+            end_date = datetime.datetime.strptime(end_date, "%m%d%Y").date()
+        if isinstance(names, str):
+            names = [names]
+
+        name_condition, name_values = "", ()
+        if names is not None:
+            name_condition = f"name IN ({', '.join(['%s'] * len(names))})"
+            name_values = tuple(names)
+
+        def work(conn):
+            cursor = conn.cursor()
+            if self.schema == 'single':
+                where = " AND ".join(part for part in ("date BETWEEN %s AND %s", name_condition) if part)
+                cursor.execute(f"SELECT name, date, CAST(entry_time AS CHAR), CAST(exit_time AS CHAR) "
+                               f"FROM {ATTENDANCE_TABLE} WHERE {where}", (start_date, end_date) + name_values)
+                rows = cursor.fetchall()
+            else:
+                # Only the day tables that exist, a missing day would fail the whole UNION
+                cursor.execute(self.show_tables_query)
+                days = []
+                for (table_name,) in cursor.fetchall():
+                    if isinstance(table_name, bytes):
+                        table_name = table_name.decode()
+                    if DAY_TABLE_PATTERN.match(table_name):
+                        day = self._table_date(table_name)
+                        if start_date <= day <= end_date:
+                            days.append((day, table_name))
+
+                rows = []
+                if days:
+                    where = f" WHERE {name_condition}" if name_condition else ""
+                    union_query = " UNION ALL ".join(
+                        f"SELECT name, '{day:%Y-%m-%d}', entry_time, exit_time FROM {table_name}{where}"
+                        for day, table_name in sorted(days))
+                    cursor.execute(union_query, name_values * len(days) or None)
+                    rows = cursor.fetchall()
+            cursor.close()
+            return rows
+
+        rows = self._run(work)
+
+        hours = [(row[0], row[1], (_time_seconds(row[3]) - _time_seconds(row[2])) / 3600) for row in rows]
+        return _hours_columns([row for row in hours if not np.isnan(row[2])])
+
+    def presence_hours(self, names, start_date, end_date, fallback=True):
+        """
+        Gets the hours everyone in names was present on each day of a date range from the daily summaries,
+        which add up every visit instead of the span from the first entry to the last exit
+        :param names: the name of a person, a list of names, or None for everyone
+        :param start_date: the first day as a datetime.date or a MMDDYYYY string
+        :param end_date: the last day as a datetime.date or a MMDDYYYY string
+        :param fallback: fill in the days from before the event log with hours_between
+        :return: a dictionary of equally long NumPy columns sorted by name and date, like hours_between.
+                Days without a finished visit are left out
+        """
+        if isinstance(start_date, str):
+            start_date = datetime.datetime.strptime(start_date, "%m%d%Y").date()
+        if isinstance(end_date, str):
+            end_date = datetime.datetime.strptime(end_date, "%m%d%Y").date()
+        if isinstance(names, str):
+            names = [names]
+
+        where, values = "date BETWEEN %s AND %s AND visits > 0", (start_date, end_date)
+        if names is not None:
+            where += f" AND name IN ({', '.join(['%s'] * len(names))})"
+            values += tuple(names)
+
+        self._ensure_event_tables()
+        rows = [(row[0], str(row[1]), row[2] / 3600) for row in self._execute(
+            f"SELECT name, date, present_seconds FROM {SUMMARY_TABLE} WHERE {where}", values, fetch=True)]
+
+        if fallback:
+            summarized = set((name, date) for name, date, _ in rows)
+            legacy = self.hours_between(names, start_date, end_date)
+            rows += [row for row in zip(legacy['name'], legacy['date'].astype(str), legacy['hours'])
+                     if (row[0], row[1]) not in summarized]
+        return _hours_columns(rows)
+
     def clean_database(self):
         """
         Cleans the database and deletes all the tables and data
         :return: void
         """
-        conn = mysql.connector.connect(**self.config)
-        cursor = conn.cursor()
+        def work(conn):
+            cursor = conn.cursor()
 
-        # Get all table names in the database
-        cursor.execute("SHOW TABLES")
-        tables = cursor.fetchall()
+            # Get all table names in the database
+            cursor.execute(self.show_tables_query)
+            tables = cursor.fetchall()
 
-        # Delete each table
-        for table in tables:
-            table_name = table[0]
-            drop_table_query = f"DROP TABLE IF EXISTS {table_name}"
-            cursor.execute(drop_table_query)
+            # Delete each table
+            for table in tables:
+                table_name = table[0]
+                drop_table_query = f"DROP TABLE IF EXISTS {table_name}"
+                cursor.execute(drop_table_query)
 
-        conn.commit()
-        conn.close()
+            conn.commit()
 
-    def export_to_csv(self):
+        self._run(work)
+
+    def _tables_to_export(self, cursor, incremental, state):
         """
-        Exports all tables and their data to a new Excel CSV file with a dynamic filename
+        Works out which tables an export has to read
+        :param cursor: a cursor on the export connection
+        :param incremental: True to only return the tables and days that changed since the last export
+        :param state: the state saved by the last export, updated in place for the next one
+        :return: a list of (table name, WHERE clause, values) to export
+        """
+        if incremental:
+            # Remember the server's clock, so the next export does not depend on this machine's clock
+            now = self._server_now(cursor)
+            update_times = self._table_update_times(cursor)
+        else:
+            cursor.execute(self.show_tables_query)
+            update_times = {row[0]: None for row in cursor.fetchall()}
+
+        exports = []
+        for table_name in sorted(update_times):
+            if incremental and table_name == ATTENDANCE_TABLE:
+                # Only the days with rows changed since the last export
+                exported_at = state.get('attendance_exported_at')
+                if exported_at is None:
+                    exports.append((table_name, "", ()))
+                else:
+                    exports.append((table_name, f"WHERE date IN (SELECT DISTINCT date FROM {ATTENDANCE_TABLE} "
+                                                f"WHERE updated_at >= %s)", (exported_at,)))
+                state['attendance_exported_at'] = str(now)
+            elif incremental and table_name == EVENTS_TABLE:
+                # The event log is append-only, so only the events after the last exported one
+                cursor.execute(f"SELECT MAX(id) FROM {EVENTS_TABLE}")
+                last_id = cursor.fetchall()[0][0] or 0
+                exported_id = state.get('events_exported_id', 0)
+                exports.append((table_name, "WHERE id > %s AND id <= %s", (exported_id, last_id)))
+                state['events_exported_id'] = max(exported_id, last_id)
+            elif incremental and table_name == SUMMARY_TABLE:
+                # Summaries change until the day is over and late events still reach the day before,
+                # so the last exported day and the one before it are exported again with the newer ones
+                cursor.execute(f"SELECT MAX(date) FROM {SUMMARY_TABLE}")
+                last_date = cursor.fetchall()[0][0]
+                exported_date = state.get('summary_exported_date')
+                if exported_date is None:
+                    exports.append((table_name, "", ()))
+                else:
+                    since = datetime.date.fromisoformat(exported_date) - datetime.timedelta(days=1)
+                    exports.append((table_name, "WHERE date >= %s", (str(since),)))
+                if last_date is not None:
+                    state['summary_exported_date'] = str(last_date)
+            elif incremental:
+                # The server does not always know when a table changed, those tables are exported
+                update_time = update_times[table_name]
+                if update_time is None or state['tables'].get(table_name) != update_time:
+                    exports.append((table_name, "", ()))
+                state['tables'][table_name] = update_time
+            else:
+                exports.append((table_name, "", ()))
+        return exports
+
+    def export_to_csv(self, output_format='csv', incremental=False, chunk_size=1000,
+                      state_path='export_state.json'):
+        """
+        Exports tables and their data to a new file with a dynamic filename. The rows are streamed
+        from an unbuffered cursor on a single connection and written in chunks, so the memory used
+        does not grow with the size of the database
+        :param output_format: 'csv' for one Excel CSV file, 'csv.gz' for the same file gzip compressed, or
+                'parquet' for a directory with one Parquet file per table (needs pyarrow)
+        :param incremental: only export the day tables, or the days of the attendance table, that changed
+                since the last incremental export, and the events and daily summaries added since then
+        :param chunk_size: the number of rows fetched and written at a time
+        :param state_path: the file where incremental exports remember what they exported
+        :return: the name of the file or directory written, None if the export failed
         """
         try:
-            conn = mysql.connector.connect(**self.config)
-            cursor = conn.cursor()
+            if output_format not in ('csv', 'csv.gz', 'parquet'):
+                raise ValueError(f"Unknown export format {output_format}")
+            if output_format == 'parquet' and pa is None:
+                raise ImportError("Parquet exports need pyarrow, install it with pip install pyarrow")
+
+            state = {'tables': {}}
+            if incremental and os.path.exists(state_path):
+                with open(state_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
 
             # Get the current date and time
             current_datetime = datetime.datetime.now()
             formatted_date = current_datetime.strftime("%Y%m%d_%H%M%S")
 
             # Construct the dynamic filename
-            csv_filename = f"database_export_{formatted_date}.csv"
+            export_name = f"database_export_{formatted_date}"
+            if output_format != 'parquet':
+                export_name += f".{output_format}"
 
-            with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-                csvwriter = csv.writer(csvfile)
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                exports = self._tables_to_export(cursor, incremental, state)
+                cursor.close()
 
-                # Get all table names in the database
-                cursor.execute("SHOW TABLES")
-                tables = cursor.fetchall()
+                if output_format == 'parquet':
+                    os.makedirs(export_name, exist_ok=True)
+                    for table_name, where, values in exports:
+                        self._export_table_parquet(conn, table_name, where, values, chunk_size,
+                                                   os.path.join(export_name, f"{table_name}.parquet"))
+                else:
+                    opener = gzip.open if output_format == 'csv.gz' else open
+                    with opener(export_name, 'wt', newline='', encoding='utf-8') as csvfile:
+                        csvwriter = csv.writer(csvfile)
+                        for table_name, where, values in exports:
+                            csvwriter.writerow([f"Table: {table_name}"])
+                            for i, chunk in enumerate(self._stream_rows(conn, table_name, where, values, chunk_size)):
+                                if i == 0:
+                                    csvwriter.writerow(chunk)
+                                else:
+                                    csvwriter.writerows(chunk)
 
-                # Export each table's data to the CSV file
-                for table in tables:
-                    table_name = table[0]
-                    csvwriter.writerow([f"Table: {table_name}"])
+            if incremental:
+                with open(state_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, indent=2)
 
-                    # Fetch data from the table
-                    data = self.select_from_table('*', table_name)
-                    cursor.execute(f"SHOW COLUMNS FROM {table_name}")
-                    column_headers = [column[0] for column in cursor.fetchall()]
-                    csvwriter.writerow(column_headers)
+            print(f"Data exported to {export_name} successfully.")
+            return export_name
+        except Exception as e:
+            print(f"Error exporting data: {e}")
+            return None
 
-                    if data:
-                        # Write the data in the file
-                        csvwriter.writerows(data)
+    @staticmethod
+    def _stream_rows(conn, table_name, where, values, chunk_size):
+        """
+        Streams the rows of a table with an unbuffered cursor
+        :return: a generator of the column headers first and then lists of at most chunk_size rows
+        """
+        cursor = conn.cursor(buffered=False)
+        try:
+            cursor.execute(f"SELECT * FROM {table_name} {where}", values or None)
+            yield [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
 
-            conn.close()
-            print(f"Data exported to {csv_filename} successfully.")
-        except Exception as e:
-            print(f"Error exporting data to CSV: {e}")
+    def _export_table_parquet(self, conn, table_name, where, values, chunk_size, path):
+        """
+        Writes the rows of a table to a Parquet file, one row group per chunk
+        :return: void
+        """
+        stream = self._stream_rows(conn, table_name, where, values, chunk_size)
+        headers = next(stream)
+        writer = None
+        try:
+            for rows in stream:
+                columns = {header: [row[i] for row in rows] for i, header in enumerate(headers)}
+                if writer is None:
+                    # Columns that are empty in the first chunk are stored as text
+                    schema = pa.Table.from_pydict(columns).schema
+                    schema = pa.schema([pa.field(field.name, pa.string()) if pa.types.is_null(field.type)
+                                        else field for field in schema])
+                    writer = pq.ParquetWriter(path, schema)
+                writer.write_table(pa.Table.from_pydict(columns, schema=writer.schema))
+            if writer is None:
+                writer = pq.ParquetWriter(path, pa.schema([pa.field(header, pa.string()) for header in headers]))
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+'''The MySQL/MariaDB storage backend.'''
+class Database(StorageBackend):
+    connection_errors = CONNECTION_ERRORS
+
+    def configure_database(self, host='10.152.5.142', port=3306, database='facerecdatabase', user='interns',
+                           password='InternsPassword!', pool_size=5, use_cache=True):
+        """
+        Function that configures the database being used
+        :param host: IP address or hostname of the database server
+        :param port: Port number on which the database server is listening
+        :param database: Name of the database to connect to
+        :param user: Username for authentication
+        :param password: Password for the specified username
+        :param pool_size: Number of persistent connections kept open. 0 opens a new connection for every query
+        :param use_cache: Serve today's attendance rows and the employee directory from memory. Only turn this
+                off if other programs write today's table at the same time
+        """
+        # Configure the database
+        config = {
+            'host': host,
+            'port': port,
+            'database': database,
+            'user': user,
+            'password': password
+        }
+
+        self._configure(config, pool_size, use_cache)
+
+    def _connect(self):
+        return mysql.connector.connect(**self.config)
+
+    def _ping(self, connection):
+        connection.ping(reconnect=False)
+
+    def _create_attendance_table(self):
+        """
+        Creates the attendance table with typed columns, partitioned by month where the server supports it
+        :return: void
+        """
+        create_table_query = f'''
+            CREATE TABLE IF NOT EXISTS {ATTENDANCE_TABLE} (
+                id BIGINT NOT NULL AUTO_INCREMENT,
+                name VARCHAR(255) NOT NULL,
+                employee_id VARCHAR(64),
+                date DATE NOT NULL,
+                entry_time TIME NULL,
+                exit_time TIME NULL,
+                updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, date),
+                UNIQUE KEY uq_attendance_name_date (name, date),
+                KEY idx_attendance_employee_date (employee_id, date),
+                KEY idx_attendance_date (date)
+            )
+        '''
+        partitions = " PARTITION BY RANGE (TO_DAYS(date)) (PARTITION pmax VALUES LESS THAN MAXVALUE)"
+
+        try:
+            self._execute(create_table_query + partitions)
+        except mysql.connector.Error:
+            # The server does not support partitioning
+            self._execute(create_table_query)
+
+    def _ensure_partitions(self, day):
+        """
+        Splits monthly partitions off the catch-all partition of the attendance table, up to the month
+        after the given day. Rows of a month then live in their own partition and date range queries
+        only read the partitions of the months they cover. A day before the first partition, for example
+        from migrate_daily_tables, gets its month and the ones up to the first partition split off that one
+        :param day: the date that needs a partition
+        :return: void
+        """
+        first = day.replace(day=1)
+        target = (first + datetime.timedelta(days=32)).replace(day=1)
+        if self._partitions_until is not None and self._partitions_from <= first and self._partitions_until >= target:
+            return
+
+        partitions = self._execute('''
+            SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ''', (ATTENDANCE_TABLE,), fetch=True)
+        names = [row[0] for row in partitions]
+        if 'pmax' not in names:
+            # Not partitioned
+            self._partitions_from = datetime.date.min
+            self._partitions_until = datetime.date.max
+            return
+
+        months = sorted(datetime.datetime.strptime(name[1:], "%Y%m").date() for name in names if name != 'pmax')
+        if months and first < months[0]:
+            # The first partition also holds everything older, split the earlier months off it
+            earlier_partitions = []
+            month = first
+            while month <= months[0]:
+                next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+                earlier_partitions.append(
+                    f"PARTITION p{month:%Y%m} VALUES LESS THAN (TO_DAYS('{next_month:%Y-%m-%d}'))")
+                month = next_month
+            self._execute(f"ALTER TABLE {ATTENDANCE_TABLE} REORGANIZE PARTITION p{months[0]:%Y%m} INTO "
+                          f"({', '.join(earlier_partitions)})")
+            months.insert(0, first)
+
+        month = (months[-1] + datetime.timedelta(days=32)).replace(day=1) if months else first
+        new_partitions = []
+        while month <= target:
+            next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+            new_partitions.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN (TO_DAYS('{next_month:%Y-%m-%d}'))")
+            month = next_month
+
+        if new_partitions:
+            new_partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+            self._execute(f"ALTER TABLE {ATTENDANCE_TABLE} REORGANIZE PARTITION pmax INTO "
+                          f"({', '.join(new_partitions)})")
+        self._partitions_from = months[0] if months else first
+        self._partitions_until = target
+
+    def _create_event_tables(self):
+        self._execute(f'''
+            CREATE TABLE IF NOT EXISTS {EVENTS_TABLE} (
+                id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                camera_id VARCHAR(64) NOT NULL DEFAULT '',
+                kind ENUM('entry', 'exit') NOT NULL,
+                ts DATETIME NOT NULL,
+                UNIQUE KEY uq_events (name, camera_id, kind, ts),
+                KEY idx_events_ts (ts)
+            )
+        ''')
+        self._execute(f'''
+            CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
+                name VARCHAR(255) NOT NULL,
+                date DATE NOT NULL,
+                first_entry TIME NULL,
+                last_exit TIME NULL,
+                present_seconds INT NOT NULL DEFAULT 0,
+                visits INT NOT NULL DEFAULT 0,
+                open_since TIME NULL,
+                PRIMARY KEY (name, date),
+                KEY idx_daily_date (date)
+            )
+        ''')
+
+    def _insert_event_query(self):
+        return f"INSERT IGNORE INTO {EVENTS_TABLE} (name, camera_id, kind, ts) VALUES (%s, %s, %s, %s)"
+
+    def _upsert_summary_query(self):
+        return f'''
+            INSERT INTO {SUMMARY_TABLE} (name, date, first_entry, last_exit, present_seconds, visits, open_since)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                first_entry = VALUES(first_entry), last_exit = VALUES(last_exit),
+                present_seconds = VALUES(present_seconds), visits = VALUES(visits), open_since = VALUES(open_since)
+        '''
+
+    def _merge_day_query(self, table_name):
+        return f'''
+            INSERT INTO {ATTENDANCE_TABLE} (name, employee_id, date, entry_time, exit_time)
+            SELECT name, employee_id, %s, NULLIF(entry_time, ''), NULLIF(exit_time, '')
+            FROM {table_name}
+            WHERE name IS NOT NULL
+            ON DUPLICATE KEY UPDATE
+                entry_time = LEAST(COALESCE({ATTENDANCE_TABLE}.entry_time, VALUES(entry_time)),
+                                   COALESCE(VALUES(entry_time), {ATTENDANCE_TABLE}.entry_time)),
+                exit_time = GREATEST(COALESCE({ATTENDANCE_TABLE}.exit_time, VALUES(exit_time)),
+                                     COALESCE(VALUES(exit_time), {ATTENDANCE_TABLE}.exit_time))
+        '''
+
+    def _server_now(self, cursor):
+        cursor.execute("SELECT NOW()")
+        return str(cursor.fetchall()[0][0])
 
+    def _table_update_times(self, cursor):
+        # InnoDB forgets the update times when the server restarts, those tables come back as None
+        cursor.execute("SELECT TABLE_NAME, UPDATE_TIME FROM information_schema.TABLES "
+                       "WHERE TABLE_SCHEMA = DATABASE()")
+        return {name: str(update_time) if update_time is not None else None
+                for name, update_time in cursor.fetchall()}
@@ -0,0 +1,227 @@
+'''A persistent on-disk cache of face encodings so that known faces are only encoded once.'''
+import os
+import json
+import hashlib
+import numpy as np
+from Gallery import ENCODING_SIZE
+
+MANIFEST_VERSION = 1
+
+
+def file_digest(path):
+    """
+    Hash the contents of a file.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        str: The hex SHA-1 digest of the file contents.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+'''A class that stores encodings in a memory-mappable .npy matrix described by a JSON manifest.'''
+class EncodingCache():
+    def __init__(self, cache_path):
+        """
+        Initialize the encoding cache.
+
+        Args:
+            cache_path (str): Directory the cache files are stored in. It is created on the first save.
+        """
+        self.cache_path = cache_path
+        self.encodings_file = None
+        self.manifest_path = os.path.join(cache_path, 'manifest.json')
+        self.entries = {}
+        self.dirty = False
+        self.loaded = False
+        self._encodings = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self._new_encodings = []
+
+    def load(self):
+        """
+        Load the manifest and memory-map the encodings matrix. A missing or unreadable
+        cache is treated as empty so that everything is simply re-encoded.
+        """
+        self.entries = {}
+        self._encodings = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self._new_encodings = []
+        self.dirty = False
+        self.loaded = True
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') != MANIFEST_VERSION:
+                return
+            encodings = np.load(os.path.join(self.cache_path, manifest['encodings']), mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return
+
+        self.entries = manifest['entries']
+        self.encodings_file = manifest['encodings']
+        # A plain ndarray view of the memory map avoids the memmap subclass overhead on every row access
+        self._encodings = np.asarray(encodings)
+
+    def _encoding(self, row):
+        """
+        Get the encoding stored in a row, including rows added since the last save.
+        """
+        if row is None:
+            return None
+        if row < len(self._encodings):
+            return self._encodings[row]
+        return self._new_encodings[row - len(self._encodings)]
+
+    def encoding(self, image_path):
+        """
+        Get the stored encoding of an image without checking whether the image changed.
+
+        Args:
+            image_path (str): Path to the image.
+
+        Returns:
+            numpy.ndarray: A read-only view of the encoding, None if the image is not cached or has no face.
+        """
+        entry = self.entries.get(image_path)
+        return self._encoding(entry['row']) if entry is not None else None
+
+    def lookup(self, image_path, stat):
+        """
+        Look up the cached encoding of an image.
+
+        The entry is valid when the size and modification time match. If only those changed,
+        the file contents are hashed so that touched but otherwise identical files are not re-encoded.
+
+        Args:
+            image_path (str): Path to the image.
+            stat (os.stat_result): The current stat of the image.
+
+        Returns:
+            Tuple: (hit, encoding). encoding is None when the image is cached as having no face.
+        """
+        entry = self.entries.get(image_path)
+        if entry is None:
+            return False, None
+
+        if entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+            if entry['size'] != stat.st_size or entry['sha1'] != file_digest(image_path):
+                return False, None
+            entry['mtime_ns'] = stat.st_mtime_ns
+            self.dirty = True
+
+        return True, self._encoding(entry['row'])
+
+    def put(self, image_path, stat, encoding):
+        """
+        Store the encoding of an image.
+
+        Args:
+            image_path (str): Path to the image.
+            stat (os.stat_result): The stat of the image when it was encoded.
+            encoding (numpy.ndarray): The encoding, or None if no face was found in the image.
+        """
+        row = None
+        if encoding is not None:
+            row = len(self._encodings) + len(self._new_encodings)
+            self._new_encodings.append(np.asarray(encoding, dtype=np.float32))
+
+        old_entry = self.entries.get(image_path, {})
+        self.entries[image_path] = {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha1': file_digest(image_path),
+            'row': row,
+            'name': old_entry.get('name'),
+            'name_mtime_ns': old_entry.get('name_mtime_ns'),
+        }
+        self.dirty = True
+
+    def lookup_name(self, image_path, name_stat):
+        """
+        Get the cached name of an image if its name file has not changed.
+
+        Args:
+            image_path (str): Path to the image.
+            name_stat (os.stat_result): The current stat of the name file.
+
+        Returns:
+            str: The cached name, or None if it has to be read again.
+        """
+        entry = self.entries.get(image_path)
+        if entry is None or entry.get('name_mtime_ns') != name_stat.st_mtime_ns:
+            return None
+        return entry.get('name')
+
+    def put_name(self, image_path, name_stat, name):
+        """
+        Store the name read from the name file of an image.
+        """
+        entry = self.entries.get(image_path)
+        if entry is None:
+            return
+        entry['name'] = name
+        entry['name_mtime_ns'] = name_stat.st_mtime_ns
+        self.dirty = True
+
+    def remove(self, image_path):
+        """
+        Remove an image from the cache. Its row is dropped on the next save.
+        """
+        if self.entries.pop(image_path, None) is not None:
+            self.dirty = True
+
+    def prune(self, image_paths):
+        """
+        Remove every cached image that is not in `image_paths`.
+
+        Args:
+            image_paths (set): The images that still exist.
+        """
+        for image_path in list(self.entries):
+            if image_path not in image_paths:
+                self.remove(image_path)
+
+    def save(self):
+        """
+        Write the cache to disk if anything changed. Rows of removed images are compacted away.
+        The encodings go to a new file that the manifest is then atomically switched over to,
+        so that a crash never leaves a manifest pointing at the wrong rows.
+        """
+        if not self.dirty:
+            return
+
+        rows = []
+        for entry in self.entries.values():
+            if entry['row'] is not None:
+                rows.append(self._encoding(entry['row']))
+                entry['row'] = len(rows) - 1
+        encodings = np.array(rows, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+
+        # Release the memory map before the file underneath it is replaced
+        self._encodings = encodings
+        self._new_encodings = []
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        old_encodings_file = self.encodings_file
+        self.encodings_file = f"encodings_{os.getpid()}_{hashlib.sha1(encodings.tobytes()).hexdigest()[:12]}.npy"
+        np.save(os.path.join(self.cache_path, self.encodings_file), encodings)
+        # Map the saved rows instead of keeping them in memory
+        self._encodings = np.asarray(np.load(os.path.join(self.cache_path, self.encodings_file), mmap_mode='r'))
+
+        manifest_tmp = self.manifest_path + '.tmp'
+        with open(manifest_tmp, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'encodings': self.encodings_file, 'entries': self.entries}, f)
+        os.replace(manifest_tmp, self.manifest_path)
+
+        if old_encodings_file and old_encodings_file != self.encodings_file:
+            try:
+                os.remove(os.path.join(self.cache_path, old_encodings_file))
+            except OSError:
+                pass
+
+        self.dirty = False
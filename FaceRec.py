@@ -1,45 +1,346 @@
 '''A program that performs real-time face recognition using webcam video stream.'''
 import os
 import time
+import datetime
+import multiprocessing
 import face_recognition
 import cv2
+import numpy as np
+from Gallery import Gallery, ENCODING_SIZE
+from IVFIndex import IVFIndex
+from Metrics import METRICS
+from EncodingCache import EncodingCache
+from Pipeline import Pipeline
+from Tracker import FaceTracker
+
+
+def encode_image_file(image_path):
+    """
+    Load an image file and encode the first face found in it.
+
+    Args:
+        image_path (str): Path to the image.
+
+    Returns:
+        numpy.ndarray: The face encoding, or None if no face was found.
+    """
+    image = face_recognition.load_image_file(image_path)
+    face_encodings = face_recognition.face_encodings(image)
+    if len(face_encodings) > 0:
+        return face_encodings[0]  # Use the first face encoding
+    return None
+
+
+def css_to_xyxy(face_location):
+    """
+    Convert a face_recognition (top, right, bottom, left) location to an x1, y1, x2, y2 box.
+    """
+    top, right, bottom, left = face_location
+    return [left, top, right, bottom]
+
+
+def xyxy_to_css(box):
+    """
+    Convert an x1, y1, x2, y2 box to a face_recognition (top, right, bottom, left) location.
+    """
+    x1, y1, x2, y2 = (int(round(float(v))) for v in box)
+    return (y1, x2, y2, x1)
+
+
+def downscale_frame(frame, scale=1.0, roi=None):
+    """
+    Crop a frame to a region of interest and shrink it for faster detection.
+
+    Args:
+        frame (numpy.ndarray): The full resolution frame.
+        scale (float): Factor the frame is resized by, for example 0.5 for half the width and height.
+        roi (tuple): Optional x1, y1, x2, y2 region of the full frame to detect in.
+
+    Returns:
+        Tuple: The detection frame and the (x, y) offset of the region in the full frame.
+    """
+    offset = (0, 0)
+    if roi is not None:
+        x1, y1, x2, y2 = roi
+        frame = frame[y1:y2, x1:x2]
+        offset = (x1, y1)
+    if scale != 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return frame, offset
+
+
+def upscale_boxes(boxes, scale=1.0, offset=(0, 0)):
+    """
+    Map x1, y1, x2, y2 boxes found on a frame from downscale_frame back to the full resolution frame.
+
+    Args:
+        boxes (list): The boxes on the detection frame.
+        scale (float): The scale the detection frame was made with.
+        offset (tuple): The offset the detection frame was made with.
+
+    Returns:
+        List: The boxes in full resolution coordinates.
+    """
+    x_offset, y_offset = offset
+    return [[float(x1) / scale + x_offset, float(y1) / scale + y_offset,
+             float(x2) / scale + x_offset, float(y2) / scale + y_offset] for x1, y1, x2, y2 in boxes]
+
+
+def _encode_image_job(image_path):
+    """
+    Process pool job that encodes one image and reports which image it was.
+    """
+    return image_path, encode_image_file(image_path)
+
+
+def print_progress(done, total, rate):
+    """
+    Default progress report of bulk_enroll, printed about every 5% of the images.
+    """
+    if done == total or done % max(1, total // 20) == 0:
+        print(f"Encoded {done}/{total} images ({rate:.1f} images/s)")
+
 
 '''A class that contains the functions to perform face recognition.'''
 class FaceReco():
-    def __init__(self, known_faces_path, known_names_path):
+    def __init__(self, known_faces_path, known_names_path, tolerance=0.6, cache_path='EncodingCache',
+                 detection_scale=1.0, detection_roi=None, encode_full_res=True, index=None,
+                 precision='float32'):
         """
         Initialize the FaceRecognizer class.
 
         Args:
             known_faces_path (str): Path to the directory containing known face images.
             known_names_path (str): Path to the directory containing known names text files.
+            tolerance (float): The largest face distance that is still considered a match.
+            cache_path (str): Directory of the persistent encoding cache. None disables the cache.
+            detection_scale (float): Factor frames are shrunk by before face detection, for example 0.25
+                to detect on a quarter of the width and height. Found faces are mapped back to full resolution.
+            detection_roi (tuple): Optional x1, y1, x2, y2 region of the frame to detect faces in.
+            encode_full_res (bool): Encode faces on the full resolution frame for accuracy. If False
+                they are encoded on the downscaled frame, which is faster.
+            index (IVFIndex): Approximate nearest neighbor index for galleries of many thousand faces, for
+                example IVFIndex(nprobe=8). True uses the default settings. Its clusters are saved in the cache.
+            precision (str): Storage of the known encodings, 'float32', 'float16' or 'int8'. See Gallery.
+
+        A person can have several reference images, saved as name.jpg and name__<suffix>.jpg next to a
+        single name.txt. Their encodings are compacted to a centroid and a few outliers, see Gallery.
         """
         self.known_names_path = known_names_path
         self.known_faces_path = known_faces_path
-        self.known_face_encodings = []
+        if index is True:
+            index = IVFIndex()
+        self.gallery = Gallery(tolerance, index, precision=precision)
+        self.cache = EncodingCache(cache_path) if cache_path else None
+        self.index_path = os.path.join(cache_path, 'ivf_index.npz') if cache_path and index else None
+        # The reference images of every person by image path. Their encodings are read from the memory
+        # mapped cache when a person is compacted again, only without a cache they are kept here
+        self.reference_images = {}
+        self.detection_scale = detection_scale
+        self.detection_roi = detection_roi
+        self.encode_full_res = encode_full_res
 
     def create_known_faces(self):
         """
         Load known face images, encode them, and store the encodings along with their names.
+        Images that are already in the encoding cache and have not changed are not encoded again.
+        """
+        self.gallery.clear()
+        self.reference_images = {}
+        if self.cache is not None and not self.cache.loaded:
+            self.cache.load()
+
+        image_paths = self._image_paths()
+        for image_path in image_paths:
+            face_encoding = self._load_encoding(image_path)
+
+            if face_encoding is not None:
+                filename = os.path.basename(image_path)
+                name = self._load_name(image_path, filename)
+
+                if name is not None:
+                    self._keep_reference(self.reference_images.setdefault(name, {}), image_path, face_encoding)
+                else:
+                    print(f"No name file found for '{filename}'.")
+
+        # Every person's references are compacted at once
+        self.gallery.add_identities({name: self._reference_encodings(images)
+                                     for name, images in self.reference_images.items()})
+
+        if self.cache is not None:
+            self.cache.prune(set(image_paths))
+            self.cache.save()
+        self.gallery.build_index(self.index_path)
+
+    def bulk_enroll(self, workers=None, image_paths=None, chunksize=1, progress=print_progress):
         """
-        for filename in os.listdir(self.known_faces_path):
-            if filename.endswith('.jpg') or filename.endswith('.png'):
-                image_path = os.path.join(self.known_faces_path, filename)
-                image = face_recognition.load_image_file(image_path)
-                face_encodings = face_recognition.face_encodings(image)
+        Encode many known face images across a process pool and stream the results into the
+        known faces as they finish. Images that are already cached are not encoded again.
 
-                if len(face_encodings) > 0:
-                    face_encoding = face_encodings[0]  # Use the first face encoding
-                    name_file = filename.split('.')[0] + '.txt'  # Assuming name files have .txt extension
-                    name_path = os.path.join(self.known_names_path, name_file)
+        Args:
+            workers (int): Number of worker processes. Defaults to the number of CPU cores.
+            image_paths (list): The images to enroll. Defaults to every image in the known faces directory.
+            chunksize (int): Number of images handed to a worker at a time.
+            progress (callable): Called as progress(done, total, images_per_second) after every image.
 
-                    if os.path.isfile(name_path):
-                        with open(name_path, 'r') as f:
-                            name = f.read().strip()
+        Returns:
+            Tuple: The number of images that were encoded and the time it took in seconds.
+        """
+        if self.cache is not None and not self.cache.loaded:
+            self.cache.load()
+        if image_paths is None:
+            image_paths = self._image_paths()
+
+        # Split off the images that still have to be encoded, enrolling the cached ones right away
+        pending = []
+        stats = {}
+        for image_path in image_paths:
+            if self.cache is not None:
+                stat = os.stat(image_path)
+                hit, face_encoding = self.cache.lookup(image_path, stat)
+                if hit:
+                    self._enroll_encoding(image_path, face_encoding)
+                    continue
+                stats[image_path] = stat
+            pending.append(image_path)
 
-                        self.known_face_encodings.append((face_encoding, name))
-                    else:
-                        print(f"No name file found for '{filename}'.")
+        start_time = time.time()
+        done = 0
+        if pending:
+            workers = min(workers or os.cpu_count() or 1, len(pending))
+            with multiprocessing.Pool(workers) as pool:
+                for image_path, face_encoding in pool.imap_unordered(_encode_image_job, pending, chunksize):
+                    if self.cache is not None:
+                        self.cache.put(image_path, stats[image_path], face_encoding)
+                    self._enroll_encoding(image_path, face_encoding)
+
+                    done += 1
+                    if progress is not None:
+                        progress(done, len(pending), done / max(time.time() - start_time, 1e-9))
+
+        if self.cache is not None:
+            self.cache.save()
+        self.gallery.build_index(self.index_path)
+        return done, time.time() - start_time
+
+    def _image_paths(self):
+        """
+        List the known face images.
+
+        Returns:
+            List: The paths of every .jpg and .png image in the known faces directory.
+        """
+        return [os.path.join(self.known_faces_path, filename)
+                for filename in sorted(os.listdir(self.known_faces_path))
+                if filename.endswith('.jpg') or filename.endswith('.png')]
+
+    def _person_images(self, name):
+        """
+        List the reference images of a person.
+
+        Args:
+            name (str): The name the images were saved under.
+
+        Returns:
+            List: The paths of name.jpg or name.png and of every name__<suffix> image.
+        """
+        return [os.path.join(self.known_faces_path, filename)
+                for filename in sorted(os.listdir(self.known_faces_path))
+                if (filename.endswith('.jpg') or filename.endswith('.png'))
+                and (filename.rsplit('.', 1)[0] == name or filename.startswith(f"{name}__"))]
+
+    def _keep_reference(self, images, image_path, face_encoding):
+        """
+        Remember a reference image of a person, and its encoding if there is no cache to read it from.
+        """
+        images[image_path] = None if self.cache is not None else np.asarray(face_encoding, dtype=np.float32)
+
+    def _reference_encodings(self, images):
+        """
+        Get the encodings of the reference images of a person.
+
+        Args:
+            images (dict): The person's entry of reference_images.
+
+        Returns:
+            numpy.ndarray: The (M, 128) float32 encodings.
+        """
+        return np.array([self.cache.encoding(image_path) if face_encoding is None else face_encoding
+                         for image_path, face_encoding in images.items()],
+                        dtype=np.float32).reshape(-1, ENCODING_SIZE)
+
+    def _enroll_encoding(self, image_path, face_encoding):
+        """
+        Add the encoding of one image to the reference set of its person, replacing an earlier
+        encoding of the same image.
+        """
+        if face_encoding is None:
+            return
+        filename = os.path.basename(image_path)
+        name = self._load_name(image_path, filename)
+        if name is None:
+            print(f"No name file found for '{filename}'.")
+            return
+        images = self.reference_images.setdefault(name, {})
+        self._keep_reference(images, image_path, face_encoding)
+        self.gallery.replace(name, self._reference_encodings(images))
+
+    def _load_encoding(self, image_path):
+        """
+        Get the encoding of an image from the cache, or encode it and remember the result.
+
+        Args:
+            image_path (str): Path to the image.
+
+        Returns:
+            numpy.ndarray: The face encoding, or None if no face was found.
+        """
+        if self.cache is None:
+            return encode_image_file(image_path)
+
+        stat = os.stat(image_path)
+        hit, face_encoding = self.cache.lookup(image_path, stat)
+        if not hit:
+            face_encoding = encode_image_file(image_path)
+            self.cache.put(image_path, stat, face_encoding)
+        return face_encoding
+
+    def _load_name(self, image_path, filename):
+        """
+        Read the name belonging to an image from its name file.
+
+        Args:
+            image_path (str): Path to the image.
+            filename (str): File name of the image.
+
+        Returns:
+            str: The name, or None if there is no name file.
+        """
+        name_file = filename.split('.')[0] + '.txt'  # Assuming name files have .txt extension
+        name_path = os.path.join(self.known_names_path, name_file)
+
+        try:
+            name_stat = os.stat(name_path)
+        except OSError:
+            # Further reference images of a person share the name file of the first image
+            if '__' not in filename:
+                return None
+            name_path = os.path.join(self.known_names_path, filename.split('__')[0] + '.txt')
+            try:
+                name_stat = os.stat(name_path)
+            except OSError:
+                return None
+
+        if self.cache is not None:
+            name = self.cache.lookup_name(image_path, name_stat)
+            if name is not None:
+                return name
+
+        with open(name_path, 'r') as f:
+            name = f.read().strip()
+        if self.cache is not None:
+            self.cache.put_name(image_path, name_stat, name)
+        return name
 
     def create_data(self, name):
         """
@@ -72,43 +373,244 @@ class FaceReco():
                     print("Data saved successfully!")
                 except:
                     print("Data not saved.")
+                else:
+                    self.add_face(name)
                 break
 
         # Release the video capture and close the windows
         video_capture.release()
         cv2.destroyAllWindows()
 
-    def recognize_faces(self, frame):
+    def add_face(self, name):
+        """
+        Encode the saved reference images of a person and add them to the known faces and the
+        encoding cache without reloading any other face. Images that are cached are not encoded again.
+
+        Args:
+            name (str): The name the images were saved under.
+
+        Returns:
+            bool: True if a face was found and added, False if not.
+        """
+        if self.cache is not None and not self.cache.loaded:
+            self.cache.load()
+
+        image_paths = self._person_images(name)
+        if not image_paths:
+            print(f"No image found for '{name}'.")
+            return False
+
+        images = {}
+        known_name = None
+        for image_path in image_paths:
+            filename = os.path.basename(image_path)
+            face_encoding = self._load_encoding(image_path)
+            known_name = self._load_name(image_path, filename) or known_name
+            if face_encoding is None:
+                print(f"No face found in '{filename}'.")
+            else:
+                self._keep_reference(images, image_path, face_encoding)
+        if self.cache is not None:
+            self.cache.save()
+
+        if not images:
+            return False
+        if known_name is None:
+            print(f"No name file found for '{name}'.")
+            return False
+
+        self.reference_images[known_name] = images
+        self.gallery.replace(known_name, self._reference_encodings(images))
+        return True
+
+    def replace_face(self, name):
+        """
+        Re-encode only the replaced image of a person and swap it in for the old encoding. The other
+        reference images of the person come from the cache.
+
+        Args:
+            name (str): The name whose image was replaced.
+
+        Returns:
+            bool: True if a face was found and replaced, False if not.
+        """
+        return self.add_face(name)
+
+    def remove_face(self, name):
+        """
+        Remove a person from the known faces, the encoding cache and the saved data.
+
+        Args:
+            name (str): The name to remove.
+        """
+        if self.cache is not None and not self.cache.loaded:
+            self.cache.load()
+
+        image_paths = self._person_images(name)
+        name_path = os.path.join(self.known_names_path, f"{name}.txt")
+
+        # The gallery knows the person by the name stored in the name file
+        known_name = name
+        if image_paths:
+            known_name = self._load_name(image_paths[0], os.path.basename(image_paths[0])) or name
+        for path in image_paths + [name_path]:
+            if os.path.isfile(path):
+                os.remove(path)
+
+        self.gallery.remove(known_name)
+        self.reference_images.pop(known_name, None)
+        if self.cache is not None:
+            for image_path in image_paths:
+                self.cache.remove(image_path)
+            self.cache.save()
+
+    def _locate_faces(self, frame):
+        """
+        Detect faces on the downscaled detection frame and map them back to full resolution.
+
+        Args:
+            frame (numpy.ndarray): The full resolution RGB frame.
+
+        Returns:
+            List: The face locations in the full frame as (top, right, bottom, left).
+        """
+        small_frame, offset = downscale_frame(frame, self.detection_scale, self.detection_roi)
+        with METRICS.timer('face_locations'):
+            boxes = [css_to_xyxy(face_location) for face_location in face_recognition.face_locations(small_frame)]
+        return [xyxy_to_css(box) for box in upscale_boxes(boxes, self.detection_scale, offset)]
+
+    def _identify(self, frame, face_locations):
+        """
+        Encode the faces at the given locations and match them against the known faces.
+
+        Args:
+            frame (numpy.ndarray): The full resolution RGB frame the faces are in.
+            face_locations (list): The face locations as (top, right, bottom, left).
+
+        Returns:
+            Tuple: The matched names and their distances, in the order of the locations.
+        """
+        if not face_locations:
+            return [], []
+
+        with METRICS.timer('face_encodings'):
+            if self.encode_full_res or self.detection_scale == 1.0:
+                new_face_encodings = face_recognition.face_encodings(frame, face_locations)
+            else:
+                scale = self.detection_scale
+                small_frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                small_boxes = [[v * scale for v in css_to_xyxy(face_location)] for face_location in face_locations]
+                new_face_encodings = face_recognition.face_encodings(
+                    small_frame, [xyxy_to_css(box) for box in small_boxes])
+
+        # Match every face in the frame against the whole gallery at once
+        with METRICS.timer('matching'):
+            return self.gallery.match(new_face_encodings)
+
+    def recognize_faces(self, frame, boxes=None, refine=False):
         """
         Perform face recognition on a given frame.
 
         Args:
-            frame (numpy.ndarray): The frame to perform face recognition on.
+            frame (numpy.ndarray): The RGB frame to perform face recognition on. Frames from OpenCV
+                are BGR and have to be converted first.
+            boxes (list): Precomputed detections as x1, y1, x2, y2, for example YOLO xyxy boxes.
+                Only these regions are encoded instead of running face detection on the whole frame.
+            refine (bool): Run face detection inside each box to find the face in it. Needed when
+                the boxes are not tight face boxes, for example YOLO person boxes.
 
         Returns:
-            List: A list of recognized faces, each containing the name and bounding box coordinates.
+            List: A list of recognized faces, each containing the name, bounding box coordinates
+            and the distance to the closest known face. When boxes are given there is one entry
+            per box in the same order, with the name None if no face was found inside the box.
         """
-        # Load known face encodings and names
         list_of_faces = []
-        known_face_encodings = [item[0] for item in self.known_face_encodings]
-        known_names = [item[1] for item in self.known_face_encodings]
-        face_locations = face_recognition.face_locations(frame)
-        new_face_encodings = face_recognition.face_encodings(frame, face_locations)
+        if boxes is None:
+            face_locations = self._locate_faces(frame)
+            names, distances = self._identify(frame, face_locations)
+
+            for face_location, name, distance in zip(face_locations, names, distances):
+                top, right, bottom, left = face_location
+                list_of_faces.append([name, [left, top, right, bottom], float(distance)])
+
+            return list_of_faces
+
+        height, width = frame.shape[:2]
+        face_locations = []
+        for box in boxes:
+            top, right, bottom, left = xyxy_to_css(box)
+            top, left = max(top, 0), max(left, 0)
+            bottom, right = min(bottom, height), min(right, width)
+            if bottom <= top or right <= left:
+                face_locations.append(None)
+                continue
+
+            if refine:
+                # Look for the largest face inside the detection and move it back into frame coordinates
+                crop, _ = downscale_frame(frame[top:bottom, left:right], self.detection_scale)
+                with METRICS.timer('face_locations'):
+                    crop_locations = face_recognition.face_locations(crop)
+                if not crop_locations:
+                    face_locations.append(None)
+                    continue
+                crop_box = css_to_xyxy(max(crop_locations, key=lambda l: (l[2] - l[0]) * (l[1] - l[3])))
+                face_locations.append(xyxy_to_css(upscale_boxes([crop_box], self.detection_scale, (left, top))[0]))
+            else:
+                face_locations.append((top, right, bottom, left))
 
-        for face_location, new_face_encoding in zip(face_locations, new_face_encodings):
+        found = [face_location for face_location in face_locations if face_location is not None]
+        names, distances = self._identify(frame, found)
+        matches = iter(zip(names, distances))
+
+        for face_location in face_locations:
+            if face_location is None:
+                list_of_faces.append([None, None, None])
+                continue
+            name, distance = next(matches)
             top, right, bottom, left = face_location
-            matches = face_recognition.compare_faces(known_face_encodings, new_face_encoding)
-            matched_indices = [i for i, match in enumerate(matches) if match]
+            list_of_faces.append([name, [left, top, right, bottom], float(distance)])
 
-            if matched_indices:
-                first_matched_index = matched_indices[0]
-                name = known_names[first_matched_index]
-            else:
-                name = "unknown"
+        return list_of_faces
+
+    def add_reference_data(self, name):
+        """
+        Capture another reference image of a registered person, for example in different lighting,
+        and add it to the reference set of the person.
 
-            list_of_faces.append([name, [left, top, right, bottom]])
+        Args:
+            name (str): The name the person was registered under.
+        """
+        if not os.path.isfile(os.path.join(self.known_names_path, f"{name}.txt")):
+            print(f"No existing data found for '{name}'.")
+            return
 
-        return list_of_faces
+        video_capture = cv2.VideoCapture(0)
+
+        while True:
+            # Capture frame-by-frame from the webcam
+            ret, frame = video_capture.read()
+
+            # Display the frame
+            cv2.imshow('Video', frame)
+
+            # Wait for 'q' key to exit and capture the image
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                try:
+                    # Save the image next to the other images of the person
+                    suffix = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+                    image_path = os.path.join(self.known_faces_path, f"{name}__{suffix}.jpg")
+                    cv2.imwrite(image_path, frame)
+
+                    print("Reference image saved successfully!")
+                except:
+                    print("Reference image not saved.")
+                else:
+                    self.add_face(name)
+                break
+
+        # Release the video capture and close the windows
+        video_capture.release()
+        cv2.destroyAllWindows()
 
     def replace_data(self, name):
         """
@@ -138,6 +640,8 @@ class FaceReco():
                         print("Data replaced successfully!")
                     except:
                         print("Data not replaced.")
+                    else:
+                        self.replace_face(name)
                     break
 
             # Release the video capture and close the windows
@@ -146,42 +650,43 @@ class FaceReco():
         else:
             print(f"No existing data found for '{name}'.")
 
-    def runfacerec(self):
+    def runfacerec(self, source=0, reverify_every=None):
         """
         Perform real-time face recognition using webcam video stream.
+        Camera reads, recognition and drawing run on separate threads, so that frames
+        do not pile up behind a slow recognition step. Faces are tracked between frames
+        and only new tracks are encoded and matched.
+
+        Args:
+            source (int or str): Camera index, video file, stream URL or image directory to read frames from.
+            reverify_every (int): Frames after which a recognized face is recognized again. None never re-verifies.
         """
-        # Open the video capture from the webcam
         #self.create_known_faces()
-        video_capture = cv2.VideoCapture(0)
-
-        # Check if the video capture was successfully opened
-        if not video_capture.isOpened():
-            print("Error opening video capture")
-            return
-
+        tracker = FaceTracker(reverify_every=reverify_every)
         start_time = time.time()
         frame_count = 0
-        old_names = []
+        old_names = set()
 
-        # Iterate over each frame in the video stream
-        while True:
-            new_names = []
+        def process(frame):
+            # face_recognition works on RGB, OpenCV delivers BGR
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            face_locations = self._locate_faces(rgb_frame)
+            tracks = tracker.update([css_to_xyxy(face_location) for face_location in face_locations])
 
-            # Read the current frame
-            ret, frame = video_capture.read()
+            # Only encode the faces of tracks that have not been recognized yet
+            due = tracker.due(tracks)
+            names, distances = self._identify(rgb_frame, [xyxy_to_css(track.box) for track in due])
+            for track, name, distance in zip(due, names, distances):
+                tracker.identify(track, name, float(distance))
 
-            # If the frame was not read successfully, exit the loop
-            if not ret:
-                break
+            data = [[track.name or "unknown", [int(v) for v in track.box], track.distance] for track in tracks]
+            return data, tracker.names()
 
-            # Perform face recognition on the frame
-            data = self.recognize_faces(frame)
+        def render(frame, result):
+            nonlocal frame_count, old_names
+            data, new_names = result
 
             # Determine entered and exited faces
-            for f in data:
-                new_names.append(f[0])
-            new_names = set(new_names)
-            old_names = set(old_names)
             entered = list(new_names - old_names)
             if entered:
                 entered.append(time.strftime("%Y-%m-%d %H:%M:%S"))
@@ -198,7 +703,7 @@ class FaceReco():
 
             # Display the frame with bounding boxes and names
             for face in data:
-                name, bounding_box = face
+                name, bounding_box = face[0], face[1]
                 left, top, right, bottom = bounding_box
 
                 # Draw bounding box
@@ -219,9 +724,10 @@ class FaceReco():
             cv2.imshow("Frame with Bounding Boxes", frame)
 
             # Wait for the 'q' key to be pressed to exit the loop
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+            return not (cv2.waitKey(1) & 0xFF == ord('q'))
 
-        # Release the video capture object and close any open windows
-        video_capture.release()
+        # Perform face recognition on the frames in the background
+        Pipeline(source, process, render).run()
+
+        # Close any open windows
         cv2.destroyAllWindows()
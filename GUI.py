@@ -1,9 +1,21 @@
 import tkinter as tk
+import queue
+import threading
+import collections
 from datetime import datetime
 from tkinter import messagebox
 from PIL import ImageTk, Image
 import DataVisualization
 
+# Largest size of the live preview, frames are shrunk on the recognition thread to fit
+PREVIEW_SIZE = (480, 270)
+# Milliseconds between two looks at the preview queue
+POLL_INTERVAL = 30
+# Milliseconds the window has to keep its size before the background is resized
+RESIZE_DELAY = 100
+# Number of resized backgrounds kept, so that going back to an earlier size is free
+RESIZE_CACHE_SIZE = 4
+
 
 class GUI:
     def __init__(self, attendance_tracker):
@@ -20,6 +32,9 @@ class GUI:
         self.background_label = None
         self.background_image = None
         self.overlay_photo = None
+        self.resized_backgrounds = collections.OrderedDict()
+        self.resize_job = None
+        self.pending_size = None
         self.image = Image.open("Images/background.png")
         self.logo = Image.open("Images/kpitlogo.png")
         # Display the images
@@ -32,6 +47,21 @@ class GUI:
         self.attendance = attendance_tracker
         self.visualization = DataVisualization.DataVis(self.attendance.database)
 
+        # Recognition runs on a worker thread and hands its frames over through this queue
+        self.worker = None
+        self.preview_queue = queue.Queue(maxsize=1)
+        self.preview_label = None
+        self.preview_photo = None
+        self.present_label = None
+        self.new_entry_button = None
+
+    def recognition_running(self):
+        """
+        Whether the worker thread is running the facial recognition
+        :return: True while it runs
+        """
+        return self.worker is not None and self.worker.is_alive()
+
     def display_images(self):
         """
         Displays the background and logo images
@@ -53,15 +83,35 @@ class GUI:
 
     def resize_image(self, event):
         """
-        Resizes an image to fit the screen
+        Resizes the background to fit the window once the window stops changing size.
+        Configure events arrive for every pixel of a drag and for every child widget,
+        so they only schedule the resize
         :param event: the event being resized
         :return:
         """
-        new_width = event.width
-        new_height = event.height
-        resized_image = self.image.resize((new_width, new_height))
-        self.background_image = ImageTk.PhotoImage(resized_image)
-        self.background_label.configure(image=self.background_image)
+        if event.widget is not self.top:
+            return
+        self.pending_size = (event.width, event.height)
+        if self.resize_job is not None:
+            self.top.after_cancel(self.resize_job)
+        self.resize_job = self.top.after(RESIZE_DELAY, self.apply_resize)
+
+    def apply_resize(self):
+        """
+        Resizes the background to the last size the window was given, reusing earlier resizes
+        :return:
+        """
+        self.resize_job = None
+        size = self.pending_size
+        if size in self.resized_backgrounds:
+            self.resized_backgrounds.move_to_end(size)
+        else:
+            self.resized_backgrounds[size] = ImageTk.PhotoImage(self.image.resize(size))
+            if len(self.resized_backgrounds) > RESIZE_CACHE_SIZE:
+                self.resized_backgrounds.popitem(last=False)
+        if self.background_image is not self.resized_backgrounds[size]:
+            self.background_image = self.resized_backgrounds[size]
+            self.background_label.configure(image=self.background_image)
 
     def update_time(self):
         """
@@ -74,9 +124,14 @@ class GUI:
 
     def display_message_submit_entry(self):
         """
-        Submits the new entry into the database and facial recognition system
+        Submits the new entry into the database and facial recognition system. Enrolling changes the
+        known faces the worker matches against and needs the camera the worker reads, so it waits
+        until the facial recognition is stopped
         :return:
         """
+        if self.recognition_running():
+            messagebox.showinfo("Popup", "Stop Facial Recognition before submitting a new entry")
+            return
         first_name = self.entry1.get()
         employee_id = self.entry2.get()
 
@@ -90,16 +145,79 @@ class GUI:
 
     def display_message_start(self):
         """
-        Starts the facial recognition code
+        Starts the facial recognition code on a worker thread, so the window keeps responding.
+        The annotated frames are shown in the preview below the buttons
         :return:
         """
-        self.attendance.detect_faces_and_count()
+        if self.recognition_running():
+            messagebox.showinfo("Popup", "Facial Recognition is already running")
+            return
+        self.new_entry_button.configure(state=tk.DISABLED)
+        self.attendance.reset_stop()
+        self.worker = threading.Thread(target=self.run_recognition, name='recognition', daemon=True)
+        self.worker.start()
+        self.top.after(POLL_INTERVAL, self.poll_preview)
+
+    def run_recognition(self):
+        """
+        Runs the facial recognition on the worker thread
+        :return:
+        """
+        try:
+            self.attendance.detect_faces_and_count(display=False, preview=self.queue_preview)
+        except Exception as e:
+            print(f"Facial recognition stopped with an error: {e}")
+
+    def queue_preview(self, camera_id, frame, names):
+        """
+        Hands a frame to the Tk thread. Runs on the worker thread, where the frame is converted
+        and shrunk. Tk widgets may only be touched from the Tk thread
+        :param camera_id: the camera the frame came from
+        :param frame: the annotated BGR frame
+        :param names: the names present in the frame
+        :return:
+        """
+        image = Image.fromarray(frame[:, :, ::-1].copy())
+        image.thumbnail(PREVIEW_SIZE)
+        # Only the newest frame matters, replace the one Tk has not picked up yet
+        try:
+            self.preview_queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.preview_queue.put((image, sorted(names)))
+
+    def poll_preview(self):
+        """
+        Shows the newest frame from the worker and keeps polling while it runs
+        :return:
+        """
+        try:
+            image, names = self.preview_queue.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            self.preview_photo = ImageTk.PhotoImage(image)
+            self.preview_label.configure(image=self.preview_photo)
+            self.present_label.config(text="Present: " + (", ".join(names) if names else "nobody"))
+
+        if self.recognition_running():
+            self.top.after(POLL_INTERVAL, self.poll_preview)
+        else:
+            self.worker = None
+            self.new_entry_button.configure(state=tk.NORMAL)
+            self.preview_photo = None
+            self.preview_label.configure(image='')
+            self.present_label.config(text="")
+            messagebox.showinfo("Popup", "Facial Recognition Ended")
 
     def name_entry_gui(self):
         """
         Pops up a new GUI window to enter a new entry (face)
         :return:
         """
+        if self.recognition_running():
+            messagebox.showinfo("Popup", "Stop Facial Recognition before making a new entry")
+            return
         self.front = tk.Toplevel(self.top)
 
         self.front.title("Data Entry")
@@ -142,10 +260,14 @@ class GUI:
 
     def display_message_end(self):
         """
-        Ends the facial recognition code
+        Ends the facial recognition code. The worker finishes the frame it is on and writes the
+        remaining events, the preview reports when it has ended
         :return:
         """
-        messagebox.showinfo("Popup", "Facial Recognition Ended")
+        if not self.recognition_running():
+            messagebox.showinfo("Popup", "Facial Recognition is not running")
+            return
+        self.attendance.stop()
 
     def display_hours(self):
         # Get the entered information
@@ -230,7 +352,7 @@ class GUI:
 
         # Set the starting window size
         window_width = 800  # Desired width
-        window_height = 360  # Desired height
+        window_height = 680  # Desired height, room for the preview
         self.top.geometry(f"{window_width}x{window_height}")
 
         #Display current time
@@ -240,9 +362,9 @@ class GUI:
         self.time_label.pack(anchor="center")
         self.update_time()
 
-        #Button to make new entry
-        B1 = tk.Button(self.top, text="Make new entry", command = self.name_entry_gui, cursor = "hand2")
-        B1.pack(anchor="center")
+        #Button to make new entry, disabled while the facial recognition runs
+        self.new_entry_button = tk.Button(self.top, text="Make new entry", command = self.name_entry_gui, cursor = "hand2")
+        self.new_entry_button.pack(anchor="center")
 
         #Button to start facial recognition
         B3 = tk.Button(self.top, text="Start", command = self.display_message_start, cursor = "hand2")
@@ -256,7 +378,13 @@ class GUI:
         B5 = tk.Button(self.top, text="Download CSV", command = self.download_csv, cursor = "hand2")
         B5.pack(anchor="center")
 
-        B6 = tk.Button(self.top, text="End", command = self.display_message_end, cursor = "hand2")
+        B6 = tk.Button(self.top, text="Stop", command = self.display_message_end, cursor = "hand2")
         B6.pack(anchor="center")
+
+        # Live preview of the recognition
+        self.present_label = tk.Label(self.top)
+        self.present_label.pack(anchor="center")
+        self.preview_label = tk.Label(self.top)
+        self.preview_label.pack(anchor="center")
         self.top.mainloop()
 
@@ -0,0 +1,361 @@
+'''The in-memory gallery of known face encodings used for matching.'''
+import os
+import numpy as np
+
+ENCODING_SIZE = 128
+
+# Rows decoded and compared at a time when the gallery is stored quantized
+SCAN_CHUNK = 16384
+
+# Encoding values are spread over the int8 range as if they were within this range until
+# a large enough batch shows their actual range
+INT8_DEFAULT_RANGE = 0.5
+INT8_CALIBRATION_ROWS = 100
+
+
+def compact_encodings(encodings, max_exemplars=3, outlier_distance=0.25):
+    """
+    Reduce the reference encodings of one person to their centroid plus the references that
+    are far from it, for example photos taken in other lighting or from another angle.
+    Exemplars are picked farthest first, so every reference ends up close to a kept encoding
+    whenever max_exemplars allows it.
+
+    Args:
+        encodings (numpy.ndarray): The (M, 128) reference encodings of a person.
+        max_exemplars (int): The largest number of references kept next to the centroid.
+        outlier_distance (float): References closer than this to a kept encoding are represented by it.
+
+    Returns:
+        numpy.ndarray: The (K, 128) kept encodings, K <= max_exemplars + 1, the centroid first.
+    """
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+    if len(encodings) <= 1:
+        return encodings
+
+    kept = [encodings.mean(axis=0)]
+    # Distance of every reference to the closest kept encoding
+    distances = np.linalg.norm(encodings - kept[0], axis=1)
+    for _ in range(max_exemplars):
+        farthest = int(np.argmax(distances))
+        if distances[farthest] <= outlier_distance:
+            break
+        kept.append(encodings[farthest])
+        distances = np.minimum(distances, np.linalg.norm(encodings - encodings[farthest], axis=1))
+    return np.array(kept, dtype=np.float32)
+
+'''A class that keeps every known encoding in one contiguous matrix next to a parallel array of name IDs.
+Only the compacted rows are kept, the reference encodings they were made from belong to the caller.'''
+class Gallery():
+    def __init__(self, tolerance=0.6, index=None, max_exemplars=3, outlier_distance=0.25, precision='float32'):
+        """
+        Initialize an empty gallery.
+
+        Args:
+            tolerance (float): The largest face distance that still counts as a match.
+                Matches further away than this are reported as "unknown".
+            index (IVFIndex): Optional approximate nearest neighbor index used to search large galleries.
+            max_exemplars (int): Reference encodings kept per person next to their centroid.
+            outlier_distance (float): How far a reference may be from the kept encodings before it is
+                kept as an exemplar of its own.
+            precision (str): How the matrix is stored. 'float32', 'float16' for half the memory, or 'int8'
+                for a quarter, quantized per dimension with a scale and offset. Quantized rows are
+                decoded a chunk at a time while matching.
+        """
+        if precision not in ('float32', 'float16', 'int8'):
+            raise ValueError(f"Unknown gallery precision {precision}")
+        self.tolerance = tolerance
+        self.index = index
+        self.max_exemplars = max_exemplars
+        self.outlier_distance = outlier_distance
+        self.precision = precision
+        self.scale = None
+        self.offset = None
+        self._encodings = np.empty((0, ENCODING_SIZE), dtype=np.dtype(precision))
+        self._norms = np.empty(0, dtype=np.float32)
+        # Every name is stored once, the rows hold its position in _labels
+        self._ids = np.empty(0, dtype=np.int32)
+        self._labels = []
+        self._label_ids = {}
+        # Number of rows of every name ID
+        self._counts = np.zeros(0, dtype=np.int32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def encodings(self):
+        """The (N, 128) float32 matrix of known encodings, decoded if the gallery is quantized."""
+        return self._decode(self._encodings[:self._size])
+
+    @property
+    def names(self):
+        """The names belonging to each row of `encodings`."""
+        return np.array(self._labels, dtype=object)[self._ids[:self._size]]
+
+    @property
+    def nbytes(self):
+        """The memory used by the rows of the matrix, their norms and name IDs, without the names themselves."""
+        return self._size * (self._encodings.itemsize * ENCODING_SIZE + self._norms.itemsize + self._ids.itemsize)
+
+    def _encode(self, encodings):
+        """
+        Convert float32 encodings to the storage precision.
+        """
+        if self.precision == 'float32':
+            return encodings
+        if self.precision == 'float16':
+            return encodings.astype(np.float16)
+
+        if self.scale is None:
+            if self._size == 0 and len(encodings) >= INT8_CALIBRATION_ROWS:
+                low, high = encodings.min(axis=0), encodings.max(axis=0)
+            else:
+                low, high = np.full(ENCODING_SIZE, -INT8_DEFAULT_RANGE), np.full(ENCODING_SIZE, INT8_DEFAULT_RANGE)
+            self.offset = ((high + low) / 2).astype(np.float32)
+            self.scale = (np.maximum(high - low, 1e-6) / 254).astype(np.float32)
+        # Values outside the calibrated range are clipped
+        return np.clip(np.rint((encodings - self.offset) / self.scale), -127, 127).astype(np.int8)
+
+    def _decode(self, stored):
+        """
+        Convert stored rows back to float32.
+        """
+        if self.precision == 'float32':
+            return stored
+        if self.precision == 'float16':
+            return stored.astype(np.float32)
+        return stored.astype(np.float32) * self.scale + self.offset
+
+    def _label_id(self, name):
+        """
+        Get the ID of a name, interning it on first use.
+        """
+        label_id = self._label_ids.get(name)
+        if label_id is None:
+            label_id = self._label_ids[name] = len(self._labels)
+            self._labels.append(name)
+            if label_id >= len(self._counts):
+                counts = np.zeros(max(2 * len(self._counts), 16), dtype=np.int32)
+                counts[:len(self._counts)] = self._counts
+                self._counts = counts
+        return label_id
+
+    def clear(self):
+        """
+        Remove every encoding from the gallery.
+        """
+        self._size = 0
+        self._counts[:] = 0
+        self.scale = None
+        self.offset = None
+        if self.index is not None:
+            self.index.clear()
+
+    def _reserve(self, capacity):
+        """
+        Grow the backing arrays so they can hold at least `capacity` rows.
+        Capacity is doubled so that repeated appends stay amortized O(1).
+        """
+        if capacity <= len(self._encodings):
+            return
+        new_capacity = max(capacity, 2 * len(self._encodings), 16)
+        encodings = np.empty((new_capacity, ENCODING_SIZE), dtype=self._encodings.dtype)
+        encodings[:self._size] = self._encodings[:self._size]
+        norms = np.empty(new_capacity, dtype=np.float32)
+        norms[:self._size] = self._norms[:self._size]
+        ids = np.empty(new_capacity, dtype=np.int32)
+        ids[:self._size] = self._ids[:self._size]
+        self._encodings = encodings
+        self._norms = norms
+        self._ids = ids
+
+    @property
+    def identities(self):
+        """The number of different names in the gallery."""
+        return int(np.count_nonzero(self._counts))
+
+    def _append(self, encodings, names):
+        """
+        Append rows to the matrix.
+        """
+        start = self._size
+        end = start + len(encodings)
+        self._reserve(end)
+        self._encodings[start:end] = self._encode(encodings)
+        # Norms of the stored values, so quantized distances stay consistent
+        decoded = self._decode(self._encodings[start:end])
+        self._norms[start:end] = np.einsum('ij,ij->i', decoded, decoded)
+        for row, name in enumerate(names, start):
+            self._ids[row] = self._label_id(name)
+        self._counts += np.bincount(self._ids[start:end], minlength=len(self._counts)).astype(np.int32)
+        self._size = end
+        if self.index is not None:
+            self.index.add(start, decoded)
+
+    def add(self, encodings, names):
+        """
+        Append encodings and their names to the gallery as they are, without compacting them.
+
+        Args:
+            encodings (numpy.ndarray): One encoding or an (M, 128) matrix of encodings.
+            names (str or list): The name, or a list of M names, for the encodings.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if isinstance(names, str):
+            names = [names]
+        if len(names) != len(encodings):
+            raise ValueError("Every encoding needs exactly one name.")
+        self._append(encodings, list(names))
+
+    def add_identities(self, references):
+        """
+        Add the reference encodings of many people at once, compacting the references of each person.
+        Earlier rows of the names are replaced, so every call has to pass all of a person's references.
+
+        Args:
+            references (dict): The (M, 128) reference encodings of every name.
+        """
+        kept = []
+        names = []
+        for name, encodings in references.items():
+            self.remove(name)
+            encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+            if len(encodings) == 0:
+                continue
+            compacted = compact_encodings(encodings, self.max_exemplars, self.outlier_distance)
+            kept.append(compacted)
+            names.extend([name] * len(compacted))
+        if kept:
+            self._append(np.concatenate(kept), names)
+
+    def remove(self, name):
+        """
+        Remove every encoding belonging to a name. The last rows are moved into the
+        freed slots so that no other row has to be shifted.
+
+        Args:
+            name (str): The name to remove.
+
+        Returns:
+            int: The number of removed encodings.
+        """
+        label_id = self._label_ids.get(name)
+        if label_id is None or self._counts[label_id] == 0:
+            return 0
+        indices = np.flatnonzero(self._ids[:self._size] == label_id)
+        self._counts[label_id] = 0
+        # Highest rows first, so the moved last row never belongs to the removed name
+        for index in indices[::-1]:
+            last = self._size - 1
+            if index != last:
+                self._encodings[index] = self._encodings[last]
+                self._norms[index] = self._norms[last]
+                self._ids[index] = self._ids[last]
+            self._size -= 1
+            if self.index is not None:
+                self.index.swap_remove(index, last)
+        return len(indices)
+
+    def replace(self, name, encodings):
+        """
+        Replace the reference encodings of a name, adding the name if it is not known yet.
+
+        Args:
+            name (str): The name to replace.
+            encodings (numpy.ndarray): One encoding or an (M, 128) matrix of reference encodings.
+        """
+        self.add_identities({name: encodings})
+
+    def build_index(self, path=None):
+        """
+        Prepare the index for searching the gallery. Clusters saved at path are reused, so only a
+        gallery that outgrew them is clustered again.
+
+        Args:
+            path (str): File the clusters are saved to and loaded from.
+
+        Returns:
+            bool: True if matching uses the index, False if it scans the whole gallery.
+        """
+        if self.index is None:
+            return False
+        if not self.index.trained and path is not None and os.path.exists(path):
+            self.index.load(path)
+        if self.index.needs_training(self._size):
+            self.index.train(self.encodings)
+            if path is not None:
+                self.index.save(path)
+        elif self.index.trained and len(self.index) != self._size:
+            self.index.rebuild(self.encodings)
+        return self.index.ready(self._size)
+
+    def match(self, encodings, tolerance=None, exact=False):
+        """
+        Find the closest known identity for every query encoding in one batched computation.
+        Large galleries with a built index only search the closest clusters and verify the best
+        candidates there with exact distances.
+
+        Args:
+            encodings (numpy.ndarray or list): The query encodings of the faces in a frame.
+            tolerance (float): Overrides the gallery tolerance for this call.
+            exact (bool): Scan the whole gallery even if there is an index.
+
+        Returns:
+            Tuple: A list of names ("unknown" where nothing is close enough) and a
+            numpy array with the distance to the closest known encoding.
+        """
+        if tolerance is None:
+            tolerance = self.tolerance
+
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if len(queries) == 0:
+            return [], np.empty(0, dtype=np.float32)
+        if self._size == 0:
+            return ["unknown"] * len(queries), np.full(len(queries), np.inf, dtype=np.float32)
+
+        if not exact and self.index is not None and self.index.ready(self._size):
+            candidates = self.index.search(queries, self._encodings[:self._size], self._norms[:self._size],
+                                           decode=self._decode)
+            rows = np.maximum(candidates, 0)
+            differences = self._decode(self._encodings[rows]) - queries[:, None, :]
+            candidate_distances = np.sqrt(np.einsum('ijk,ijk->ij', differences, differences))
+            candidate_distances[candidates < 0] = np.inf
+            picked = np.argmin(candidate_distances, axis=1)
+            closest = rows[np.arange(len(queries)), picked]
+            best = candidate_distances[np.arange(len(queries)), picked]
+        else:
+            closest, best = self._scan(queries)
+
+        names = [self._labels[self._ids[index]] if distance <= tolerance else "unknown"
+                 for index, distance in zip(closest, best)]
+        return names, best
+
+    def _scan(self, queries):
+        """
+        Compare the queries with every row of the gallery.
+
+        Returns:
+            Tuple: The closest row of every query and the distance to it.
+        """
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+        closest = np.zeros(len(queries), dtype=np.int64)
+        best = np.full(len(queries), np.inf, dtype=np.float32)
+        products = queries
+        if self.precision == 'int8':
+            # q.(scale * k + offset) = (q * scale).k + q.offset, so the rows only need a cast
+            products = queries * self.scale
+            query_norms = query_norms - 2.0 * queries @ self.offset
+        # float32 rows are compared in one go, quantized rows are cast a chunk at a time
+        chunk = self._size if self.precision == 'float32' else SCAN_CHUNK
+        for start in range(0, self._size, chunk):
+            end = min(start + chunk, self._size)
+            known = self._encodings[start:end].astype(np.float32, copy=False)
+            # Squared euclidean distance expanded as |q|^2 + |k|^2 - 2 q.k so the whole frame is one matrix product
+            distances = query_norms[:, None] + self._norms[None, start:end] - 2.0 * products @ known.T
+            chunk_closest = np.argmin(distances, axis=1)
+            chunk_best = np.sqrt(np.maximum(distances[np.arange(len(queries)), chunk_closest], 0.0))
+            better = chunk_best < best
+            closest[better] = start + chunk_closest[better]
+            best[better] = chunk_best[better]
+        return closest, best
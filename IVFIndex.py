@@ -0,0 +1,235 @@
+'''An inverted file (IVF) index that narrows the face search down to the closest k-means clusters.'''
+import os
+import numpy as np
+
+
+def squared_distances(queries, known, known_norms=None):
+    """
+    Squared euclidean distances between two sets of encodings, expanded as |q|^2 + |k|^2 - 2 q.k.
+
+    Args:
+        queries (numpy.ndarray): An (M, D) matrix.
+        known (numpy.ndarray): An (N, D) matrix.
+        known_norms (numpy.ndarray): The squared norms of the rows of known, if they are already known.
+
+    Returns:
+        numpy.ndarray: The (M, N) squared distances.
+    """
+    if known_norms is None:
+        known_norms = np.einsum('ij,ij->i', known, known)
+    return np.einsum('ij,ij->i', queries, queries)[:, None] + known_norms[None, :] - 2.0 * queries @ known.T
+
+
+'''A class that assigns every gallery row to its closest k-means centroid and searches only the closest clusters.'''
+class IVFIndex():
+    def __init__(self, n_lists=None, nprobe=8, rerank=4, min_size=10000, iterations=10, sample_size=256, seed=0):
+        """
+        Initialize an untrained index.
+
+        Args:
+            n_lists (int): The number of k-means clusters. Defaults to the square root of the gallery size.
+            nprobe (int): The number of closest clusters searched per query. Higher values find the true
+                nearest encoding more often and take longer; nprobe == n_lists is an exact search.
+            rerank (int): The number of best candidates of a query returned for exact verification.
+            min_size (int): Galleries smaller than this are searched by brute force, which is faster there.
+            iterations (int): The number of k-means iterations when training.
+            sample_size (int): The number of training encodings per cluster.
+            seed (int): Seed of the training sample, so the same gallery gives the same index.
+        """
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.min_size = min_size
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self._lists = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def ready(self, size):
+        """
+        Check whether a gallery of the given size should be searched with the index.
+        """
+        return self.trained and size >= self.min_size and self._size == size
+
+    def needs_training(self, size):
+        """
+        Check whether the index should be trained for a gallery of the given size. The clusters are
+        retrained when the gallery grew to four times the size they were trained on.
+        """
+        return size >= self.min_size and (not self.trained or size > 4 * self.trained_size)
+
+    def _assign(self, encodings, chunk=8192):
+        """
+        Find the closest centroid of every encoding, a chunk of rows at a time to bound the memory.
+        """
+        centroid_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        labels = np.empty(len(encodings), dtype=np.int32)
+        for start in range(0, len(encodings), chunk):
+            block = encodings[start:start + chunk]
+            labels[start:start + chunk] = np.argmin(squared_distances(block, self.centroids, centroid_norms), axis=1)
+        return labels
+
+    def train(self, encodings):
+        """
+        Cluster the encodings with k-means on a random sample and assign every encoding to a cluster.
+
+        Args:
+            encodings (numpy.ndarray): The (N, 128) gallery encodings.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32)
+        rng = np.random.default_rng(self.seed)
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(len(encodings)))), len(encodings))
+        sample = encodings[rng.choice(len(encodings), min(len(encodings), n_lists * self.sample_size),
+                                      replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            labels = np.argmin(squared_distances(sample, centroids), axis=1)
+            order = np.argsort(labels, kind='stable')
+            counts = np.bincount(labels, minlength=n_lists)
+            filled = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+            centroids[filled] = np.add.reduceat(sample[order], starts, axis=0) / counts[filled, None]
+            # Restart empty clusters on random encodings
+            empty = np.flatnonzero(counts == 0)
+            centroids[empty] = sample[rng.choice(len(sample), len(empty))]
+
+        self.centroids = centroids
+        self.trained_size = len(encodings)
+        self.rebuild(encodings)
+
+    def rebuild(self, encodings):
+        """
+        Assign every encoding to the cluster of its closest centroid, for example after loading the centroids.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32)
+        self._assignments = self._assign(encodings) if len(encodings) else np.empty(0, dtype=np.int32)
+        self._size = len(encodings)
+        self._lists = None
+
+    def add(self, start, encodings):
+        """
+        Assign rows appended to the gallery to their clusters.
+
+        Args:
+            start (int): The gallery row of the first encoding.
+            encodings (numpy.ndarray): The (M, 128) appended encodings.
+        """
+        if not self.trained or start != self._size:
+            return
+        end = start + len(encodings)
+        if end > len(self._assignments):
+            assignments = np.empty(max(end, 2 * len(self._assignments), 16), dtype=np.int32)
+            assignments[:self._size] = self._assignments[:self._size]
+            self._assignments = assignments
+        self._assignments[start:end] = self._assign(encodings)
+        self._size = end
+        self._lists = None
+
+    def swap_remove(self, index, last):
+        """
+        Follow the gallery moving its last row into a freed slot.
+
+        Args:
+            index (int): The freed row.
+            last (int): The last row, which is moved.
+        """
+        if not self.trained or last != self._size - 1:
+            return
+        self._assignments[index] = self._assignments[last]
+        self._size -= 1
+        self._lists = None
+
+    def clear(self):
+        """
+        Forget every row but keep the trained clusters.
+        """
+        self._size = 0
+        self._lists = None
+
+    def _inverted_lists(self):
+        """
+        Group the rows by cluster. Built lazily once after a change, so enrolling many faces costs one sort.
+        """
+        if self._lists is None:
+            assignments = self._assignments[:self._size]
+            order = np.argsort(assignments, kind='stable')
+            offsets = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, offsets)
+        return self._lists
+
+    def search(self, queries, encodings, norms=None, decode=None):
+        """
+        Find the best candidates of every query in its nprobe closest clusters.
+
+        Args:
+            queries (numpy.ndarray): The (M, 128) query encodings.
+            encodings (numpy.ndarray): The (N, 128) gallery encodings the index was built on.
+            norms (numpy.ndarray): The squared norms of the gallery encodings, if they are already known.
+            decode (callable): Converts rows of encodings to float32 if they are stored quantized.
+
+        Returns:
+            numpy.ndarray: An (M, rerank) array of candidate gallery rows, best first, padded with -1.
+        """
+        order, offsets = self._inverted_lists()
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroid_distances = squared_distances(queries, self.centroids)
+        probes = np.argpartition(centroid_distances, nprobe - 1, axis=1)[:, :nprobe]
+
+        candidates = np.full((len(queries), self.rerank), -1, dtype=np.int64)
+        for i, probe in enumerate(probes):
+            rows = np.concatenate([order[offsets[cluster]:offsets[cluster + 1]] for cluster in probe])
+            if len(rows) == 0:
+                continue
+            known = decode(encodings[rows]) if decode is not None else encodings[rows]
+            distances = squared_distances(queries[i:i + 1], known, norms[rows] if norms is not None else None)[0]
+            k = min(self.rerank, len(rows))
+            best = np.argpartition(distances, k - 1)[:k]
+            best = best[np.argsort(distances[best])]
+            candidates[i, :k] = rows[best]
+        return candidates
+
+    def save(self, path):
+        """
+        Save the trained clusters. The row assignments are not saved, they are rebuilt from the encodings.
+
+        Args:
+            path (str): The file to write, replaced atomically.
+        """
+        if not self.trained:
+            return
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, trained_size=self.trained_size)
+        os.replace(temp_path, path)
+
+    def load(self, path):
+        """
+        Load clusters saved with save.
+
+        Args:
+            path (str): The saved file.
+
+        Returns:
+            bool: True if the clusters could be loaded.
+        """
+        try:
+            with np.load(path) as data:
+                self.centroids = data['centroids'].astype(np.float32)
+                self.trained_size = int(data['trained_size'])
+        except (OSError, KeyError, ValueError):
+            return False
+        self._size = 0
+        self._lists = None
+        return True
@@ -0,0 +1,345 @@
+'''Lightweight per-stage latency metrics for the recognition loop, exposed as Prometheus text or a JSON log.'''
+import json
+import math
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prefix of every exported metric name
+METRIC_PREFIX = "facerec"
+
+
+'''A class that counts values in logarithmic buckets, so percentiles stay within a few percent at any scale.'''
+class Histogram():
+    # Buckets per doubling of the value, 8 keeps every percentile within 9% of the true value
+    SUBBUCKETS = 8
+
+    def __init__(self, lowest=1e-6, highest=1000.0):
+        """
+        Initialize an empty histogram.
+
+        Args:
+            lowest (float): The smallest value told apart, smaller values count into the first bucket.
+            highest (float): The largest value told apart, larger values count into the last bucket.
+        """
+        self.lowest = lowest
+        self.counts = [0] * (int(math.ceil(math.log2(highest / lowest) * self.SUBBUCKETS)) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        """
+        Count a value.
+        """
+        index = int(math.log2(value / self.lowest) * self.SUBBUCKETS) if value > self.lowest else 0
+        index = min(index, len(self.counts) - 1)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        """
+        Get a percentile of the counted values.
+
+        Args:
+            percent (float): The percentile, for example 99.
+
+        Returns:
+            float: The upper edge of the bucket the percentile falls in, at most the largest value.
+        """
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            rank = max(1, int(math.ceil(self.count * percent / 100)))
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(self.lowest * 2 ** ((index + 1) / self.SUBBUCKETS), self.max)
+            return self.max
+
+
+'''A context manager that does nothing, handed out while metrics are switched off.'''
+class _NullTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+'''A context manager that records the time spent in a with block.'''
+class _Timer():
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    labels = list(key) + list(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+'''A class that collects stage timers, counters and gauges and exports them.'''
+class Metrics():
+    def __init__(self, enabled=False):
+        """
+        Initialize the metrics. While switched off, timers and counters return right away.
+
+        Args:
+            enabled (bool): Start collecting right away.
+        """
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._logger = None
+        self._stop_logger = threading.Event()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """
+        Forget every recorded value. Registered gauges are kept.
+        """
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+
+    def timer(self, stage):
+        """
+        Time a with block as a stage, for example `with METRICS.timer('yolo'):`.
+
+        Args:
+            stage (str): The name of the stage.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        """
+        Record the duration of a stage.
+
+        Args:
+            stage (str): The name of the stage.
+            seconds (float): How long it took.
+        """
+        if not self.enabled:
+            return
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(stage, Histogram())
+        histogram.record(seconds)
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Add to a counter, for example increment('dropped_frames', queue='frames').
+
+        Args:
+            name (str): The name of the counter.
+            amount (int): The amount to add.
+            labels: Labels telling apart counters of the same name.
+        """
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, function, **labels):
+        """
+        Register a gauge that is read when the metrics are exported, for example a queue depth.
+
+        Args:
+            name (str): The name of the gauge.
+            function (callable): Returns the current value.
+            labels: Labels telling apart gauges of the same name.
+        """
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = function
+
+    def remove_gauge(self, name, **labels):
+        with self._lock:
+            self.gauges.pop((name, _label_key(labels)), None)
+
+    def _gauge_values(self):
+        values = {}
+        with self._lock:
+            gauges = list(self.gauges.items())
+        for key, function in gauges:
+            try:
+                values[key] = function()
+            except Exception:
+                pass
+        return values
+
+    def snapshot(self):
+        """
+        Get the current values.
+
+        Returns:
+            dict: Latency percentiles in milliseconds per stage, the counters and the gauges.
+        """
+        with self._lock:
+            stages = dict(self.stages)
+            counters = dict(self.counters)
+        return {
+            'time': time.time(),
+            'stages': {stage: {
+                'count': histogram.count,
+                'mean_ms': 1000 * histogram.sum / histogram.count if histogram.count else 0.0,
+                'p50_ms': 1000 * histogram.percentile(50),
+                'p95_ms': 1000 * histogram.percentile(95),
+                'p99_ms': 1000 * histogram.percentile(99),
+                'max_ms': 1000 * histogram.max,
+            } for stage, histogram in stages.items()},
+            'counters': {name + _format_labels(key): value for (name, key), value in counters.items()},
+            'gauges': {name + _format_labels(key): value for (name, key), value in self._gauge_values().items()},
+        }
+
+    def prometheus_text(self):
+        """
+        Format the current values in the Prometheus text exposition format.
+
+        Returns:
+            str: Stage latencies as a summary with quantiles, counters and gauges.
+        """
+        with self._lock:
+            stages = dict(self.stages)
+            counters = dict(self.counters)
+
+        lines = []
+        if stages:
+            name = f"{METRIC_PREFIX}_stage_seconds"
+            lines.append(f"# HELP {name} Time spent in each stage of the recognition loop.")
+            lines.append(f"# TYPE {name} summary")
+            for stage, histogram in sorted(stages.items()):
+                key = (('stage', stage),)
+                for quantile in (0.5, 0.95, 0.99):
+                    value = histogram.percentile(quantile * 100)
+                    lines.append(f"{name}{_format_labels(key, (('quantile', quantile),))} {value:.9f}")
+                lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum:.9f}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+            lines.append(f"# TYPE {name}_max gauge")
+            for stage, histogram in sorted(stages.items()):
+                lines.append(f"{name}_max{_format_labels((('stage', stage),))} {histogram.max:.9f}")
+
+        for counter in sorted(set(name for name, _ in counters)):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{counter}_total counter")
+            for (name, key), value in sorted(counters.items()):
+                if name == counter:
+                    lines.append(f"{METRIC_PREFIX}_{name}_total{_format_labels(key)} {value}")
+
+        gauges = self._gauge_values()
+        for gauge in sorted(set(name for name, _ in gauges)):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{gauge} gauge")
+            for (name, key), value in sorted(gauges.items()):
+                if name == gauge:
+                    lines.append(f"{METRIC_PREFIX}_{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9464, host='127.0.0.1'):
+        """
+        Serve the metrics in the Prometheus text format at http://host:port/metrics on a background
+        thread. Collecting is switched on.
+
+        Args:
+            port (int): The port to listen on.
+            host (str): The address to listen on. The default only accepts local connections.
+
+        Returns:
+            ThreadingHTTPServer: The running server.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.enable()
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        return self._server
+
+    def start_json_log(self, path=None, interval=10.0):
+        """
+        Write a snapshot as one JSON line every interval seconds on a background thread.
+        Collecting is switched on.
+
+        Args:
+            path (str): The file the lines are appended to. None prints them.
+            interval (float): Seconds between two snapshots.
+        """
+        def log():
+            while not self._stop_logger.wait(interval):
+                line = json.dumps(self.snapshot())
+                if path is None:
+                    print(line)
+                else:
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write(line + '\n')
+
+        self.enable()
+        self._stop_logger.clear()
+        self._logger = threading.Thread(target=log, name='metrics-log', daemon=True)
+        self._logger.start()
+
+    def stop(self):
+        """
+        Stop the HTTP server and the JSON log.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._logger is not None:
+            self._stop_logger.set()
+            self._logger.join()
+            self._logger = None
+
+
+# The metrics of this process, switched off until enabled, served or logged
+METRICS = Metrics()
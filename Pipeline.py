@@ -0,0 +1,460 @@
+'''A threaded frame pipeline that keeps camera reads, inference and rendering apart.'''
+import os
+import glob
+import time
+import threading
+import collections
+import cv2
+from Metrics import METRICS
+
+# Marks the end of the stream on the queues between the stages
+END_OF_STREAM = object()
+
+
+'''A bounded queue that throws away the oldest item instead of blocking the producer.'''
+class DropOldestQueue():
+    def __init__(self, maxsize=1, drop_oldest=True, name=None):
+        """
+        Initialize the queue.
+
+        Args:
+            maxsize (int): The maximum number of items held at once.
+            drop_oldest (bool): If True a put into a full queue drops the oldest item,
+                otherwise the put waits until there is room.
+            name (str): The name the queue's depth and dropped items are reported under in the metrics.
+        """
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.name = name
+        self.dropped = 0
+        self.closed = False
+        self._items = collections.deque()
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._items)
+
+    def put(self, item, force=False):
+        """
+        Add an item to the queue.
+
+        Args:
+            item: The item to add.
+            force (bool): Add the item even if the queue is full, used for the end of stream marker.
+
+        Returns:
+            bool: False if the queue was closed before the item could be added.
+        """
+        with self._condition:
+            while not force and not self.drop_oldest and len(self._items) >= self.maxsize and not self.closed:
+                self._condition.wait(0.1)
+            if self.closed:
+                return False
+            if not force and len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+                METRICS.increment('dropped_frames', queue=self.name)
+            self._items.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Take the oldest item out of the queue.
+
+        Args:
+            timeout (float): Seconds to wait for an item. None waits until one arrives.
+
+        Returns:
+            The item, or END_OF_STREAM if the queue was closed or the timeout expired.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items or self.closed, timeout):
+                return END_OF_STREAM
+            if not self._items:
+                return END_OF_STREAM
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        """
+        Close the queue and wake up everyone waiting on it.
+        """
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+'''A video source that reads a directory or glob of images as if it were a camera.'''
+class ImageSequenceSource():
+    def __init__(self, pattern):
+        """
+        Initialize the image sequence.
+
+        Args:
+            pattern (str): A directory of images or a glob pattern. Images are read in sorted order.
+        """
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*')
+        self.paths = sorted(path for path in glob.glob(pattern)
+                            if path.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')))
+        self.position = 0
+
+    def isOpened(self):
+        return self.position < len(self.paths)
+
+    def read(self):
+        """
+        Read the next image.
+
+        Returns:
+            Tuple: (ret, frame) in the same way as cv2.VideoCapture.read.
+        """
+        while self.position < len(self.paths):
+            frame = cv2.imread(self.paths[self.position])
+            self.position += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def release(self):
+        self.position = len(self.paths)
+
+
+def open_source(source):
+    """
+    Open a frame source.
+
+    Args:
+        source (int or str): A camera index, a video file, a stream URL, a directory of images
+            or a glob pattern of images.
+
+    Returns:
+        Tuple: The opened source and whether it is live. Live sources drop old frames when the
+        pipeline falls behind, recorded sources are played back without dropping any frame.
+    """
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        capture = cv2.VideoCapture(int(source))
+        # Keep the driver from queueing up stale frames behind our back
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return capture, True
+    if os.path.isdir(source) or glob.has_magic(source):
+        return ImageSequenceSource(source), False
+    live = '://' in source
+    return cv2.VideoCapture(source), live
+
+
+'''A class that runs capture, processing and rendering of frames on separate threads.'''
+class Pipeline():
+    def __init__(self, source, process, render, queue_size=1, drop_oldest=None):
+        """
+        Initialize the pipeline.
+
+        Args:
+            source (int or str): The frame source, see open_source.
+            process (callable): Called as process(frame) on the processing thread for every frame
+                it gets to. Its return value is handed on to render.
+            render (callable): Called as render(frame, result) on the thread that calls run.
+                Returning False stops the pipeline.
+            queue_size (int): Number of frames each queue between the stages can hold.
+            drop_oldest (bool): Whether the full frame queue drops its oldest frame. Defaults to True for
+                live sources and False for recorded ones. Processed results are never dropped, render
+                sees every one of them, so that changes render reacts to are not lost.
+        """
+        self.source = source
+        self.process = process
+        self.render = render
+        self.queue_size = queue_size
+        self.drop_oldest = drop_oldest
+        self.capture = None
+        self.frames = None
+        self.results = None
+        self.frames_read = 0
+        self.frames_processed = 0
+        self._stop = threading.Event()
+        self._error = None
+
+    @property
+    def dropped_frames(self):
+        """The number of frames that were thrown away because a later stage was busy."""
+        dropped = 0
+        for queue in (self.frames, self.results):
+            if queue is not None:
+                dropped += queue.dropped
+        return dropped
+
+    def stop(self):
+        """
+        Ask the pipeline to stop. Safe to call from any thread.
+        """
+        self._stop.set()
+        for queue in (self.frames, self.results):
+            if queue is not None:
+                queue.close()
+
+    def _capture_loop(self):
+        """
+        Read frames as fast as the source delivers them.
+        """
+        try:
+            while not self._stop.is_set():
+                with METRICS.timer('capture'):
+                    ret, frame = self.capture.read()
+                if not ret:
+                    break
+                self.frames_read += 1
+                if not self.frames.put(frame):
+                    break
+        finally:
+            self.frames.put(END_OF_STREAM, force=True)
+
+    def _process_loop(self):
+        """
+        Process the newest frame every time the previous one is done.
+        """
+        try:
+            while not self._stop.is_set():
+                frame = self.frames.get()
+                if frame is END_OF_STREAM:
+                    break
+                with METRICS.timer('process'):
+                    result = self.process(frame)
+                self.frames_processed += 1
+                if not self.results.put((frame, result)):
+                    break
+        except Exception as e:
+            self._error = e
+        finally:
+            self.results.put(END_OF_STREAM, force=True)
+
+    def run(self):
+        """
+        Run the pipeline until the source ends, render returns False or stop is called.
+        Rendering happens on the calling thread because OpenCV windows have to stay on one thread.
+        A pipeline runs once, if stop was called before it returns right away.
+
+        Returns:
+            bool: False if the source could not be opened, True otherwise.
+        """
+        if self._stop.is_set():
+            return True
+        self.capture, live = open_source(self.source)
+        if not self.capture.isOpened():
+            print("Error opening video capture")
+            return False
+
+        drop_oldest = live if self.drop_oldest is None else self.drop_oldest
+        self.frames = DropOldestQueue(self.queue_size, drop_oldest, 'frames')
+        self.results = DropOldestQueue(self.queue_size, False, 'results')
+        for queue in (self.frames, self.results):
+            METRICS.gauge('queue_depth', queue.__len__, queue=queue.name)
+
+        threads = [threading.Thread(target=self._capture_loop, name='capture', daemon=True),
+                   threading.Thread(target=self._process_loop, name='process', daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while not self._stop.is_set():
+                item = self.results.get()
+                if item is END_OF_STREAM:
+                    break
+                frame, result = item
+                with METRICS.timer('render'):
+                    if self.render(frame, result) is False:
+                        break
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+            self.capture.release()
+            for queue in (self.frames, self.results):
+                METRICS.remove_gauge('queue_depth', queue=queue.name)
+
+        if self._error is not None:
+            raise self._error
+        return True
+
+
+'''A class that reads several sources on their own threads and processes their newest frames in batches.'''
+class MultiSourcePipeline():
+    def __init__(self, sources, process, render, queue_size=1, drop_oldest=None, batch_timeout=0.005):
+        """
+        Initialize the pipeline.
+
+        Args:
+            sources (dict): The frame source of every camera ID, see open_source.
+            process (callable): Called as process(batch) on the processing thread, where batch is a list
+                of (camera_id, frame) with the newest frame of every camera that has one. It returns
+                one result per frame.
+            render (callable): Called as render(camera_id, frame, result) on the thread that calls run.
+                Returning False stops the pipeline.
+            queue_size (int): Number of frames each camera queue can hold.
+            drop_oldest (bool): Whether full camera queues drop their oldest frame. Defaults to True for
+                live sources and False for recorded ones. Processed results are never dropped, render
+                sees every one of them, so that changes render reacts to are not lost.
+            batch_timeout (float): Seconds to wait at most after the first frame arrives for the other
+                cameras to deliver theirs, so that they end up in the same batch. A batch that is
+                complete is processed right away.
+        """
+        self.sources = sources
+        self.process = process
+        self.render = render
+        self.queue_size = queue_size
+        self.drop_oldest = drop_oldest
+        self.batch_timeout = batch_timeout
+        self.captures = {}
+        self.frames = {}
+        self.results = None
+        self.batches = 0
+        self.frames_processed = 0
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._error = None
+
+    @property
+    def dropped_frames(self):
+        """The number of frames that were thrown away because a later stage was busy."""
+        dropped = sum(queue.dropped for queue in self.frames.values())
+        if self.results is not None:
+            dropped += self.results.dropped
+        return dropped
+
+    def stop(self):
+        """
+        Ask the pipeline to stop. Safe to call from any thread.
+        """
+        self._stop.set()
+        self._ready.set()
+        for queue in list(self.frames.values()) + [self.results]:
+            if queue is not None:
+                queue.close()
+
+    def _capture_loop(self, camera_id):
+        """
+        Read the frames of one camera as fast as it delivers them.
+        """
+        capture = self.captures[camera_id]
+        queue = self.frames[camera_id]
+        try:
+            while not self._stop.is_set():
+                with METRICS.timer('capture'):
+                    ret, frame = capture.read()
+                if not ret:
+                    break
+                if not queue.put(frame):
+                    break
+                self._ready.set()
+        finally:
+            queue.put(END_OF_STREAM, force=True)
+            self._ready.set()
+
+    def _collect(self, ended):
+        """
+        Wait for frames and take the oldest queued frame of every camera that has one.
+
+        Returns:
+            List: The batch of (camera_id, frame), empty if nothing arrived yet.
+        """
+        self._ready.wait(0.1)
+        deadline = time.monotonic() + self.batch_timeout
+        while not self._stop.is_set():
+            # Cleared before looking at the queues, so a frame arriving after the look wakes the wait
+            self._ready.clear()
+            waiting = sum(1 for camera_id, queue in self.frames.items() if camera_id not in ended and not len(queue))
+            timeout = deadline - time.monotonic()
+            # Nothing to wait for if the batch is complete, or empty because no frame arrived yet
+            if not waiting or waiting == len(self.frames) - len(ended) or timeout <= 0:
+                break
+            self._ready.wait(timeout)
+
+        batch = []
+        for camera_id, queue in self.frames.items():
+            if camera_id in ended or not len(queue):
+                continue
+            frame = queue.get(timeout=0)
+            if frame is END_OF_STREAM:
+                ended.add(camera_id)
+            else:
+                batch.append((camera_id, frame))
+        return batch
+
+    def _process_loop(self):
+        """
+        Process the cameras' frames in batches until every source has ended.
+        """
+        ended = set()
+        try:
+            while not self._stop.is_set() and len(ended) < len(self.frames):
+                batch = self._collect(ended)
+                if not batch:
+                    continue
+                with METRICS.timer('process'):
+                    results = self.process(batch)
+                self.batches += 1
+                self.frames_processed += len(batch)
+                for (camera_id, frame), result in zip(batch, results):
+                    if not self.results.put((camera_id, frame, result)):
+                        return
+        except Exception as e:
+            self._error = e
+        finally:
+            self.results.put(END_OF_STREAM, force=True)
+
+    def run(self):
+        """
+        Run the pipeline until every source ends, render returns False or stop is called.
+        Rendering happens on the calling thread because OpenCV windows have to stay on one thread.
+        A pipeline runs once, if stop was called before it returns right away.
+
+        Returns:
+            bool: False if no source could be opened, True otherwise.
+        """
+        if self._stop.is_set():
+            return True
+        for camera_id, source in self.sources.items():
+            capture, live = open_source(source)
+            if not capture.isOpened():
+                print(f"Error opening video capture for camera {camera_id}")
+                continue
+            drop_oldest = live if self.drop_oldest is None else self.drop_oldest
+            self.captures[camera_id] = capture
+            name = 'frames' if camera_id is None else f'frames_{camera_id}'
+            self.frames[camera_id] = DropOldestQueue(self.queue_size, drop_oldest, name)
+        if not self.captures:
+            return False
+
+        self.results = DropOldestQueue(max(self.queue_size, len(self.captures)), False, 'results')
+        queues = list(self.frames.values()) + [self.results]
+        for queue in queues:
+            METRICS.gauge('queue_depth', queue.__len__, queue=queue.name)
+
+        threads = [threading.Thread(target=self._capture_loop, args=(camera_id,), name=f'capture-{camera_id}',
+                                    daemon=True) for camera_id in self.captures]
+        threads.append(threading.Thread(target=self._process_loop, name='process', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while not self._stop.is_set():
+                item = self.results.get()
+                if item is END_OF_STREAM:
+                    break
+                camera_id, frame, result = item
+                with METRICS.timer('render'):
+                    if self.render(camera_id, frame, result) is False:
+                        break
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+            for capture in self.captures.values():
+                capture.release()
+            for queue in queues:
+                METRICS.remove_gauge('queue_depth', queue=queue.name)
+
+        if self._error is not None:
+            raise self._error
+        return True
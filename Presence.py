@@ -0,0 +1,189 @@
+'''A debounced presence state machine that turns per-frame recognitions into entry and exit events.'''
+import time
+import collections
+
+# The vote of a match right at the tolerance, so that every genuine match counts towards an entry
+MIN_WEIGHT = 0.5
+
+
+'''The presence state of one identity.'''
+class Identity():
+    def __init__(self, name):
+        self.name = name
+        self.present = False
+        self.votes = collections.deque()
+        self.last_seen_frame = None
+        self.last_seen_time = None
+
+    def __repr__(self):
+        return f"Identity({self.name!r}, present={self.present})"
+
+
+'''A class that decides who entered and who left with hysteresis, so that one missed or
+misrecognized frame does not produce an exit followed by an entry.'''
+class PresenceFilter():
+    def __init__(self, exit_frames=10, exit_seconds=None, entry_votes=1.5, entry_window=10, tolerance=0.6,
+                 clock=time.monotonic):
+        """
+        Initialize the filter.
+
+        Args:
+            exit_frames (int): Consecutive frames without the identity before it exits. None only uses exit_seconds.
+                These are the frames update is called with, so frames the camera delivered while processing
+                was busy do not count. Use exit_seconds for a bound in time.
+            exit_seconds (float): Seconds without the identity before it exits. None only uses exit_frames.
+                With both set, whichever is reached first triggers the exit.
+            entry_votes (float): Votes an identity needs within entry_window frames before it enters. Every
+                frame it is recognized in adds a vote between MIN_WEIGHT and 1, the closer the match the larger.
+                At most entry_window * MIN_WEIGHT, so that a weak but genuine match still enters.
+            entry_window (int): Number of most recent frames the votes are counted over.
+            tolerance (float): The matching tolerance. A match at this distance adds MIN_WEIGHT, an exact one
+                a full vote.
+            clock (callable): Returns the current time in seconds when update is not given a timestamp.
+        """
+        if exit_frames is None and exit_seconds is None:
+            raise ValueError("exit_frames and exit_seconds can not both be None")
+        if entry_votes > entry_window * MIN_WEIGHT:
+            raise ValueError(f"entry_votes {entry_votes} can not be reached by matches at the tolerance, "
+                             f"use at most {entry_window * MIN_WEIGHT}")
+        self.exit_frames = exit_frames
+        self.exit_seconds = exit_seconds
+        self.entry_votes = entry_votes
+        self.entry_window = entry_window
+        self.tolerance = tolerance
+        self.clock = clock
+        self.identities = {}
+        self.frame_index = 0
+
+    def weight(self, distance):
+        """
+        Get the vote of a recognition.
+
+        Args:
+            distance (float): The distance to the matched known face, None if it is not known.
+
+        Returns:
+            float: 1 for an exact match falling to MIN_WEIGHT at the tolerance. Recognitions without a distance
+            get a full vote.
+        """
+        if distance is None:
+            return 1.0
+        closeness = min(max(1.0 - float(distance) / self.tolerance, 0.0), 1.0)
+        return MIN_WEIGHT + (1.0 - MIN_WEIGHT) * closeness
+
+    def _absent(self, identity, now):
+        if self.exit_frames is not None and self.frame_index - identity.last_seen_frame >= self.exit_frames:
+            return True
+        return self.exit_seconds is not None and now - identity.last_seen_time >= self.exit_seconds
+
+    def update(self, observations, timestamp=None):
+        """
+        Advance the filter by one frame.
+
+        Args:
+            observations (dict): The distance of every name recognized in the frame. "unknown" is ignored.
+            timestamp (float): The time of the frame in seconds. Defaults to the clock.
+
+        Returns:
+            Tuple: The set of names that entered with this frame, and a dictionary of the names that exited
+            with it and the time they were last seen, which is when they actually left.
+        """
+        self.frame_index += 1
+        now = self.clock() if timestamp is None else timestamp
+        entered = set()
+        exited = {}
+
+        for name, distance in observations.items():
+            if name is None or name == "unknown":
+                continue
+            identity = self.identities.get(name)
+            if identity is None:
+                identity = self.identities[name] = Identity(name)
+            identity.last_seen_frame = self.frame_index
+            identity.last_seen_time = now
+            if not identity.present:
+                identity.votes.append((self.frame_index, self.weight(distance)))
+
+        for name, identity in list(self.identities.items()):
+            if identity.present:
+                if self._absent(identity, now):
+                    identity.present = False
+                    exited[name] = identity.last_seen_time
+                    del self.identities[name]
+                continue
+
+            # Only the votes of the last entry_window frames count
+            while identity.votes and identity.votes[0][0] <= self.frame_index - self.entry_window:
+                identity.votes.popleft()
+            if not identity.votes:
+                del self.identities[name]
+            elif sum(weight for _, weight in identity.votes) >= self.entry_votes:
+                identity.present = True
+                identity.votes.clear()
+                entered.add(name)
+
+        return entered, exited
+
+    def present(self):
+        """
+        Get the identities that entered and have not exited yet.
+
+        Returns:
+            set: Their names.
+        """
+        return set(name for name, identity in self.identities.items() if identity.present)
+
+    def flush(self):
+        """
+        Exit everyone still present, for example when the stream ends.
+
+        Returns:
+            dict: The names that exited and the time they were last seen.
+        """
+        exited = {name: identity.last_seen_time for name, identity in self.identities.items() if identity.present}
+        self.identities = {}
+        return exited
+
+
+'''The unfiltered behaviour the filter replaces: every change between two frames is an event.'''
+class ImmediatePresence():
+    def __init__(self, clock=time.monotonic):
+        self.names = set()
+        self.frame_index = 0
+        self.clock = clock
+        self.last_time = None
+
+    def update(self, observations, timestamp=None):
+        self.frame_index += 1
+        now = self.clock() if timestamp is None else timestamp
+        names = set(name for name in observations if name is not None and name != "unknown")
+        entered = names - self.names
+        exited = {name: self.last_time for name in self.names - names}
+        self.names = names
+        self.last_time = now
+        return entered, exited
+
+    def present(self):
+        return set(self.names)
+
+    def flush(self):
+        exited = {name: self.last_time for name in self.names}
+        self.names = set()
+        return exited
+
+
+def track_observations(tracks):
+    """
+    Collect what a frame's tracks say about who is there.
+
+    Args:
+        tracks (list): The tracks seen in the frame, see FaceTracker.update.
+
+    Returns:
+        dict: The closest distance of every recognized name, the input of PresenceFilter.update.
+    """
+    observations = {}
+    for track in tracks:
+        if track.name is not None:
+            observations[track.name] = min(track.distance, observations.get(track.name, track.distance))
+    return observations
@@ -0,0 +1,210 @@
+'''An embedded SQLite storage backend for single kiosk deployments and for running without a database server.'''
+import sqlite3
+import datetime
+from Database import StorageBackend, ATTENDANCE_TABLE, EVENTS_TABLE, SUMMARY_TABLE
+
+# Counts the changes of every table whose changes are not tracked otherwise, kept up to date by triggers
+VERSIONS_TABLE = "table_versions"
+
+
+def _sqlite_value(value):
+    """
+    Converts a query value to one SQLite stores the way MySQL returns it
+    :param value: the value
+    :return: dates and times as ISO strings, anything else unchanged
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+'''A cursor that takes the %s placeholders of the queries shared with MySQL.'''
+class SQLiteCursor():
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, query, values=None):
+        return self.cursor.execute(query.replace('%s', '?'), [_sqlite_value(value) for value in values or ()])
+
+    def executemany(self, query, rows):
+        return self.cursor.executemany(query.replace('%s', '?'),
+                                       [[_sqlite_value(value) for value in row] for row in rows])
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def close(self):
+        self.cursor.close()
+
+
+'''A connection that accepts the cursor options of mysql.connector.'''
+class SQLiteConnection():
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cursor(self, prepared=False, buffered=None, **kwargs):
+        # sqlite3 caches the compiled statements itself and always reads rows on demand
+        return SQLiteCursor(self.connection.cursor())
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+
+'''The SQLite storage backend. The database is a local file in WAL mode, so writes do not wait for a network.'''
+class SQLiteDatabase(StorageBackend):
+    connection_errors = (sqlite3.InterfaceError, sqlite3.ProgrammingError)
+    show_tables_query = "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+
+    def configure_database(self, path='attendance.db', pool_size=5, use_cache=True, synchronous='NORMAL',
+                           busy_timeout=30):
+        """
+        Function that configures the database file being used
+        :param path: The database file, created if it does not exist
+        :param pool_size: Number of connections kept open. 0 opens a new connection for every query
+        :param use_cache: Serve today's attendance rows and the employee directory from memory
+        :param synchronous: SQLite's synchronous setting. NORMAL only syncs the WAL at checkpoints, a power
+                cut can lose the last commits but never corrupts the database
+        :param busy_timeout: Seconds a write waits for another connection's write to finish
+        """
+        config = {
+            'path': path,
+            'synchronous': synchronous,
+            'busy_timeout': busy_timeout
+        }
+
+        self._configure(config, pool_size, use_cache)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.config['path'], timeout=self.config['busy_timeout'],
+                                     check_same_thread=False)
+        # Readers do not block the writer and the other way around
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"PRAGMA synchronous={self.config['synchronous']}")
+        return SQLiteConnection(connection)
+
+    def _create_attendance_table(self):
+        self._execute(f'''
+            CREATE TABLE IF NOT EXISTS {ATTENDANCE_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                employee_id TEXT,
+                date TEXT NOT NULL,
+                entry_time TEXT,
+                exit_time TEXT,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (name, date)
+            )
+        ''')
+        self._execute(f"CREATE INDEX IF NOT EXISTS idx_attendance_employee_date "
+                      f"ON {ATTENDANCE_TABLE} (employee_id, date)")
+        self._execute(f"CREATE INDEX IF NOT EXISTS idx_attendance_date ON {ATTENDANCE_TABLE} (date)")
+        # SQLite has no ON UPDATE CURRENT_TIMESTAMP
+        self._execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {ATTENDANCE_TABLE}_updated_at
+            AFTER UPDATE OF entry_time, exit_time ON {ATTENDANCE_TABLE}
+            BEGIN
+                UPDATE {ATTENDANCE_TABLE} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        ''', commit=True)
+
+    def _create_event_tables(self):
+        self._execute(f'''
+            CREATE TABLE IF NOT EXISTS {EVENTS_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                camera_id TEXT NOT NULL DEFAULT '',
+                kind TEXT NOT NULL CHECK (kind IN ('entry', 'exit')),
+                ts TEXT NOT NULL,
+                UNIQUE (name, camera_id, kind, ts)
+            )
+        ''')
+        self._execute(f"CREATE INDEX IF NOT EXISTS idx_events_ts ON {EVENTS_TABLE} (ts)")
+        self._execute(f'''
+            CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
+                name TEXT NOT NULL,
+                date TEXT NOT NULL,
+                first_entry TEXT,
+                last_exit TEXT,
+                present_seconds INTEGER NOT NULL DEFAULT 0,
+                visits INTEGER NOT NULL DEFAULT 0,
+                open_since TEXT,
+                PRIMARY KEY (name, date)
+            )
+        ''')
+        self._execute(f"CREATE INDEX IF NOT EXISTS idx_daily_date ON {SUMMARY_TABLE} (date)", commit=True)
+
+    def _insert_event_query(self):
+        return f"INSERT OR IGNORE INTO {EVENTS_TABLE} (name, camera_id, kind, ts) VALUES (%s, %s, %s, %s)"
+
+    def _upsert_summary_query(self):
+        return f'''
+            INSERT INTO {SUMMARY_TABLE} (name, date, first_entry, last_exit, present_seconds, visits, open_since)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (name, date) DO UPDATE SET
+                first_entry = excluded.first_entry, last_exit = excluded.last_exit,
+                present_seconds = excluded.present_seconds, visits = excluded.visits,
+                open_since = excluded.open_since
+        '''
+
+    def _merge_day_query(self, table_name):
+        return f'''
+            INSERT INTO {ATTENDANCE_TABLE} (name, employee_id, date, entry_time, exit_time)
+            SELECT name, employee_id, %s, NULLIF(entry_time, ''), NULLIF(exit_time, '')
+            FROM {table_name}
+            WHERE name IS NOT NULL
+            ON CONFLICT (name, date) DO UPDATE SET
+                entry_time = MIN(COALESCE({ATTENDANCE_TABLE}.entry_time, excluded.entry_time),
+                                 COALESCE(excluded.entry_time, {ATTENDANCE_TABLE}.entry_time)),
+                exit_time = MAX(COALESCE({ATTENDANCE_TABLE}.exit_time, excluded.exit_time),
+                                COALESCE(excluded.exit_time, {ATTENDANCE_TABLE}.exit_time))
+        '''
+
+    def _server_now(self, cursor):
+        cursor.execute("SELECT CURRENT_TIMESTAMP")
+        return cursor.fetchall()[0][0]
+
+    def _table_update_times(self, cursor):
+        """
+        Gets a version of each table that changes whenever its rows do. SQLite does not know when a table
+        was last changed, so the day and employee tables get triggers that count their changes the first
+        time they are asked for. A counter is used instead of a time, so two changes within one second
+        are not mistaken for one
+        :param cursor: a cursor
+        :return: a dictionary from table name to its version as a string
+        """
+        cursor.execute(self.show_tables_query)
+        tables = [row[0] for row in cursor.fetchall() if row[0] != VERSIONS_TABLE]
+        # The attendance, event and summary tables are exported by their own watermarks
+        tracked = [table_name for table_name in tables
+                   if table_name not in (ATTENDANCE_TABLE, EVENTS_TABLE, SUMMARY_TABLE)]
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} "
+                       f"(table_name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        for table_name in tracked:
+            for action in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table_name}_version_{action.lower()}
+                    AFTER {action} ON {table_name}
+                    BEGIN
+                        INSERT INTO {VERSIONS_TABLE} (table_name, version) VALUES ('{table_name}', 1)
+                        ON CONFLICT (table_name) DO UPDATE SET version = version + 1;
+                    END
+                ''')
+        cursor.execute(f"SELECT table_name, version FROM {VERSIONS_TABLE}")
+        versions = dict(cursor.fetchall())
+        return {table_name: str(versions.get(table_name, 0)) if table_name in tracked else None
+                for table_name in tables}
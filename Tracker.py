@@ -0,0 +1,212 @@
+'''A lightweight IoU/centroid tracker that keeps identities attached to detections between frames.'''
+import itertools
+import numpy as np
+
+
+def _intersection(boxes_a, boxes_b):
+    """
+    Compute the intersection area of every pair of boxes along with the box areas.
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return intersection, area_a, area_b
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Compute the intersection over union of every pair of boxes.
+
+    Args:
+        boxes_a (numpy.ndarray): An (N, 4) array of boxes as x1, y1, x2, y2.
+        boxes_b (numpy.ndarray): An (M, 4) array of boxes as x1, y1, x2, y2.
+
+    Returns:
+        numpy.ndarray: An (N, M) matrix of IoU values.
+    """
+    intersection, area_a, area_b = _intersection(boxes_a, boxes_b)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+
+'''A single tracked face.'''
+class Track():
+    def __init__(self, track_id, box, frame_index):
+        """
+        Initialize the track.
+
+        Args:
+            track_id (int): The stable ID of the track.
+            box (numpy.ndarray): The box of the first detection as x1, y1, x2, y2.
+            frame_index (int): The frame the track was first seen in.
+        """
+        self.track_id = track_id
+        self.box = box
+        self.name = None
+        self.distance = None
+        self.missed = 0
+        self.first_seen = frame_index
+        self.last_recognized = None
+
+    def __repr__(self):
+        return f"Track({self.track_id}, {self.name!r})"
+
+
+'''A class that assigns stable track IDs to boxes and decides when a track needs to be recognized.'''
+class FaceTracker():
+    def __init__(self, iou_threshold=0.3, centroid_threshold=0.5, max_missed=5, retry_every=5, reverify_every=None):
+        """
+        Initialize the tracker.
+
+        Args:
+            iou_threshold (float): The minimum IoU for a detection to continue a track.
+            centroid_threshold (float): Detections that do not overlap enough still continue a track if their
+                centers are closer than this fraction of the track's box size, which catches fast movement.
+            max_missed (int): Number of frames a track survives without a detection.
+            retry_every (int): Frames to wait before trying again to recognize a track whose face
+                could not be encoded.
+            reverify_every (int): Frames after which a recognized track is recognized again.
+                None keeps the identity for the lifetime of the track.
+        """
+        self.iou_threshold = iou_threshold
+        self.centroid_threshold = centroid_threshold
+        self.max_missed = max_missed
+        self.retry_every = retry_every
+        self.reverify_every = reverify_every
+        self.tracks = []
+        self.frame_index = 0
+        self._ids = itertools.count(1)
+
+    def _match(self, boxes):
+        """
+        Greedily pair tracks and detections, best IoU first, then by centroid distance.
+
+        Returns:
+            Dictionary: The detection index for every matched track index.
+        """
+        pairs = {}
+        if not self.tracks or len(boxes) == 0:
+            return pairs
+
+        track_boxes = np.array([track.box for track in self.tracks], dtype=np.float32)
+        ious = box_iou(track_boxes, boxes)
+        used_tracks = set()
+        used_boxes = set()
+        for flat in np.argsort(-ious, axis=None):
+            t, b = np.unravel_index(flat, ious.shape)
+            if ious[t, b] < self.iou_threshold:
+                break
+            if t in used_tracks or b in used_boxes:
+                continue
+            pairs[t] = b
+            used_tracks.add(t)
+            used_boxes.add(b)
+
+        # Fall back to centroid distance for the detections that moved too far to overlap
+        track_centers = (track_boxes[:, :2] + track_boxes[:, 2:]) / 2
+        box_centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        track_sizes = np.maximum(track_boxes[:, 2] - track_boxes[:, 0], track_boxes[:, 3] - track_boxes[:, 1])
+        distances = np.linalg.norm(track_centers[:, None, :] - box_centers[None, :, :], axis=2)
+        distances = distances / np.maximum(track_sizes[:, None], 1e-9)
+        for flat in np.argsort(distances, axis=None):
+            t, b = np.unravel_index(flat, distances.shape)
+            if distances[t, b] > self.centroid_threshold:
+                break
+            if t in used_tracks or b in used_boxes:
+                continue
+            pairs[t] = b
+            used_tracks.add(t)
+            used_boxes.add(b)
+
+        return pairs
+
+    def update(self, boxes):
+        """
+        Advance the tracker by one frame.
+
+        Args:
+            boxes (list): The detections of the frame as x1, y1, x2, y2.
+
+        Returns:
+            List: The tracks that were seen in this frame.
+        """
+        self.frame_index += 1
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        pairs = self._match(boxes)
+
+        tracks = []
+        seen = []
+        for index, track in enumerate(self.tracks):
+            if index in pairs:
+                track.box = boxes[pairs[index]]
+                track.missed = 0
+                seen.append(track)
+            else:
+                track.missed += 1
+            if track.missed <= self.max_missed:
+                tracks.append(track)
+
+        matched = set(pairs.values())
+        for index, box in enumerate(boxes):
+            if index not in matched:
+                track = Track(next(self._ids), box, self.frame_index)
+                tracks.append(track)
+                seen.append(track)
+
+        self.tracks = tracks
+        return seen
+
+    def due(self, tracks=None):
+        """
+        Find the tracks that have to be recognized in this frame: new tracks, tracks that could
+        not be recognized a while ago and tracks that are due for re-verification.
+
+        Args:
+            tracks (list): The tracks to check. Defaults to every live track.
+
+        Returns:
+            List: The tracks to recognize.
+        """
+        if tracks is None:
+            tracks = self.tracks
+        due = []
+        for track in tracks:
+            if track.missed:
+                continue
+            if track.last_recognized is None:
+                due.append(track)
+            elif track.name is None or track.name == "unknown":
+                if self.frame_index - track.last_recognized >= self.retry_every:
+                    due.append(track)
+            elif self.reverify_every and self.frame_index - track.last_recognized >= self.reverify_every:
+                due.append(track)
+        return due
+
+    def identify(self, track, name, distance):
+        """
+        Attach the result of a recognition attempt to a track.
+
+        Args:
+            track (Track): The recognized track.
+            name (str): The recognized name, or None if no face could be encoded.
+            distance (float): The distance to the closest known face.
+        """
+        track.last_recognized = self.frame_index
+        if name is not None:
+            track.name = name
+            track.distance = distance
+
+    def names(self):
+        """
+        Get the identities currently present, including tracks that are only briefly missing.
+
+        Returns:
+            set: The names of every live, recognized track.
+        """
+        return set(track.name for track in self.tracks if track.name is not None)
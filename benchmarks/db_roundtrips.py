@@ -0,0 +1,161 @@
+'''Counts the database connections and round trips of one attendance event, with and without connection pooling.
+
+Runs against a local MySQL/MariaDB server when --host is given, otherwise against a SQLite
+stand-in that mimics mysql.connector and adds a configurable network latency per round trip:
+
+    python benchmarks/db_roundtrips.py --events 200 --latency-ms 1
+    python benchmarks/db_roundtrips.py --host 127.0.0.1 --user root --password secret --database facerec
+'''
+import os
+import sys
+import time
+import json
+import types
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A new connection costs the TCP handshake plus the MySQL greeting and authentication exchange
+CONNECT_ROUND_TRIPS = 3
+
+
+'''A cursor that counts every statement it sends.'''
+class CountingCursor():
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def execute(self, query, values=None):
+        self.connection.round_trip('statements')
+        if self.connection.translate:
+            query = query.replace('%s', '?')
+            values = values or ()
+        return self.cursor.execute(query, values)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+'''A connection wrapper that counts connects, statements and commits and adds latency to each of them.'''
+class CountingConnection():
+    def __init__(self, connection, stats, latency, translate):
+        self.connection = connection
+        self.stats = stats
+        self.latency = latency
+        self.translate = translate
+        self.stats['connects'] += 1
+        self.stats['round_trips'] += CONNECT_ROUND_TRIPS
+        time.sleep(CONNECT_ROUND_TRIPS * latency)
+
+    def round_trip(self, kind):
+        self.stats[kind] += 1
+        self.stats['round_trips'] += 1
+        time.sleep(self.latency)
+
+    def cursor(self, prepared=False, **kwargs):
+        if self.translate:
+            return CountingCursor(self.connection.cursor(), self)
+        return CountingCursor(self.connection.cursor(prepared=prepared, **kwargs), self)
+
+    def commit(self):
+        self.round_trip('commits')
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def ping(self, reconnect=False):
+        self.round_trip('pings')
+
+    def close(self):
+        self.connection.close()
+
+
+def install_connector(args, stats):
+    """
+    Make mysql.connector.connect hand out counting connections, backed by SQLite if no host was given.
+    """
+    latency = args.latency_ms / 1000
+
+    if args.host is None:
+        path = os.path.join(tempfile.mkdtemp(), 'attendance.db')
+        connector = types.ModuleType('mysql.connector')
+        connector.errors = types.SimpleNamespace(OperationalError=sqlite3.OperationalError,
+                                                 InterfaceError=sqlite3.InterfaceError)
+        connector.connect = lambda **config: CountingConnection(
+            sqlite3.connect(path, check_same_thread=False), stats, latency, True)
+        mysql = types.ModuleType('mysql')
+        mysql.connector = connector
+        sys.modules['mysql'] = mysql
+        sys.modules['mysql.connector'] = connector
+        return
+
+    import mysql.connector
+    connect = mysql.connector.connect
+    mysql.connector.connect = lambda **config: CountingConnection(connect(**config), stats, latency, False)
+
+
+def attendance_event(database, name, entry_time, exit_time):
+    """
+    The queries AttendanceTracker.update_times makes for one person entering and later exiting.
+    """
+    exist = database.select_from_table(name)
+    employee_info = database.select_from_table(name, 'table_employees')
+    if not exist:
+        database.insert_into_table(name, employee_info[0][1], entry_time)
+    elif exist[0][2] is None:
+        database.update_times(exist[0][0], entry_time, exist[0][3])
+
+    eexist = database.select_from_table(name)
+    database.update_times(eexist[0][0], eexist[0][2], exit_time)
+
+
+def run(database_class, args, stats, pool_size, table_date):
+    database = database_class(table_date)
+    database.configure_database(args.host or 'localhost', args.port, args.database, args.user, args.password,
+                                pool_size=pool_size)
+    database.create_table(table_date)
+    database.create_employee_table('employees')
+    for i in range(args.events):
+        database.insert_into_employee_table(f"Person {i}", str(i))
+
+    for key in stats:
+        stats[key] = 0
+    start_time = time.perf_counter()
+    for i in range(args.events):
+        attendance_event(database, f"Person {i}", "09:00:00", "17:00:00")
+    elapsed = time.perf_counter() - start_time
+    database.close()
+
+    result = {key: value / args.events for key, value in stats.items()}
+    result['ms'] = 1000 * elapsed / args.events
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=200, help="Number of attendance events to record")
+    parser.add_argument('--pool-size', type=int, default=5, help="Pool size of the pooled run")
+    parser.add_argument('--latency-ms', type=float, default=0.5, help="Simulated network latency per round trip")
+    parser.add_argument('--host', default=None, help="MySQL host, the SQLite stand-in is used if not given")
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--database', default='facerecdatabase')
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    args = parser.parse_args()
+
+    stats = {'connects': 0, 'statements': 0, 'commits': 0, 'pings': 0, 'round_trips': 0}
+    install_connector(args, stats)
+    from Database import Database
+
+    results = {
+        'before (connection per query)': run(Database, args, stats, 0, 'bench_before'),
+        f'after (pool of {args.pool_size})': run(Database, args, stats, args.pool_size, 'bench_after'),
+    }
+    print("Per attendance event:")
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,112 @@
+'''Measures memory, matching speed and accuracy of the gallery precisions against a float64 baseline.
+
+The baseline is the original representation: one float64 array per known face next to its name.
+Memory is what tracemalloc sees allocated while the gallery is built and still held afterwards,
+so it includes the name IDs and everything else the gallery keeps, not only the matrix.
+Queries are noisy copies of known encodings plus strangers, so both the identity and the
+"unknown" decision are compared:
+
+    python benchmarks/gallery_precision.py --identities 100000 --queries 500
+'''
+import os
+import sys
+import time
+import json
+import argparse
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Gallery import Gallery, ENCODING_SIZE
+
+
+def synthetic_encodings(rng, count):
+    """
+    Encodings spread like face_recognition's: 128 values of a unit-ish vector.
+    """
+    encodings = rng.normal(size=(count, ENCODING_SIZE)).astype(np.float32)
+    encodings *= 1.0 / np.sqrt(ENCODING_SIZE) / 0.85
+    return encodings
+
+
+def baseline_match(known, names, queries, tolerance):
+    """
+    The float64 matching every precision is compared with.
+    """
+    distances = np.sqrt(np.maximum((queries ** 2).sum(1)[:, None] + (known ** 2).sum(1)[None, :]
+                                   - 2 * queries @ known.T, 0))
+    closest = np.argmin(distances, axis=1)
+    best = distances[np.arange(len(queries)), closest]
+    return [names[i] if d <= tolerance else "unknown" for i, d in zip(closest, best)], best
+
+
+def allocated(build):
+    """
+    Call build and measure the memory still allocated by what it returns.
+
+    Returns:
+        Tuple: What build returned and the bytes it holds.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        built = build()
+        return built, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    known = synthetic_encodings(rng, args.identities)
+    names = [f"person_{i}" for i in range(args.identities)]
+
+    # Half the queries are known faces seen again, half are strangers
+    picked = rng.choice(args.identities, args.queries // 2, replace=False)
+    queries = np.concatenate([known[picked] + rng.normal(scale=args.noise, size=(len(picked), ENCODING_SIZE)),
+                              synthetic_encodings(rng, args.queries - len(picked))]).astype(np.float32)
+
+    known64 = known.astype(np.float64)
+    queries64 = queries.astype(np.float64)
+    # The original layout: a list of float64 arrays and a list of names
+    _, baseline_bytes = allocated(lambda: ([np.array(encoding) for encoding in known64], list(names)))
+    expected_names, expected_distances = baseline_match(known64, names, queries64, args.tolerance)
+
+    results = {}
+    for precision in ('float32', 'float16', 'int8'):
+        def build():
+            gallery = Gallery(args.tolerance, max_exemplars=0, precision=precision)
+            gallery.add(known, names)
+            return gallery
+        gallery, gallery_bytes = allocated(build)
+
+        start_time = time.perf_counter()
+        for i in range(0, len(queries), args.faces_per_frame):
+            found_names, found_distances = gallery.match(queries[i:i + args.faces_per_frame])
+        per_frame = (time.perf_counter() - start_time) / -(-len(queries) // args.faces_per_frame)
+
+        found_names, found_distances = gallery.match(queries)
+        results[precision] = {
+            'bytes': gallery_bytes,
+            'matrix_bytes': gallery.nbytes,
+            'memory_reduction_vs_float64': round(baseline_bytes / gallery_bytes, 2),
+            'ms_per_frame': round(1000 * per_frame, 3),
+            'decisions_matching_float64': float(np.mean([a == b for a, b in zip(found_names, expected_names)])),
+            'max_distance_error': float(np.max(np.abs(found_distances - expected_distances))),
+        }
+    results['float64 baseline bytes'] = baseline_bytes
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--identities', type=int, default=100000, help="Number of known faces")
+    parser.add_argument('--queries', type=int, default=400, help="Number of faces to recognize")
+    parser.add_argument('--faces-per-frame', type=int, default=4, help="Faces matched together, like one frame")
+    parser.add_argument('--noise', type=float, default=0.03, help="Spread of a known face seen again")
+    parser.add_argument('--tolerance', type=float, default=0.6)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args), indent=2))
@@ -0,0 +1,464 @@
+'''Offline benchmarks of the recognition and attendance hot paths.
+
+Every benchmark runs in its own process against synthetic data: galleries of random 128-d
+encodings, generated frames (or a recorded clip with --clip) and an SQLite database in a
+temporary directory instead of the MySQL server. Latency percentiles, throughput and the
+peak RSS of each benchmark are written as JSON:
+
+    python benchmarks/hot_paths.py --output results.json
+    python benchmarks/hot_paths.py --only gallery_match,export_to_csv --gallery-sizes 100,1000
+    python benchmarks/hot_paths.py --baseline results.json --threshold 0.2
+
+With --baseline the run fails when the p95 latency of a benchmark grew by more than the threshold.
+Benchmarks whose dependencies are not installed, for example YOLO without ultralytics, are reported as skipped.
+'''
+import os
+import sys
+import time
+import json
+import shutil
+import platform
+import argparse
+import tempfile
+import traceback
+import multiprocessing
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCHMARKS = ['gallery_match', 'recognize_faces', 'create_known_faces', 'yolo_detection', 'update_times',
+              'display_total_hours', 'export_to_csv']
+
+
+def summarize(latencies, items_per_call=1):
+    """
+    Summarize the latencies of repeated calls.
+
+    Args:
+        latencies (list): Seconds each call took.
+        items_per_call (int): Frames, faces or events handled by one call.
+
+    Returns:
+        dict: p50/p95/p99 and mean latency in milliseconds and the throughput in items per second.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        'calls': len(latencies),
+        'p50_ms': round(float(p50), 4),
+        'p95_ms': round(float(p95), 4),
+        'p99_ms': round(float(p99), 4),
+        'mean_ms': round(float(latencies.mean() * 1000), 4),
+        'throughput_per_s': round(float(items_per_call * len(latencies) / latencies.sum()), 2),
+    }
+
+
+def timed(function, repeat, warmup=1):
+    """
+    Call a function repeatedly and return the seconds every call took, after warmup calls.
+    """
+    for _ in range(warmup):
+        function()
+    latencies = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start_time)
+    return latencies
+
+
+def peak_rss():
+    """
+    The peak resident set size of this process in bytes.
+    """
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def random_encodings(rng, count):
+    """
+    Random encodings spread like the 128-d encodings of face_recognition.
+    """
+    return (rng.normal(size=(count, 128)) / np.sqrt(128) / 0.85).astype(np.float32)
+
+
+def generated_frames(count, width, height, seed=0):
+    """
+    Frames with a noisy background and a few bright face-sized blobs, in BGR like OpenCV delivers them.
+
+    Returns:
+        Tuple: The frames and for every frame the boxes of its blobs as x1, y1, x2, y2.
+    """
+    import cv2
+    rng = np.random.default_rng(seed)
+    frames = []
+    boxes = []
+    for _ in range(count):
+        frame = rng.integers(0, 80, size=(height, width, 3), dtype=np.uint8)
+        frame_boxes = []
+        for _ in range(3):
+            size = int(rng.integers(height // 8, height // 4))
+            x = int(rng.integers(0, width - size))
+            y = int(rng.integers(0, height - size))
+            cv2.ellipse(frame, (x + size // 2, y + size // 2), (size // 2, int(size * 0.6) // 2), 0, 0, 360,
+                        tuple(int(c) for c in rng.integers(120, 230, size=3)), -1)
+            frame_boxes.append([x, y, x + size, y + size])
+        frames.append(frame)
+        boxes.append(frame_boxes)
+    return frames, boxes
+
+
+def load_frames(args):
+    """
+    Read the frames of --clip, or generate them.
+    """
+    if args.clip is None:
+        return generated_frames(args.frames, args.width, args.height, args.seed)
+
+    from Pipeline import open_source
+    capture, _ = open_source(args.clip)
+    frames = []
+    while len(frames) < args.frames:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    height, width = frames[0].shape[:2]
+    # Recorded clips have no ground truth, recognize one centered box per frame
+    box = [width // 3, height // 4, 2 * width // 3, 3 * height // 4]
+    return frames, [[box] for _ in frames]
+
+
+def populate_database(path, days, people, schema='daily'):
+    """
+    Fill an SQLite database with the attendance of people over a number of days ending today.
+
+    Returns:
+        Tuple: The database and the first and last day as MMDDYYYY.
+    """
+    import datetime
+    from SQLiteDatabase import SQLiteDatabase
+
+    today = datetime.date.today()
+    first_day = today - datetime.timedelta(days=days - 1)
+    database = SQLiteDatabase(today.strftime("%m%d%Y"), schema=schema)
+    database.configure_database(path)
+    database.create_employee_table('employees')
+    for i in range(people):
+        database.insert_into_employee_table(f"person_{i}", str(i))
+
+    for day in range(days):
+        formatted_date = (first_day + datetime.timedelta(days=day)).strftime("%m%d%Y")
+        database.create_table(formatted_date)
+        events = []
+        for i in range(people):
+            events.append({'kind': 'entry', 'name': f"person_{i}", 'time': f"{8 + i % 2:02d}:{i % 60:02d}:00"})
+            events.append({'kind': 'exit', 'name': f"person_{i}", 'time': f"{16 + i % 3:02d}:{i % 60:02d}:00"})
+        database.apply_events(events)
+    return database, first_day.strftime("%m%d%Y"), today.strftime("%m%d%Y")
+
+
+def bench_gallery_match(args, workdir):
+    """
+    Gallery.match, the matching step of recognize_faces, for each gallery size.
+    """
+    from Gallery import Gallery
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    for size in args.gallery_sizes:
+        gallery = Gallery(max_exemplars=0)
+        known = random_encodings(rng, size)
+        gallery.add(known, [f"person_{i}" for i in range(size)])
+        queries = known[rng.integers(0, size, args.faces_per_frame)] + rng.normal(scale=0.02, size=(
+            args.faces_per_frame, 128)).astype(np.float32)
+        results[str(size)] = summarize(timed(lambda: gallery.match(queries), args.repeat), args.faces_per_frame)
+    return results
+
+
+def bench_recognize_faces(args, workdir):
+    """
+    FaceReco.recognize_faces on full frames and inside given boxes, against a synthetic gallery.
+    """
+    import cv2
+    from FaceRec import FaceReco
+
+    rng = np.random.default_rng(args.seed)
+    facerecog = FaceReco(workdir, workdir, cache_path=None)
+    size = args.recognition_gallery
+    facerecog.gallery.add(random_encodings(rng, size), [f"person_{i}" for i in range(size)])
+    frames, boxes = load_frames(args)
+    rgb_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+
+    position = [0]
+
+    def next_frame():
+        index = position[0] % len(rgb_frames)
+        position[0] += 1
+        return index
+
+    def full_frame():
+        facerecog.recognize_faces(rgb_frames[next_frame()])
+
+    def in_boxes():
+        index = next_frame()
+        facerecog.recognize_faces(rgb_frames[index], boxes[index])
+
+    return {
+        'full_frame': summarize(timed(full_frame, args.repeat)),
+        'boxes': summarize(timed(in_boxes, args.repeat)),
+        'gallery_size': size,
+    }
+
+
+def bench_create_known_faces(args, workdir):
+    """
+    FaceReco.create_known_faces on generated images, with an empty and with a filled encoding cache.
+    """
+    import cv2
+    from FaceRec import FaceReco
+
+    faces_path = os.path.join(workdir, 'KnownFaces')
+    names_path = os.path.join(workdir, 'KnownNames')
+    cache_path = os.path.join(workdir, 'EncodingCache')
+    os.makedirs(faces_path)
+    os.makedirs(names_path)
+    frames, _ = generated_frames(args.images, 320, 240, args.seed)
+    for i, frame in enumerate(frames):
+        cv2.imwrite(os.path.join(faces_path, f"person_{i}.jpg"), frame)
+        with open(os.path.join(names_path, f"person_{i}.txt"), 'w') as f:
+            f.write(f"person_{i}")
+
+    def cold():
+        shutil.rmtree(cache_path, ignore_errors=True)
+        FaceReco(faces_path, names_path, cache_path=cache_path).create_known_faces()
+
+    def warm():
+        FaceReco(faces_path, names_path, cache_path=cache_path).create_known_faces()
+
+    return {
+        'cold': summarize(timed(cold, max(1, args.repeat // 20), warmup=0), args.images),
+        'warm': summarize(timed(warm, max(1, args.repeat // 5)), args.images),
+        'images': args.images,
+    }
+
+
+def bench_yolo_detection(args, workdir):
+    """
+    The batched YOLO call of AttendanceTracker.detect_faces_multi on downscaled frames.
+    """
+    from ultralytics import YOLO
+    from FaceRec import downscale_frame
+
+    model = YOLO(args.model)
+    frames, _ = load_frames(args)
+    results = {}
+    for batch_size in (1, 4):
+        position = [0]
+
+        def detect():
+            batch = [frames[(position[0] + i) % len(frames)] for i in range(batch_size)]
+            position[0] += batch_size
+            model([downscale_frame(frame, args.detection_scale)[0] for frame in batch], verbose=False)
+
+        results[f"batch_{batch_size}"] = summarize(timed(detect, args.repeat, warmup=2), batch_size)
+    return results
+
+
+def bench_update_times(args, workdir):
+    """
+    AttendanceTracker.update_times as the camera loop sees it, and how fast the background writer commits.
+    """
+    import datetime
+    from AttendanceTracker import AttendanceTracker
+    from AttendanceWriter import AttendanceWriter
+
+    database, _, _ = populate_database(os.path.join(workdir, 'attendance.db'), 1, args.people)
+    database.create_table(datetime.date.today().strftime("%m%d%Y"))
+    database.load_cache()
+    # Only the database and the writer are needed, not the models
+    tracker = AttendanceTracker.__new__(AttendanceTracker)
+    tracker.database = database
+    tracker.writer = AttendanceWriter(database, spool_path=os.path.join(workdir, 'spool.jsonl'))
+    tracker.writer.start()
+
+    position = [0]
+
+    def event():
+        i = position[0] % args.people
+        position[0] += 1
+        tracker.update_times([f"person_{i}", "09:00:00"], [f"person_{(i + 1) % args.people}", "17:00:00"])
+
+    latencies = timed(event, args.repeat * 10, warmup=0)
+    start_time = time.perf_counter()
+    tracker.writer.stop(timeout=60)
+    drain = time.perf_counter() - start_time
+    database.close()
+    return {
+        'submit': summarize(latencies, 2),
+        'committed_events': tracker.writer.committed,
+        'drain_s': round(drain, 4),
+    }
+
+
+def bench_display_total_hours(args, workdir):
+    """
+    DataVis.display_total_hours over the whole populated date range, rendered off screen.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    from DataVisualization import DataVis
+
+    results = {}
+    for schema in ('daily', 'single'):
+        database, first_day, last_day = populate_database(os.path.join(workdir, f"{schema}.db"), args.days,
+                                                          args.people, schema)
+        visualization = DataVis(database)
+
+        def display():
+            visualization.display_total_hours("person_1", first_day, last_day)
+            plt.close('all')
+
+        results[schema] = summarize(timed(display, args.repeat))
+        results[f"{schema}_query_only"] = summarize(
+            timed(lambda: database.hours_between("person_1", first_day, last_day), args.repeat))
+        database.close()
+    results['days'] = args.days
+    return results
+
+
+def bench_export_to_csv(args, workdir):
+    """
+    Database.export_to_csv of the populated database, plain and gzip compressed.
+    """
+    database, _, _ = populate_database(os.path.join(workdir, 'attendance.db'), args.days, args.people)
+    current_directory = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = {}
+        for output_format in ('csv', 'csv.gz'):
+            def export():
+                os.remove(database.export_to_csv(output_format))
+            results[output_format] = summarize(timed(export, max(1, args.repeat // 10)), args.days * args.people)
+    finally:
+        os.chdir(current_directory)
+    database.close()
+    results['rows'] = args.days * args.people
+    return results
+
+
+def run_benchmark(name, args, results):
+    """
+    Run one benchmark in a fresh process, so that its peak RSS is its own.
+    """
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    try:
+        # Keep the prints of the code under test out of the JSON
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            result = globals()[f"bench_{name}"](args, workdir)
+            sys.stdout = sys.__stdout__
+        result['peak_rss_mb'] = round(peak_rss() / 2 ** 20, 1)
+    except ImportError as e:
+        result = {'skipped': f"missing dependency: {e}"}
+    except Exception:
+        result = {'error': traceback.format_exc()}
+    finally:
+        sys.stdout = sys.__stdout__
+        shutil.rmtree(workdir, ignore_errors=True)
+    results[name] = result
+
+
+def p95_values(result, prefix=""):
+    """
+    Flatten the p95 latencies of a benchmark result into {name: p95}.
+    """
+    values = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            values.update(p95_values(value, f"{prefix}{key}."))
+        elif key == 'p95_ms':
+            values[prefix.rstrip('.')] = value
+    return values
+
+
+def compare(report, baseline, threshold):
+    """
+    Find the benchmarks whose p95 latency grew by more than the threshold.
+
+    Returns:
+        list: Descriptions of the regressions.
+    """
+    regressions = []
+    for name, result in report['benchmarks'].items():
+        old = p95_values(baseline.get('benchmarks', {}).get(name, {}))
+        for key, p95 in p95_values(result).items():
+            if key in old and old[key] > 0 and p95 > old[key] * (1 + threshold):
+                regressions.append(f"{name}.{key}: p95 {old[key]:.3f} ms -> {p95:.3f} ms")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help="Comma separated benchmarks to run")
+    parser.add_argument('--repeat', type=int, default=100, help="Timed calls per measurement")
+    parser.add_argument('--gallery-sizes', default='100,1000,10000,100000', help="Gallery sizes to match against")
+    parser.add_argument('--faces-per-frame', type=int, default=4, help="Faces matched together")
+    parser.add_argument('--recognition-gallery', type=int, default=1000, help="Gallery size for recognize_faces")
+    parser.add_argument('--images', type=int, default=50, help="Known face images for create_known_faces")
+    parser.add_argument('--clip', default=None, help="Video file or image directory to use instead of generated frames")
+    parser.add_argument('--frames', type=int, default=30, help="Frames generated or read from the clip")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--model', default='yolov8n.pt', help="YOLO weights for yolo_detection")
+    parser.add_argument('--detection-scale', type=float, default=0.5)
+    parser.add_argument('--days', type=int, default=90, help="Days of attendance in the database")
+    parser.add_argument('--people', type=int, default=200, help="People in the database")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="File to write the JSON report to")
+    parser.add_argument('--baseline', default=None, help="Earlier JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed relative p95 growth")
+    args = parser.parse_args()
+    args.gallery_sizes = [int(size) for size in args.gallery_sizes.split(',')]
+
+    names = [name for name in args.only.split(',') if name]
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks {', '.join(sorted(unknown))}")
+
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager:
+        results = manager.dict()
+        for name in names:
+            process = context.Process(target=run_benchmark, args=(name, args, results))
+            process.start()
+            process.join()
+            print(f"{name}: done", file=sys.stderr)
+        benchmarks = {name: results.get(name, {'error': 'benchmark process died'}) for name in names}
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        },
+        'benchmarks': benchmarks,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,199 @@
+'''Replays recorded recognitions through the presence filter and measures accuracy and database writes.
+
+Every entry and exit is one update_times call, so the number of events is the number of writes.
+The unfiltered baseline turns every change between two frames into an event. Each filter setting
+is scored against ground truth intervals:
+
+    presence_iou  identity-frames both agree someone is present / frames either says they are
+    events        entry and exit events, the writes to the database
+    true_events   entries and exits in the ground truth
+    churn         events / true_events, 1.0 is perfect
+
+Recognitions come from one of three places:
+
+    # A recorded clip, recognized with the known faces and saved for later runs
+    python benchmarks/presence_replay.py --clip clip.mp4 --truth truth.csv --save-observations clip.jsonl
+    # Recognitions saved earlier, one JSON line per frame: {"t": 1.5, "observations": {"alice": 0.41}}
+    python benchmarks/presence_replay.py --observations clip.jsonl --truth truth.csv
+    # Generated people walking in and out, with missed and misrecognized frames
+    python benchmarks/presence_replay.py --synthetic
+
+The ground truth is a CSV of name,start,end with the seconds each person was in view.
+'''
+import os
+import sys
+import csv
+import json
+import argparse
+import itertools
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Presence import PresenceFilter, ImmediatePresence, track_observations
+
+
+def record_clip(args):
+    """
+    Recognize every frame of a clip the way the recognition loop does: detect, track and only
+    recognize the tracks that are due.
+    """
+    import cv2
+    from FaceRec import FaceReco, css_to_xyxy
+    from Pipeline import open_source
+    from Tracker import FaceTracker
+
+    facerecog = FaceReco(args.known_faces, args.known_names, tolerance=args.tolerance)
+    facerecog.create_known_faces()
+    tracker = FaceTracker(reverify_every=args.reverify_every)
+    capture, _ = open_source(args.clip)
+    fps = capture.get(cv2.CAP_PROP_FPS) if hasattr(capture, 'get') else 0
+    fps = fps or args.fps
+
+    frames = []
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        tracks = tracker.update([css_to_xyxy(location) for location in facerecog._locate_faces(rgb_frame)])
+        due = tracker.due(tracks)
+        for track, face in zip(due, facerecog.recognize_faces(rgb_frame, [track.box for track in due])):
+            tracker.identify(track, face[0], face[2])
+        frames.append({'t': len(frames) / fps, 'observations': track_observations(tracks)})
+    capture.release()
+    return frames
+
+
+def load_observations(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_truth(path):
+    truth = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            truth.setdefault(row['name'], []).append((float(row['start']), float(row['end'])))
+    return truth
+
+
+def synthetic(args):
+    """
+    People entering and leaving a camera at random, seen by a recognizer that misses faces and
+    confuses people now and then. Misses come in short bursts, like a head turning away.
+    """
+    rng = np.random.default_rng(args.seed)
+    names = [f"person_{i}" for i in range(args.people)]
+    duration = args.frames / args.fps
+    truth = {}
+    for name in names:
+        start = rng.uniform(0, duration * 0.3)
+        while start < duration:
+            end = min(start + rng.uniform(10, duration * 0.4), duration)
+            truth.setdefault(name, []).append((start, end))
+            start = end + rng.uniform(5, duration * 0.3)
+
+    frames = []
+    missing = {}
+    for index in range(args.frames):
+        t = index / args.fps
+        observations = {}
+        for name in names:
+            if not any(start <= t < end for start, end in truth.get(name, [])):
+                continue
+            if missing.get(name, 0) > 0:
+                missing[name] -= 1
+                continue
+            if rng.random() < args.miss_rate:
+                missing[name] = rng.integers(0, args.max_miss_burst)
+                continue
+            if rng.random() < args.confusion_rate:
+                # Mistaken for someone else with a weak match
+                observations[names[rng.integers(len(names))]] = rng.uniform(0.45, 0.6)
+            else:
+                # Genuine matches anywhere up to the tolerance, weak ones included
+                observations[name] = rng.uniform(0.25, args.tolerance)
+        frames.append({'t': t, 'observations': observations})
+    return frames, truth
+
+
+def score(frames, truth, presence):
+    """
+    Run the frames through a presence strategy and compare it with the ground truth.
+    """
+    events = 0
+    agree = 0
+    either = 0
+    for frame in frames:
+        entered, exited = presence.update(frame['observations'], frame['t'])
+        events += len(entered) + len(exited)
+        present = presence.present()
+        actual = set(name for name, intervals in truth.items()
+                     if any(start <= frame['t'] < end for start, end in intervals))
+        agree += len(present & actual)
+        either += len(present | actual)
+    # Whoever is still present leaves when the recording ends
+    events += len(presence.flush())
+    true_events = sum(2 * len(intervals) for intervals in truth.values())
+    return {
+        'presence_iou': round(agree / either, 4) if either else 1.0,
+        'events': events,
+        'true_events': true_events,
+        'churn': round(events / true_events, 2) if true_events else None,
+    }
+
+
+def run(args):
+    if args.synthetic:
+        frames, truth = synthetic(args)
+    else:
+        frames = load_observations(args.observations) if args.observations else record_clip(args)
+        truth = load_truth(args.truth) if args.truth else {}
+        if args.save_observations:
+            with open(args.save_observations, 'w', encoding='utf-8') as f:
+                for frame in frames:
+                    f.write(json.dumps(frame) + '\n')
+
+    results = {'frames': len(frames), 'unfiltered': score(frames, truth, ImmediatePresence())}
+    for exit_frames, entry_votes in itertools.product(args.exit_frames, args.entry_votes):
+        presence = PresenceFilter(exit_frames=exit_frames, exit_seconds=args.exit_seconds, entry_votes=entry_votes,
+                                  entry_window=args.entry_window, tolerance=args.tolerance)
+        result = score(frames, truth, presence)
+        unfiltered = results['unfiltered']['events']
+        result['write_reduction'] = round(1 - result['events'] / unfiltered, 4) if unfiltered else None
+        results[f"exit_frames={exit_frames},entry_votes={entry_votes}"] = result
+    return results
+
+
+def number_list(cast):
+    return lambda value: [cast(item) for item in value.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clip', default=None, help="Video file or image directory to recognize")
+    parser.add_argument('--observations', default=None, help="JSON lines of recognitions saved by --save-observations")
+    parser.add_argument('--save-observations', default=None, help="Write the recognitions of --clip here")
+    parser.add_argument('--truth', default=None, help="CSV of name,start,end in seconds")
+    parser.add_argument('--synthetic', action='store_true', help="Generate people and recognitions instead")
+    parser.add_argument('--known-faces', default='KnownFaces')
+    parser.add_argument('--known-names', default='KnownNames')
+    parser.add_argument('--reverify-every', type=int, default=None)
+    parser.add_argument('--fps', type=float, default=10.0, help="Frame rate of image directories and generated frames")
+    parser.add_argument('--exit-frames', type=number_list(int), default=[5, 10, 20])
+    parser.add_argument('--exit-seconds', type=float, default=None)
+    parser.add_argument('--entry-votes', type=number_list(float), default=[1.0, 1.5, 2.5])
+    parser.add_argument('--entry-window', type=int, default=10)
+    parser.add_argument('--tolerance', type=float, default=0.6)
+    parser.add_argument('--frames', type=int, default=6000, help="Generated frames")
+    parser.add_argument('--people', type=int, default=8, help="Generated people")
+    parser.add_argument('--miss-rate', type=float, default=0.05, help="Chance a present face starts being missed")
+    parser.add_argument('--max-miss-burst', type=int, default=6, help="Longest run of missed frames")
+    parser.add_argument('--confusion-rate', type=float, default=0.02, help="Chance a face is taken for someone else")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if not (args.synthetic or args.clip or args.observations):
+        parser.error("one of --clip, --observations or --synthetic is required")
+    print(json.dumps(run(args), indent=2))
@@ -0,0 +1,18 @@
+'''Bulk enrollment of a directory full of known face images across all CPU cores.'''
+import argparse
+from FaceRec import FaceReco
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Encode every known face image in parallel.")
+    parser.add_argument('--known-faces', default='KnownFaces', help="Directory containing the known face images")
+    parser.add_argument('--known-names', default='KnownNames', help="Directory containing the known names text files")
+    parser.add_argument('--cache', default='EncodingCache', help="Directory of the encoding cache")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: all cores)")
+    parser.add_argument('--chunksize', type=int, default=1, help="Images handed to a worker at a time")
+    args = parser.parse_args()
+
+    facerecog = FaceReco(args.known_faces, args.known_names, cache_path=args.cache)
+    encoded, elapsed = facerecog.bulk_enroll(args.workers, chunksize=args.chunksize)
+
+    print(f"Encoded {encoded} new images in {elapsed:.1f}s, {len(facerecog.gallery)} known faces in total.")
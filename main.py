@@ -2,8 +2,14 @@ from FaceRec import FaceReco
 from Database import Database
 from AttendanceTracker import AttendanceTracker
 from GUI import GUI
+from Metrics import METRICS
 import datetime
+import os
 
+# Serve per-stage latency metrics at http://127.0.0.1:<port>/metrics if a port is set
+metrics_port = os.environ.get("FACEREC_METRICS_PORT")
+if metrics_port:
+    METRICS.serve(int(metrics_port))
 
 # Get today's date
 today = datetime.date.today()
@@ -21,6 +27,7 @@ password = input("Enter the password: ")
 data.configure_database(host, port, database, user, password)
 
 data.create_table(formatted_date)
+data.load_cache()
 
 # Initialize the face recognition
 known_faces_path = 'KnownFaces'
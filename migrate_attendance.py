@@ -0,0 +1,22 @@
+'''Moves the per-day attendance tables into the single partitioned attendance table.'''
+import argparse
+import datetime
+from Database import Database
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import every table_MMDDYYYY table into the attendance table.")
+    parser.add_argument('--host', default='localhost', help="IP address or hostname of the database server")
+    parser.add_argument('--port', type=int, default=3306, help="Port number of the database server")
+    parser.add_argument('--database', default='facerecdatabase', help="Name of the database")
+    parser.add_argument('--user', default='root', help="Username for authentication")
+    parser.add_argument('--password', default='', help="Password for the username")
+    parser.add_argument('--drop', action='store_true', help="Drop each day table after it was imported")
+    args = parser.parse_args()
+
+    data = Database(datetime.date.today().strftime("%m%d%Y"), schema='single')
+    data.configure_database(args.host, args.port, args.database, args.user, args.password)
+    imported = data.migrate_daily_tables(drop=args.drop)
+    data.close()
+
+    print(f"Imported {imported} day tables into the attendance table.")
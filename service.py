@@ -0,0 +1,289 @@
+'''Headless attendance service for machines without a screen, controlled over a local HTTP API.'''
+import os
+import json
+import time
+import signal
+import argparse
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from FaceRec import FaceReco
+from Database import Database
+from SQLiteDatabase import SQLiteDatabase
+from AttendanceTracker import AttendanceTracker
+from Metrics import METRICS
+
+# Settings used when neither the config file nor the environment sets them
+DEFAULTS = {
+    'storage': 'mysql',
+    'host': 'localhost',
+    'port': 3306,
+    'database': 'facerecdatabase',
+    'user': 'root',
+    'password': '',
+    'sqlite_path': 'attendance.db',
+    'schema': 'daily',
+    'sources': [0],
+    'known_faces': 'KnownFaces',
+    'known_names': 'KnownNames',
+    'model_path': 'yolov8n.pt',
+    'face_model': False,
+    'detection_scale': 1.0,
+    'reverify_every': None,
+    'control_host': '127.0.0.1',
+    'control_port': 8080,
+    'metrics': True,
+    'autostart': True,
+}
+
+# Prefix of the environment variables that override the settings, for example FACEREC_SOURCES
+ENV_PREFIX = "FACEREC_"
+
+
+def load_config(path=None, environ=None):
+    """
+    Load the settings. Values from the config file override the defaults, environment variables
+    override both.
+
+    Args:
+        path (str): A JSON file of settings. None only uses the defaults and the environment.
+        environ (dict): The environment to read, os.environ if None.
+
+    Returns:
+        dict: The settings. Environment values of settings that are not strings by default are
+        parsed as JSON where possible, so that FACEREC_SOURCES='[0, "rtsp://cam2/stream"]' or
+        FACEREC_PORT=3307 keep their types. String settings such as FACEREC_PASSWORD=12345 are
+        taken as they are.
+    """
+    environ = os.environ if environ is None else environ
+    config = dict(DEFAULTS)
+    if path is not None:
+        with open(path, encoding='utf-8') as f:
+            config.update(json.load(f))
+    for key in DEFAULTS:
+        value = environ.get(ENV_PREFIX + key.upper())
+        if value is None:
+            continue
+        if isinstance(DEFAULTS[key], str):
+            config[key] = value
+            continue
+        try:
+            config[key] = json.loads(value)
+        except ValueError:
+            config[key] = value
+    return config
+
+
+def open_database(config):
+    """
+    Connect to the configured storage and prepare today's table.
+
+    Args:
+        config (dict): The settings, see load_config.
+
+    Returns:
+        StorageBackend: The connected database.
+    """
+    formatted_date = datetime.date.today().strftime("%m%d%Y")
+    if config['storage'] == 'sqlite':
+        data = SQLiteDatabase(formatted_date, config['schema'])
+        data.configure_database(config['sqlite_path'])
+    else:
+        data = Database(formatted_date, config['schema'])
+        data.configure_database(config['host'], config['port'], config['database'], config['user'],
+                                config['password'])
+    data.create_table(formatted_date)
+    data.load_cache()
+    return data
+
+
+'''A class that runs the attendance pipeline without rendering and serves the control API.'''
+class AttendanceService():
+    def __init__(self, config, database=None, tracker=None):
+        """
+        Initialize the service.
+
+        Args:
+            config (dict): The settings, see load_config.
+            database (StorageBackend): The database to use instead of opening the configured one.
+            tracker (AttendanceTracker): The tracker to use instead of building one from the settings.
+        """
+        self.config = config
+        self.database = database if database is not None else open_database(config)
+        if tracker is None:
+            facerecog = FaceReco(config['known_faces'], config['known_names'])
+            tracker = AttendanceTracker(self.database, facerecog, config['model_path'], config['face_model'],
+                                        config['detection_scale'])
+        self.tracker = tracker
+        self.started_at = time.time()
+        self.last_error = None
+        self.server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._shutdown = threading.Event()
+
+    @property
+    def running(self):
+        """Whether the attendance pipeline is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run_pipeline(self):
+        try:
+            self.tracker.detect_faces_multi(self.config['sources'], self.config['reverify_every'], display=False)
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Attendance pipeline stopped with an error: {e}")
+
+    def start(self):
+        """
+        Start the attendance pipeline on a background thread.
+
+        Returns:
+            bool: False if it was already running.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self.last_error = None
+            self.tracker.reset_stop()
+            self._thread = threading.Thread(target=self._run_pipeline, name='attendance', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """
+        Stop the attendance pipeline and wait until the remaining events are written.
+
+        Returns:
+            bool: False if it was not running.
+        """
+        with self._lock:
+            if not self.running:
+                return False
+            # The pipeline may still be loading the known faces, so keep asking until it has stopped
+            while self._thread.is_alive():
+                self.tracker.stop()
+                self._thread.join(0.5)
+            return True
+
+    def status(self):
+        """
+        Get the state of the service.
+
+        Returns:
+            dict: Whether the pipeline runs, the uptime, the last error and the tracker's status.
+        """
+        status = self.tracker.status()
+        status['running'] = self.running
+        status['uptime'] = time.time() - self.started_at
+        status['last_error'] = self.last_error
+        return status
+
+    def export(self):
+        """
+        Export the attendance data like the GUI's Download CSV button.
+
+        Returns:
+            dict: The name of the written export, None if nothing was written.
+        """
+        return {'export': self.database.export_to_csv()}
+
+    def shutdown(self):
+        """
+        Ask run to stop the service. Safe to call from any thread and from signal handlers.
+        """
+        self._shutdown.set()
+
+    def serve(self, host='127.0.0.1', port=8080):
+        """
+        Serve the control API on a background thread.
+
+            GET  /status    The state of the service as JSON
+            GET  /metrics   Per-stage latency metrics in the Prometheus text format
+            POST /start     Start the attendance pipeline
+            POST /stop      Stop the attendance pipeline
+            POST /export    Export the attendance data
+            POST /shutdown  Stop the pipeline and exit
+
+        Args:
+            host (str): The address to listen on. The default only accepts local connections.
+            port (int): The port to listen on.
+
+        Returns:
+            ThreadingHTTPServer: The running server.
+        """
+        service = self
+        actions = {'/start': lambda: {'started': service.start()},
+                   '/stop': lambda: {'stopped': service.stop()},
+                   '/export': service.export,
+                   '/shutdown': lambda: service.shutdown() or {'shutdown': True}}
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, body, content_type='application/json'):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/status':
+                    self._reply(200, service.status())
+                elif path == '/metrics':
+                    self._reply(200, METRICS.prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4')
+                else:
+                    self._reply(404, {'error': 'not found'})
+
+            def do_POST(self):
+                action = actions.get(self.path.split('?')[0])
+                if action is None:
+                    self._reply(404, {'error': 'not found'})
+                    return
+                try:
+                    self._reply(200, action())
+                except Exception as e:
+                    self._reply(500, {'error': str(e)})
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name='control-http', daemon=True).start()
+        return self.server
+
+    def run(self):
+        """
+        Run the service until SIGTERM, SIGINT or POST /shutdown, then stop the pipeline,
+        write the remaining events and close the database.
+        """
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self.shutdown())
+
+        if self.config['metrics']:
+            METRICS.enable()
+        self.serve(self.config['control_host'], self.config['control_port'])
+        print(f"Control API listening on http://{self.config['control_host']}:{self.config['control_port']}")
+        if self.config['autostart']:
+            self.start()
+
+        # Wake up regularly so that signal handlers get to run
+        while not self._shutdown.wait(1.0):
+            pass
+
+        print("Shutting down...")
+        self.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.database.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run attendance tracking headless with a local control API.")
+    parser.add_argument('--config', default=os.environ.get(ENV_PREFIX + 'CONFIG'),
+                        help="JSON file of settings, FACEREC_* environment variables override it")
+    args = parser.parse_args()
+
+    AttendanceService(load_config(args.config)).run()